@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+
+import os
+import io
+import sys
+import json
+import socket
+import argparse
+import threading
+
+SOCKET_ENV = "ANKI_PROCESSING_SOCKET"
+
+# Largest request or response accepted, to keep a bad client from exhausting memory
+MAX_MESSAGE_BYTES = 64 << 20
+
+def default_socket_path():
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "anki_processing")
+    return os.path.join(runtime_dir, "anki_processing.sock")
+
+class _ThreadOutput(io.TextIOBase):
+    """sys.stdout replacement that sends each request thread's prints to its own buffer."""
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (buffer or self.fallback).write(text)
+
+    def flush(self):
+        buffer = getattr(self.local, 'buffer', None)
+        (buffer or self.fallback).flush()
+
+# Builds into the same output directory share archive and manifest files
+_output_locks = {}
+_output_locks_guard = threading.Lock()
+
+def _output_lock(output_dir):
+    with _output_locks_guard:
+        return _output_locks.setdefault(os.path.abspath(output_dir), threading.Lock())
+
+def op_build(input_path, output_dir, force=False, backend='genanki'):
+    """Builds the decks for input_path and returns the paths of the apkgs written.
+
+    The existing decks are archived once up front, as in build_batch, so one
+    deck's build never archives another deck written by the same request.
+    """
+    from generate_anki_from_text import expand_input_paths, prepare_batch, build_deck, NoCardsError
+    input_paths = expand_input_paths(input_path)
+    if not input_paths:
+        raise FileNotFoundError(f"File not found: {input_path}")
+    os.makedirs(output_dir, exist_ok=True)
+    built = []
+    with _output_lock(output_dir):
+        pending, _, failures = prepare_batch(input_paths, output_dir, force)
+        for path, error in failures:
+            print(f"❌ {path}: {error}")
+        for path in pending:
+            try:
+                output = build_deck(path, output_dir, force, backend, archive=False)
+            except NoCardsError:
+                print(f"❌ No valid cards found in {path}")
+                continue
+            if output:
+                built.append(output)
+    return built
+
+def op_dump(apkg_path, output_dir, cache=True):
+    from anki_unpacker import AnkiDeckUnpacker
+    from dump_apkg import unpack_and_review
+    from verify_guids import verify
+    with _output_lock(output_dir), AnkiDeckUnpacker(apkg_path, cache=cache) as unpacker:
+        unpack_and_review(apkg_path, output_dir, unpacker=unpacker)
+        print("\n--- Verifying GUIDs ---")
+        verify(os.path.join(output_dir, "cards.txt"), apkg_path, unpacker=unpacker)
+    return output_dir
+
+def op_verify(txt_path, apkg_path, verbose=False, cache=True):
+    from verify_guids import verify
+    return verify(txt_path, apkg_path, verbose, cache=cache)
+
+OPERATIONS = {
+    'build': op_build,
+    'dump': op_dump,
+    'verify': op_verify,
+}
+
+def run_operation(op, kwargs):
+    """Runs an operation and returns the response dict {ok, result | error}."""
+    try:
+        return {"ok": True, "result": OPERATIONS[op](**kwargs)}
+    except Exception as e:
+        print(f"❌ {op} failed: {e}")
+        return {"ok": False, "error": str(e) or type(e).__name__}
+
+def _send(sock, message):
+    sock.sendall(json.dumps(message).encode() + b"\n")
+
+def _receive(sock):
+    data = bytearray()
+    while not data.endswith(b"\n"):
+        chunk = sock.recv(1 << 16)
+        if not chunk:
+            break
+        data += chunk
+        if len(data) > MAX_MESSAGE_BYTES:
+            raise ValueError("Message too large")
+    return json.loads(data) if data else None
+
+def serve(socket_path):
+    """Serves requests on a Unix socket until a 'shutdown' request. One thread per request."""
+    import socketserver
+    # Import everything the operations need once, so requests start warm. genanki
+    # and zstandard are lazy imports in those modules: touch them to load them now
+    import generate_anki_from_text, dump_apkg, verify_guids, anki_unpacker
+    generate_anki_from_text.genanki.Deck
+    anki_unpacker.zstandard.ZstdDecompressor
+
+    output = _ThreadOutput(sys.stdout)
+    sys.stdout = output
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            request = _receive(self.connection)
+            if request is None:
+                return
+            op = request.get("op")
+            if op == 'ping':
+                _send(self.connection, {"ok": True, "result": os.getpid()})
+                return
+            if op == 'shutdown':
+                _send(self.connection, {"ok": True, "result": None})
+                threading.Thread(target=self.server.shutdown).start()
+                return
+            if op not in OPERATIONS:
+                _send(self.connection, {"ok": False, "error": f"Unknown operation: {op}", "output": ""})
+                return
+
+            output.local.buffer = io.StringIO()
+            try:
+                response = run_operation(op, request.get("args", {}))
+                response["output"] = output.local.buffer.getvalue()
+            finally:
+                output.local.buffer = None
+            _send(self.connection, response)
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    os.makedirs(os.path.dirname(socket_path) or ".", exist_ok=True)
+    if os.path.exists(socket_path):
+        if ping(socket_path) is not None:
+            print(f"❌ A daemon is already listening on {socket_path}", file=sys.__stdout__)
+            return
+        os.remove(socket_path) # Left behind by a daemon that died
+
+    # Create the socket owner-only from the start, not chmod it after bind
+    old_umask = os.umask(0o077)
+    try:
+        server = Server(socket_path, Handler)
+    finally:
+        os.umask(old_umask)
+    print(f"🚀 Listening on {socket_path} (pid {os.getpid()})", file=sys.__stdout__, flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        sys.stdout = output.fallback
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+def request(socket_path, op, args=None, timeout=None):
+    """Sends one request to the daemon. Returns the response, or None if no daemon is listening."""
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            _send(sock, {"op": op, "args": args or {}})
+            return _receive(sock)
+    except (FileNotFoundError, ConnectionRefusedError):
+        return None
+
+def ping(socket_path):
+    """Returns the daemon's pid, or None if it is not running."""
+    response = request(socket_path, 'ping', timeout=2)
+    return response["result"] if response else None
+
+def call(socket_path, op, args):
+    """Runs op on the daemon, or in this process if none is listening. Returns the response dict."""
+    response = request(socket_path, op, args)
+    if response is None:
+        return run_operation(op, args)
+    sys.stdout.write(response.get("output", ""))
+    return response
+
+def main():
+    parser = argparse.ArgumentParser(description='Warm server for build, dump and verify, and its client')
+    parser.add_argument('--socket', default=default_socket_path(), help='Unix socket path (default: $ANKI_PROCESSING_SOCKET)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('serve', help='Run the daemon in the foreground')
+    sub.add_parser('stop', help='Stop a running daemon')
+    sub.add_parser('status', help='Report whether a daemon is running')
+
+    build = sub.add_parser('build', help='Build decks (see generate_anki_from_text.py)')
+    build.add_argument('input_path', help='Cards text file, directory or quoted glob')
+    build.add_argument('--output_dir', default='generated_decks', help='Directory for the decks')
+    build.add_argument('--force', action='store_true', help='Rebuild the whole deck, ignoring the previous build')
+    build.add_argument('--backend', choices=['genanki', 'native'], default='genanki', help='Writer for full builds')
+
+    dump = sub.add_parser('dump', help='Dump an apkg to HTML/text and verify it (see dump_apkg.py)')
+    dump.add_argument('apkg_path', help='Path to the .apkg file')
+    dump.add_argument('--output_dir', default='anki_review_output', help='Directory to output files')
+    dump.add_argument('--no-cache', action='store_true', help='Do not read or write the decompressed collection cache')
+
+    verify = sub.add_parser('verify', help='Verify GUIDs of an apkg against a cards file (see verify_guids.py)')
+    verify.add_argument('txt_path', help='Path to the source text file')
+    verify.add_argument('apkg_path', help='Path to the .apkg file')
+    verify.add_argument('-v', '--verbose', action='store_true', help='Print detailed card content for mismatches')
+    verify.add_argument('--no-cache', action='store_true', help='Do not read or write the decompressed collection cache')
+
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.socket)
+        return
+    if args.command == 'status':
+        pid = ping(args.socket)
+        print(f"✅ Daemon running (pid {pid}) on {args.socket}" if pid else f"ℹ️  No daemon on {args.socket}")
+        return
+    if args.command == 'stop':
+        response = request(args.socket, 'shutdown', timeout=5)
+        print("✅ Daemon stopped" if response else f"ℹ️  No daemon on {args.socket}")
+        return
+
+    # The daemon has its own working directory, so paths are sent absolute
+    if args.command == 'build':
+        op_args = {"input_path": os.path.abspath(args.input_path), "output_dir": os.path.abspath(args.output_dir),
+                   "force": args.force, "backend": args.backend}
+    elif args.command == 'dump':
+        op_args = {"apkg_path": os.path.abspath(args.apkg_path), "output_dir": os.path.abspath(args.output_dir),
+                   "cache": not args.no_cache}
+    else:
+        op_args = {"txt_path": os.path.abspath(args.txt_path), "apkg_path": os.path.abspath(args.apkg_path),
+                   "verbose": args.verbose, "cache": not args.no_cache}
+
+    response = call(args.socket, args.command, op_args)
+    if not response["ok"] or (args.command == 'verify' and response["result"] is False):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
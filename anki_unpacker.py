@@ -1,68 +1,623 @@
 import zipfile
 import sqlite3
-import zstandard
 import json
 import os
 import shutil
 import io
+import re
+import mmap
+import struct
+import hashlib
 import tempfile
+import threading
+from collections import Counter
+from collection_cache import CollectionCache
+from instrumentation import stage
+from lazy_import import lazy_import
+
+# Only needed for zstd compressed collections and media maps
+zstandard = lazy_import("zstandard")
+
+# Process-wide counters, e.g. stats['collection_loads'] counts how many times a
+# collection database was decompressed/loaded from an apkg and
+# stats['cache_hits'] how many loads were served by the CollectionCache
+stats = Counter()
+
+# Zstandard frame magic bytes (0x28 B5 2F FD)
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+# Read/write size used when streaming decompressed data (1 MiB)
+CHUNK_SIZE = 1 << 20
+
+def stream_decompress(src, dst, chunk_size=CHUNK_SIZE):
+    """Decompresses a zstd stream from src into dst without buffering it whole.
+
+    src is a binary file object or a buffer such as a memoryview of a mapped
+    zip member, dst a binary file object. Memory use is bounded by chunk_size
+    regardless of the size of the decompressed data.
+    Returns the number of decompressed bytes written.
+    """
+    dctx = zstandard.ZstdDecompressor()
+    if not hasattr(src, 'read'):
+        written = 0
+        for chunk in dctx.read_to_iter(src, read_size=chunk_size, write_size=chunk_size):
+            dst.write(chunk)
+            written += len(chunk)
+        return written
+    _, written = dctx.copy_stream(src, dst, read_size=chunk_size, write_size=chunk_size)
+    return written
+
+# Collections that decompress to at most this many bytes are loaded into an
+# in-memory SQLite database instead of a temp file (256 MiB)
+IN_MEMORY_MAX_BYTES = 256 << 20
+
+# Connection.deserialize needs Python 3.11+ and SQLite serialization support
+CAN_DESERIALIZE = hasattr(sqlite3.Connection, 'deserialize')
+
+# Columns of the notes table that get_notes() can select
+NOTE_COLUMNS = ('id', 'guid', 'mid', 'mod', 'usn', 'tags', 'flds', 'sfld', 'csum', 'flags', 'data')
+
+# Rows fetched per round trip by get_notes()
+NOTES_BATCH_SIZE = 1000
+
+# Anki does not index notes.guid; find_notes() adds this index, and cached
+# collections are stored with it
+GUID_INDEX_SQL = "CREATE INDEX IF NOT EXISTS ix_notes_guid ON notes (guid)"
+
+# GUIDs bound per query by find_notes(), below SQLite's variable limit
+GUID_LOOKUP_BATCH = 500
+
+# Media references in note fields: <img src="..."> and [sound:...]
+MEDIA_REF_RE = re.compile(r"""src=["']([^"']+)["']|\[sound:([^\]]+)\]""")
+
+def _create_guid_index(conn):
+    conn.execute(GUID_INDEX_SQL)
+    conn.commit()
+
+def _note_digest(mid, flds):
+    return hashlib.blake2b(f"{mid}\x1e{flds}".encode(), digest_size=16).digest()
+
+def media_references(fields):
+    """Returns the set of media file names referenced by a note's flds string."""
+    return {src or sound for src, sound in MEDIA_REF_RE.findall(fields)}
+
+class _SpillBuffer:
+    """Write-only buffer that stays in memory until it would grow past limit,
+    then moves its contents to path and keeps writing there.
+
+    limit=None never spills, limit=0 writes to path from the start.
+    """
+    def __init__(self, path, limit):
+        self.path = path
+        self.limit = limit
+        self.buffer = None
+        self.file = None
+        if limit == 0:
+            self.file = open(path, 'wb')
+        else:
+            self.buffer = io.BytesIO()
+
+    def write(self, data):
+        if self.file is None and self.limit is not None and self.buffer.tell() + len(data) > self.limit:
+            self.file = open(self.path, 'wb')
+            self.file.write(self.buffer.getbuffer())
+            self.buffer = None
+        if self.file is not None:
+            return self.file.write(data)
+        return self.buffer.write(data)
+
+def load_collection(src, db_path, compressed=True, in_memory=None):
+    """Loads a collection stream into SQLite and returns the open connection.
+
+    src is a binary file object or buffer holding the collection database,
+    zstd compressed when compressed is True. With in_memory=None the database is
+    deserialized into an in-memory connection unless it grows past
+    IN_MEMORY_MAX_BYTES, in which case it is written to db_path and opened
+    from there. in_memory=True/False forces either path. The connection may be
+    handed to another thread (AnkiDeckUnpacker loads collections on a worker).
+    """
+    if in_memory is None:
+        limit = IN_MEMORY_MAX_BYTES
+    else:
+        limit = None if in_memory else 0
+    if not CAN_DESERIALIZE:
+        limit = 0
+
+    if not compressed and not hasattr(src, 'read') and limit != 0 and (limit is None or len(src) <= limit):
+        # An uncompressed buffer is copied into SQLite as is
+        conn = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.deserialize(src)
+        return conn
+
+    spill = _SpillBuffer(db_path, limit)
+    try:
+        if compressed:
+            stream_decompress(src, spill)
+        elif hasattr(src, 'read'):
+            shutil.copyfileobj(src, spill, CHUNK_SIZE)
+        else:
+            spill.write(src)
+    finally:
+        if spill.file is not None:
+            spill.file.close()
+
+    if spill.file is not None:
+        return sqlite3.connect(db_path, check_same_thread=False)
+
+    conn = sqlite3.connect(":memory:", check_same_thread=False)
+    with spill.buffer.getbuffer() as view:
+        conn.deserialize(view)
+    return conn
+
+# Zip local file header: signature, then name and extra field lengths at offset 26
+LOCAL_HEADER = struct.Struct("<4s22xHH")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+class MappedZip:
+    """Read-only zip archive accessed through mmap.
+
+    Members stored without compression (Anki stores its zstd collection,
+    media map and media files that way) are returned as memoryview slices of
+    the mapping, so reading them copies nothing and the pages are shared by
+    every thread. Compressed members, and files that cannot be mapped, fall
+    back to zipfile. Wraps zipfile.ZipFile for the directory: namelist(),
+    getinfo() and infolist() work as there.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            self.map = None
+        self.zip = zipfile.ZipFile(self.file)
+
+    def namelist(self):
+        return self.zip.namelist()
+
+    def getinfo(self, name):
+        return self.zip.getinfo(name)
+
+    def infolist(self):
+        return self.zip.infolist()
+
+    def open(self, name):
+        """Opens a member as a file object, like zipfile.ZipFile.open()."""
+        info = self.getinfo(name)
+        view = self.view(info)
+        if view is None:
+            return self.zip.open(info)
+        return _ViewReader(view)
+
+    def view(self, info):
+        """Returns a stored member's data as a memoryview of the mapping, or None.
+
+        The caller must release the view (`with zf.view(info) as data:`)
+        before close().
+        """
+        if self.map is None or info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+            return None
+        signature, name_len, extra_len = LOCAL_HEADER.unpack_from(self.map, info.header_offset)
+        if signature != LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+        start = info.header_offset + LOCAL_HEADER.size + name_len + extra_len
+        with memoryview(self.map) as whole:
+            return whole[start:start + info.file_size]
+
+    def read(self, name):
+        info = self.getinfo(name)
+        view = self.view(info)
+        if view is None:
+            return self.zip.read(info)
+        with view:
+            return bytes(view)
+
+    def extract_to(self, info, path, zip_file=None):
+        """Writes a member to path, straight from the mapping when it is stored.
+
+        zip_file is the zipfile.ZipFile used for compressed members (threads
+        pass their own, ZipFile handles are not shared between threads).
+        """
+        view = self.view(info)
+        if view is not None:
+            with view, open(path, 'wb') as f:
+                f.write(view)
+            return
+        with (zip_file or self.zip).open(info) as src, open(path, 'wb') as f:
+            shutil.copyfileobj(src, f, CHUNK_SIZE)
+
+    def close(self):
+        self.zip.close()
+        if self.map is not None:
+            self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class _ViewReader(io.RawIOBase):
+    """Read-only file object over a memoryview, releasing it on close."""
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self.view) if size is None or size < 0 else min(self.pos + size, len(self.view))
+        data = bytes(self.view[self.pos:end])
+        self.pos = end
+        return data
+
+    def close(self):
+        if not self.closed:
+            self.view.release()
+        super().close()
+
+class _Background(threading.Thread):
+    """Runs fn(*args) on a thread; result() waits for it and returns its value or raises its error."""
+    def __init__(self, fn, *args):
+        super().__init__(daemon=True)
+        self.fn = fn
+        self.args = args
+        self.value = None
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.value = self.fn(*self.args)
+        except BaseException as e:
+            self.error = e
+
+    def result(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+def _read_varint(buf, pos):
+    """Decodes a multi-byte varint starting at pos. Returns (value, new_pos)."""
+    result = 0
+    shift = 0
+    length = len(buf)
+    while True:
+        if pos >= length:
+            raise IndexError("Varint read out of bounds")
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7f) << shift
+        if not (b & 0x80):
+            return result, pos
+        shift += 7
+
+def _skip_field(buf, pos, wire_type):
+    """Skips the value of an unknown field. Returns the position after it."""
+    if wire_type == 2: # Length delimited (e.g. checksum)
+        skip_len, pos = _read_varint(buf, pos)
+        return pos + skip_len
+    if wire_type == 0: # Varint
+        _, pos = _read_varint(buf, pos)
+        return pos
+    if wire_type == 5: # 32-bit
+        return pos + 4
+    if wire_type == 1: # 64-bit
+        return pos + 8
+    # Groups are not used by Anki; carry on with the next byte as a tag
+    return pos
+
+def parse_protobuf_media(data):
+    """Parses Anki's protobuf media map into {numeric_name: filename}.
+
+    The map is a sequence of MediaEntry messages (field 1) holding a
+    filename (field 1) and an index (field 2); other fields are skipped.
+    Single-byte varints, by far the most common, are decoded inline and
+    filenames are decoded straight from a memoryview without slicing copies.
+    """
+    buf = bytes(data)
+    view = memoryview(buf)
+    media_map = {}
+    pos = 0
+    length = len(buf)
+    
+    while pos < length:
+        # Read tag
+        tag = buf[pos]
+        if tag < 0x80:
+            pos += 1
+        else:
+            tag, pos = _read_varint(buf, pos)
+        
+        if tag != 0x0a: # Anything but field 1, length delimited
+            pos = _skip_field(buf, pos, tag & 7)
+            continue
+        
+        # MediaEntry message
+        msg_len = buf[pos]
+        if msg_len < 0x80:
+            pos += 1
+        else:
+            msg_len, pos = _read_varint(buf, pos)
+        end_pos = pos + msg_len
+        
+        filename = None
+        idx = None
+        while pos < end_pos:
+            inner_tag = buf[pos]
+            if inner_tag < 0x80:
+                pos += 1
+            else:
+                inner_tag, pos = _read_varint(buf, pos)
+            
+            if inner_tag == 0x0a: # Filename
+                str_len = buf[pos]
+                if str_len < 0x80:
+                    pos += 1
+                else:
+                    str_len, pos = _read_varint(buf, pos)
+                filename = str(view[pos:pos + str_len], 'utf-8', 'replace')
+                pos += str_len
+            elif inner_tag == 0x10: # Index
+                idx = buf[pos]
+                if idx < 0x80:
+                    pos += 1
+                else:
+                    idx, pos = _read_varint(buf, pos)
+            elif inner_tag & 7 == 2 and buf[pos] < 0x80: # Short length delimited (e.g. checksum)
+                pos += 1 + buf[pos]
+            else:
+                pos = _skip_field(buf, pos, inner_tag & 7)
+        
+        if filename is not None and idx is not None:
+            media_map[str(idx)] = filename
+    
+    return media_map
+
+# Ways export_media() can place media files, see its docstring
+MEDIA_EXPORT_MODES = ('stream', 'hardlink', 'reflink', 'copy')
+
+# ioctl request to clone a file's extents (Linux, e.g. btrfs/XFS)
+FICLONE = 0x40049409
+
+def _hardlink(src, dst):
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst) # e.g. across filesystems
+
+def _reflink(src, dst):
+    try:
+        import fcntl
+        with open(src, 'rb') as s, open(dst, 'wb') as d:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+    except (ImportError, OSError):
+        shutil.copyfile(src, dst) # Filesystem or platform without reflinks
 
 class AnkiDeckUnpacker:
-    def __init__(self, apkg_path):
+    def __init__(self, apkg_path, in_memory=None, cache=True, temp_root=None):
+        """in_memory: True/False forces an in-memory or file-backed database,
+        None picks one based on IN_MEMORY_MAX_BYTES.
+        cache: True uses the default CollectionCache, False disables caching,
+        or pass a CollectionCache instance.
+        temp_root: directory to create the temp dir in (default: the system
+        temp dir); on the output filesystem it lets media hardlink."""
         self.apkg_path = apkg_path
-        self.temp_dir = tempfile.mkdtemp()
+        self.in_memory = in_memory
+        self.cache = CollectionCache() if cache is True else (cache or None)
+        self.temp_dir = tempfile.mkdtemp(dir=temp_root)
         self.conn = None
-        self.cursor = None
         self.db_path = None
+        self.media_map = {}
+        self.media_dir = None
+        self._media_exports = []
+        self._media_dir_lock = threading.Lock()
 
-    def unpack(self):
-        """Unpacks the .apkg file to a temporary directory and processes media."""
-        print(f"Extracting {self.apkg_path} to temporary storage...")
+    def unpack(self, media=True, media_target=None, media_mode='stream', media_workers=None):
+        """Reads the collection and media map from the .apkg file.
+
+        The apkg is memory-mapped (see MappedZip). The collection is
+        decompressed on a worker thread while this thread reads the media
+        map. Only the collection and media map members are read; media files
+        stay in the archive until export_media() is called. Pass media=False
+        to skip the media map when only notes are needed.
+
+        media_target starts exporting the media there (see
+        start_media_export()) as soon as the media map is read, so it overlaps
+        the collection load and the caller's note queries. Call
+        wait_for_media() before using the files.
+        """
+        print(f"Reading {self.apkg_path}...")
+        media = media or media_target is not None
         
-        # 1. Unzip the contents
-        with zipfile.ZipFile(self.apkg_path, 'r') as z:
-            z.extractall(self.temp_dir)
-            
-        # 2. Rename Media Files
-        self._process_media()
+        with stage("unpack"):
+            with MappedZip(self.apkg_path) as z:
+                names = set(z.namelist())
+                if "collection.anki21b" not in names and "collection.anki2" not in names:
+                    raise FileNotFoundError(f"Database not found: {self.apkg_path} has no collection.anki21b or collection.anki2")
+                
+                # 0. Reuse a previously decompressed copy of this collection
+                cache_key = self.cache.key_for(z) if self.cache else None
+                with stage("cache_lookup"):
+                    if cache_key and self._load_from_cache(cache_key, media):
+                        if media_target is not None:
+                            self.start_media_export(media_target, media_mode, media_workers)
+                        return
+                
+                # 1. Decompress the collection in the background
+                stats['collection_loads'] += 1
+                loader = _Background(self._prepare_database, z, names)
+                
+                # 2. Meanwhile load the media map (always when it will be cached) and start the media export
+                try:
+                    if media or cache_key:
+                        with stage("media_map"):
+                            self._process_media(z, names)
+                    if media_target is not None:
+                        self.start_media_export(media_target, media_mode, media_workers)
+                finally:
+                    with stage("load_collection"):
+                        loader.result()
+                
+            if cache_key:
+                with stage("cache_store"):
+                    self._store_in_cache(cache_key)
+
+    @property
+    def unpacked(self):
+        """True once unpack() has loaded the collection."""
+        return self.conn is not None or self.db_path is not None
+
+    def _load_from_cache(self, key, media):
+        entry = self.cache.get(key)
+        if entry is None:
+            return False
         
-        # 3. Prepare Database
-        self._prepare_database()
+        # Another process may evict the entry after get(): treat that as a miss
+        conn = None
+        try:
+            conn = entry.connect()
+            conn.execute("SELECT 1 FROM notes LIMIT 1").fetchall()
+            media_map = entry.load_media_map() if media else None
+        except (OSError, ValueError, sqlite3.Error):
+            if conn is not None:
+                conn.close()
+            return False
+        
+        print("Using cached collection.")
+        stats['cache_hits'] += 1
+        self.conn = conn
+        self.db_path = entry.db_path
+        if media:
+            self.media_map = media_map
+        return True
 
-    def export_media(self, target_dir):
-        """Copies processed media files to the target directory."""
-        if not os.path.exists(target_dir):
-            os.makedirs(target_dir)
-            
-        count = 0
-        for filename in os.listdir(self.temp_dir):
-            # Skip database files and the media map itself (if it still exists)
-            if filename.startswith("collection.anki") or filename == "media":
-                continue
-            
-            src = os.path.join(self.temp_dir, filename)
-            dst = os.path.join(target_dir, filename)
-            
-            if os.path.isfile(src):
-                shutil.copy2(src, dst)
-                count += 1
+    def _store_in_cache(self, key):
+        conn = self.conn or sqlite3.connect(self.db_path)
+        try:
+            _create_guid_index(conn)
+            self.cache.put(key, conn, self.media_map)
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  Could not write collection cache: {e}")
+        finally:
+            if conn is not self.conn:
+                conn.close()
+
+    def export_media(self, target_dir, mode='stream', workers=None, names=None):
+        """Writes media files into target_dir under their original names.
+
+        mode:
+          'stream'  - each zip member is decompressed straight to its final
+                      path, the only write of the file.
+          'hardlink', 'reflink', 'copy' - media is first extracted once into
+                      the temp dir (kept for later exports) and then linked,
+                      reflinked (copy-on-write clone) or copied into target_dir.
+                      Links fall back to a copy where the filesystem refuses.
+        Files are processed on a thread pool of workers threads. names, if
+        given, limits the export to media files with those original names.
+        """
+        self._check_media_mode(mode)
+        with stage("export_media"):
+            self._export_media(target_dir, mode, workers, names)
+
+    def start_media_export(self, target_dir, mode='stream', workers=None, names=None):
+        """Like export_media(), but runs in the background and returns at once.
+
+        Notes can be queried meanwhile; wait_for_media() waits for every
+        started export and raises the first error.
+        """
+        self._check_media_mode(mode)
+        self._media_exports.append(_Background(self._export_media, target_dir, mode, workers, names))
+
+    def wait_for_media(self):
+        """Waits for the exports started by start_media_export(). Returns the number of files exported."""
+        exports, self._media_exports = self._media_exports, []
+        with stage("wait_for_media"):
+            return sum([export.result() for export in exports])
+
+    @staticmethod
+    def _check_media_mode(mode):
+        if mode not in MEDIA_EXPORT_MODES:
+            raise ValueError(f"Unknown media export mode: {mode}. Expected one of {MEDIA_EXPORT_MODES}")
+
+    def _export_media(self, target_dir, mode, workers, names):
+        os.makedirs(target_dir, exist_ok=True)
+        
+        # Imported here: concurrent.futures pulls in logging, which only media export needs
+        from concurrent.futures import ThreadPoolExecutor
+        if mode == 'stream':
+            count = self._extract_media(target_dir, workers, names)
+        else:
+            self._extract_media_to_temp(workers)
+            link = {'hardlink': _hardlink, 'reflink': _reflink, 'copy': shutil.copyfile}[mode]
+            files = [name for name in os.listdir(self.media_dir) if names is None or name in names]
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(lambda name: link(os.path.join(self.media_dir, name), os.path.join(target_dir, name)), files))
+            count = len(files)
         
         if count > 0:
             print(f"Exported {count} media files to {target_dir}")
+        return count
 
-    def _process_media(self):
-        media_map_path = os.path.join(self.temp_dir, "media")
+    def _extract_media_to_temp(self, workers):
+        with self._media_dir_lock:
+            if self.media_dir is None:
+                media_dir = os.path.join(self.temp_dir, "media")
+                os.makedirs(media_dir, exist_ok=True)
+                self._extract_media(media_dir, workers)
+                self.media_dir = media_dir
+
+    def _extract_media(self, target_dir, workers, names=None):
+        """Writes media members to target_dir/<original name>. Returns the count."""
+        from concurrent.futures import ThreadPoolExecutor
         
-        if os.path.exists(media_map_path):
-            with open(media_map_path, 'rb') as f:
-                data = f.read()
-                
-            # Check for Zstandard magic bytes (0x28 B5 2F FD)
-            if data.startswith(b'\x28\xb5\x2f\xfd'):
+        with MappedZip(self.apkg_path) as z:
+            # Media members are stored under numeric names
+            members = [info for info in z.infolist() if info.filename.isdigit()]
+            if names is not None:
+                members = [info for info in members
+                           if os.path.basename(self.media_map.get(info.filename, info.filename)) in names]
+            
+            # Stored members are written from the shared mapping; compressed ones need a
+            # ZipFile handle per thread, as handles are not safe to share between threads
+            local = threading.local()
+            handles = []
+            
+            def extract(info):
+                original_name = os.path.basename(self.media_map.get(info.filename, info.filename))
+                zip_file = None
+                if info.compress_type != zipfile.ZIP_STORED:
+                    zip_file = getattr(local, 'zip', None)
+                    if zip_file is None:
+                        zip_file = local.zip = zipfile.ZipFile(self.apkg_path, 'r')
+                        handles.append(zip_file)
+                z.extract_to(info, os.path.join(target_dir, original_name), zip_file)
+            
+            try:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    list(pool.map(extract, members))
+            finally:
+                for zip_file in handles:
+                    zip_file.close()
+        return len(members)
+
+    def _process_media(self, z, names):
+        """Loads the numeric name -> original filename map into self.media_map."""
+        self.media_map = {}
+        
+        if "media" in names:
+            data = z.read("media")
+            # Check for Zstandard magic bytes
+            if data[:len(ZSTD_MAGIC)] == ZSTD_MAGIC:
                 print("Detected Zstandard compressed media file. Decompressing...")
-                dctx = zstandard.ZstdDecompressor()
-                with dctx.stream_reader(io.BytesIO(data)) as reader:
-                    data = reader.read()
+                buf = io.BytesIO()
+                stream_decompress(data, buf)
+                data = buf.getvalue()
                 
             if not data:
                 print("Media file is empty.")
@@ -78,126 +633,169 @@ class AnkiDeckUnpacker:
                         print(f"❌ Protobuf parse failed: {e}")
                         media_map = {}
             
-            # Rename the numbered files to their original extensions
-            for numeric_name, original_name in media_map.items():
-                old_path = os.path.join(self.temp_dir, numeric_name)
-                new_path = os.path.join(self.temp_dir, original_name)
-                if os.path.exists(old_path):
-                    os.rename(old_path, new_path)
-            
-            os.remove(media_map_path) # cleanup
+            self.media_map = media_map
 
     def _parse_protobuf_media(self, data):
         """Parses Anki's protobuf media format."""
-        media_map = {}
-        pos = 0
-        length = len(data)
-        
-        def read_varint(pos):
-            result = 0
-            shift = 0
-            while True:
-                if pos >= length:
-                    raise IndexError("Varint read out of bounds")
-                b = data[pos]
-                pos += 1
-                result |= (b & 0x7f) << shift
-                if not (b & 0x80):
-                    return result, pos
-                shift += 7
-        
-        while pos < length:
-            # Read tag
-            tag, pos = read_varint(pos)
-            field_number = tag >> 3
-            wire_type = tag & 7
-            
-            if field_number == 1 and wire_type == 2: # MediaEntry message
-                msg_len, pos = read_varint(pos)
-                end_pos = pos + msg_len
-                
-                filename = None
-                idx = None
-                
-                while pos < end_pos:
-                    inner_tag, pos = read_varint(pos)
-                    inner_field = inner_tag >> 3
-                    inner_type = inner_tag & 7
-                    
-                    if inner_field == 1 and inner_type == 2: # Filename
-                        str_len, pos = read_varint(pos)
-                        filename = data[pos:pos+str_len].decode('utf-8', errors='replace')
-                        pos += str_len
-                    elif inner_field == 2 and inner_type == 0: # Index
-                        idx, pos = read_varint(pos)
-                    elif inner_type == 2: # Skip length delimited (e.g. checksum)
-                        skip_len, pos = read_varint(pos)
-                        pos += skip_len
-                    elif inner_type == 0: # Skip varint
-                        _, pos = read_varint(pos)
-                    elif inner_type == 5: # Skip 32-bit
-                        pos += 4
-                    elif inner_type == 1: # Skip 64-bit
-                        pos += 8
-                    else:
-                        # Should not happen in this specific format, but good to be safe
-                        # If we don't know the type, we can't skip it easily without a schema
-                        # But we assume valid Anki protobuf
-                        pass
-                
-                if filename is not None and idx is not None:
-                    media_map[str(idx)] = filename
-            else:
-                # Skip top-level unknown fields
-                if wire_type == 2:
-                    skip_len, pos = read_varint(pos)
-                    pos += skip_len
-                elif wire_type == 0:
-                    _, pos = read_varint(pos)
-                elif wire_type == 5:
-                    pos += 4
-                elif wire_type == 1:
-                    pos += 8
-                    
-        return media_map
-
-    def _prepare_database(self):
+        return parse_protobuf_media(data)
+
+    def _prepare_database(self, z, names):
+        """Loads the collection from the MappedZip z. Runs on a worker thread during unpack()."""
         # Check for newer Anki format (collection.anki21b)
-        db_path_v2 = os.path.join(self.temp_dir, "collection.anki21b")
-        db_path_legacy = os.path.join(self.temp_dir, "collection.anki2")
+        decompressed_path = os.path.join(self.temp_dir, "collection.anki2_decompressed")
         
-        if os.path.exists(db_path_v2):
+        if "collection.anki21b" in names:
             print("Detected V2/V3 scheduler database (collection.anki21b). Decompressing...")
-            with open(db_path_v2, 'rb') as f:
-                data = f.read()
-                dctx = zstandard.ZstdDecompressor()
-                with dctx.stream_reader(io.BytesIO(data)) as reader:
-                    decompressed_db = reader.read()
-                    
-            # Write to a temp file to open with sqlite
-            self.db_path = os.path.join(self.temp_dir, "collection.anki2_decompressed")
-            with open(self.db_path, 'wb') as f:
-                f.write(decompressed_db)
+            self.conn = self._load_member(z, z.getinfo("collection.anki21b"), decompressed_path, compressed=True,
+                                          in_memory=self.in_memory)
+            if os.path.exists(decompressed_path):
+                self.db_path = decompressed_path
+        elif self._legacy_in_memory(z.getinfo("collection.anki2")):
+            self.conn = self._load_member(z, z.getinfo("collection.anki2"), None, compressed=False, in_memory=True)
         else:
-            self.db_path = db_path_legacy
+            self.db_path = os.path.join(self.temp_dir, "collection.anki2")
+            z.extract_to(z.getinfo("collection.anki2"), self.db_path)
 
-    def get_notes(self):
-        """Yields notes from the database."""
-        if not self.db_path or not os.path.exists(self.db_path):
-            raise FileNotFoundError("Database not found. Did you call unpack()?")
-            
-        self.conn = sqlite3.connect(self.db_path)
-        self.cursor = self.conn.cursor()
+    @staticmethod
+    def _load_member(z, info, db_path, compressed, in_memory):
+        view = z.view(info)
+        if view is None:
+            # Compressed member: a ZipFile of its own, as the caller's thread reads z meanwhile
+            with zipfile.ZipFile(z.path) as zip_file, zip_file.open(info.filename) as src:
+                return load_collection(src, db_path, compressed, in_memory)
+        with view:
+            return load_collection(view, db_path, compressed, in_memory)
+
+    def _legacy_in_memory(self, info):
+        if not CAN_DESERIALIZE:
+            return False
+        if self.in_memory is None:
+            return info.file_size <= IN_MEMORY_MAX_BYTES
+        return self.in_memory
+
+    def get_notes(self, columns=('flds', 'guid'), batch_size=NOTES_BATCH_SIZE):
+        """Yields notes from the database as tuples of the requested columns.
+
+        columns is a sequence of notes table columns (see NOTE_COLUMNS), e.g.
+        ('guid',) to read GUIDs only. Rows are fetched batch_size at a time,
+        so memory use does not grow with the size of the collection.
+        """
+        unknown = [c for c in columns if c not in NOTE_COLUMNS]
+        if unknown or not columns:
+            raise ValueError(f"Unknown note columns: {unknown}. Expected some of {NOTE_COLUMNS}")
+        
+        self._connect()
+        cursor = self.conn.cursor()
+        # Keep table (id) order even when the guid index could cover the query
+        cursor.execute(f"SELECT {', '.join(columns)} FROM notes ORDER BY id")
+        return self._iter_rows(cursor, batch_size)
+
+    def find_notes(self, guids=(), pattern=None, columns=('flds', 'guid')):
+        """Returns notes (tuples of columns) with the given GUIDs or whose front matches pattern.
+
+        GUID matches come first, in the order the GUIDs were given, followed by
+        pattern matches in collection order.
+
+        GUIDs are looked up through an index on notes.guid, which is built on
+        first use (cached collections already carry it). pattern is a regular
+        expression searched for in the first field; it needs a scan of the
+        notes table.
+        """
+        unknown = [c for c in columns if c not in NOTE_COLUMNS]
+        if unknown or not columns:
+            raise ValueError(f"Unknown note columns: {unknown}. Expected some of {NOTE_COLUMNS}")
+        self._connect()
+        select = f"SELECT {', '.join(columns)} FROM notes"
+        
+        results = []
+        guids = list(dict.fromkeys(guids))
+        if guids:
+            self._ensure_guid_index()
+            by_guid = {}
+            for start in range(0, len(guids), GUID_LOOKUP_BATCH):
+                batch = guids[start:start + GUID_LOOKUP_BATCH]
+                for row in self.conn.execute(
+                        f"SELECT guid, {', '.join(columns)} FROM notes WHERE guid IN ({', '.join('?' * len(batch))}) ORDER BY id",
+                        batch):
+                    by_guid.setdefault(row[0], []).append(row[1:])
+            for guid in guids:
+                results.extend(by_guid.get(guid, ()))
         
-        # Get the raw field data and GUID
-        self.cursor.execute("SELECT flds, guid FROM notes")
-        notes = self.cursor.fetchall()
+        if pattern is not None:
+            regex = re.compile(pattern)
+            self.conn.create_function(
+                "front_matches", 1, lambda flds: regex.search(flds.split('\x1f', 1)[0]) is not None,
+                deterministic=True)
+            results.extend(self.conn.execute(f"{select} WHERE front_matches(flds) ORDER BY id"))
+        return results
+
+    def note_digests(self, batch_size=NOTES_BATCH_SIZE):
+        """Yields (guid, digest) for every note in GUID order.
+
+        The digest is a blake2b hash of the note type and fields, computed by a
+        Python function called from the query: each note's field text still
+        passes through it, but no note tuples are built or kept and the caller
+        only compares 16-byte digests. Rows are read
+        through the notes.guid index in batches, so memory does not grow with
+        the collection. Notes sharing a GUID are folded into one digest.
+        """
+        self._connect()
+        self._ensure_guid_index()
+        self.conn.create_function("note_digest", 2, _note_digest, deterministic=True)
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT guid, note_digest(mid, flds) FROM notes ORDER BY guid, id")
         
-        return notes
+        guid = digest = None
+        for next_guid, next_digest in self._iter_rows(cursor, batch_size):
+            if next_guid == guid:
+                digest = hashlib.blake2b(digest + next_digest, digest_size=16).digest()
+                continue
+            if guid is not None:
+                yield guid, digest
+            guid, digest = next_guid, next_digest
+        if guid is not None:
+            yield guid, digest
+
+    def _ensure_guid_index(self):
+        try:
+            _create_guid_index(self.conn)
+        except sqlite3.OperationalError:
+            pass # Read-only connection; lookups fall back to a table scan
+
+    def _connect(self):
+        if self.conn is None:
+            if not self.db_path or not os.path.exists(self.db_path):
+                raise FileNotFoundError("Database not found. Did you call unpack()?")
+            self.conn = sqlite3.connect(self.db_path)
+
+    @staticmethod
+    def _iter_rows(cursor, batch_size):
+        try:
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            cursor.close()
 
     def close(self):
+        # Background exports write into temp_dir, so they finish before it is removed
+        for export in self._media_exports:
+            export.join()
+        self._media_exports = []
+        
         if self.conn:
             self.conn.close()
+            self.conn = None
         
         if self.temp_dir and os.path.exists(self.temp_dir):
             shutil.rmtree(self.temp_dir)
+        self.temp_dir = None
+        self.media_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
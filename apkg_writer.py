@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import itertools
+import tempfile
+
+from genanki.apkg_col import APKG_COL
+from genanki.apkg_schema import APKG_SCHEMA
+from incremental_build import write_apkg
+
+# Rows buffered per executemany call
+BATCH_SIZE = 10000
+
+# Bulk-load settings: nothing is durable until the apkg is zipped anyway
+BULK_PRAGMAS = (
+    "PRAGMA page_size = 4096",
+    "PRAGMA journal_mode = OFF",
+    "PRAGMA synchronous = OFF",
+    "PRAGMA locking_mode = EXCLUSIVE",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -65536",
+)
+
+# genanki's schema, split so the indexes can be created after the bulk insert
+SCHEMA_INDEXES = [line.strip().rstrip(';') for line in APKG_SCHEMA.splitlines() if line.startswith("CREATE INDEX")]
+SCHEMA_TABLES = "\n".join(line for line in APKG_SCHEMA.splitlines() if not line.startswith("CREATE INDEX"))
+
+# Same patterns genanki.Note uses to find cloze fields and cloze numbers
+CLOZE_FIELD_RE = re.compile(r"{{[^}]*?cloze:(?:[^}]?:)*(.+?)}}")
+CLOZE_FIELD_ALT_RE = re.compile("<%cloze:(.+?)%>")
+CLOZE_NUMBER_RE = re.compile(r"{{c(\d+)::.+?}}", re.DOTALL)
+
+def write_deck_native(deck, filename, timestamp=None):
+    """Writes a genanki.Deck to an .apkg with bulk inserts instead of genanki.Package.
+
+    The schema, col row, note/card rows, ids and GUIDs are the same as
+    genanki.Package(deck).write_to_file(filename, timestamp) produces; notes
+    and cards are inserted with executemany inside a single transaction and
+    the indexes are built afterwards. genanki's invalid-HTML warning check
+    is skipped.
+    """
+    if timestamp is None:
+        timestamp = time.time()
+
+    fd, db_path = tempfile.mkstemp(suffix=".anki2")
+    os.close(fd)
+    try:
+        conn = sqlite3.connect(db_path, isolation_level=None)
+        try:
+            for pragma in BULK_PRAGMAS:
+                conn.execute(pragma)
+            cursor = conn.cursor()
+            cursor.executescript(SCHEMA_TABLES)
+            cursor.executescript(APKG_COL)
+
+            cursor.execute("BEGIN")
+            _write_col(cursor, deck, timestamp)
+            _write_notes(cursor, deck, timestamp)
+            # Building the indexes once after the load beats updating them per row
+            for statement in SCHEMA_INDEXES:
+                cursor.execute(statement)
+            cursor.execute("COMMIT")
+        finally:
+            conn.close()
+
+        write_apkg(db_path, filename)
+    finally:
+        os.remove(db_path)
+
+def _write_col(cursor, deck, timestamp):
+    """Adds the deck and its models to the col row, as genanki.Deck.write_to_db does."""
+    decks_json, models_json = cursor.execute("SELECT decks, models FROM col").fetchone()
+    decks = json.loads(decks_json)
+    decks.update({str(deck.deck_id): deck.to_json()})
+
+    models = json.loads(models_json)
+    for note in deck.notes:
+        deck.add_model(note.model)
+    models.update({model.model_id: model.to_json(timestamp, deck.deck_id) for model in deck.models.values()})
+
+    cursor.execute("UPDATE col SET decks = ?, models = ?", (json.dumps(decks), json.dumps(models)))
+
+def _write_notes(cursor, deck, timestamp):
+    # Ids are drawn in the same order as genanki: each note, then its cards
+    id_gen = itertools.count(int(timestamp * 1000))
+    mod = int(timestamp)
+    deck_id = deck.deck_id
+    note_rows = []
+    card_rows = []
+    card_rules = {}
+
+    for note in deck.notes:
+        if len(note.model.fields) != len(note.fields):
+            raise ValueError(
+                f"Number of fields in Model does not match number of fields in Note: "
+                f"{note.model} has {len(note.model.fields)} fields, but {note} has {len(note.fields)} fields.")
+
+        note_id = next(id_gen)
+        note_rows.append((
+            note_id, note.guid, note.model.model_id, mod, -1,
+            ' ' + ' '.join(note.tags) + ' ', '\x1f'.join(note.fields), note.sort_field, 0, 0, '',
+        ))
+        model = note.model
+        rule = card_rules.get(model.model_id)
+        if rule is None:
+            rule = card_rules[model.model_id] = _card_rule(model)
+        for card_ord in rule(note.fields):
+            card_rows.append((
+                next(id_gen), note_id, deck_id, card_ord, mod, -1, 0,
+                0, note.due, 0, 0, 0, 0, 0, 0, 0, 0, '',
+            ))
+
+        if len(note_rows) >= BATCH_SIZE:
+            _flush(cursor, note_rows, card_rows)
+
+    _flush(cursor, note_rows, card_rows)
+
+def _card_rule(model):
+    """Returns fields -> card ords for a model, matching genanki.Note.cards.
+
+    The model's templates are analysed once instead of once per note.
+    """
+    if model.model_type == model.CLOZE:
+        qfmt = model.templates[0]['qfmt']
+        field_names = [f['name'] for f in model.fields]
+        cloze_indices = [
+            field_names.index(name) if name in field_names else -1
+            for name in set(CLOZE_FIELD_RE.findall(qfmt) + CLOZE_FIELD_ALT_RE.findall(qfmt))
+        ]
+
+        def cloze_ords(fields):
+            card_ords = set()
+            for index in cloze_indices:
+                value = fields[index] if index >= 0 else ""
+                card_ords.update(int(m) - 1 for m in CLOZE_NUMBER_RE.findall(value) if int(m) > 0)
+            return card_ords
+        return cloze_ords
+
+    if model.model_type == model.FRONT_BACK:
+        req = [(card_ord, {'any': any, 'all': all}[any_or_all], required)
+               for card_ord, any_or_all, required in model._req]
+
+        def front_back_ords(fields):
+            return [card_ord for card_ord, op, required in req if op(fields[i] for i in required)]
+        return front_back_ords
+
+    raise ValueError('Expected model_type CLOZE or FRONT_BACK')
+
+def _flush(cursor, note_rows, card_rows):
+    cursor.executemany("INSERT INTO notes VALUES(?,?,?,?,?,?,?,?,?,?,?)", note_rows)
+    cursor.executemany("INSERT INTO cards VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)", card_rows)
+    note_rows.clear()
+    card_rows.clear()
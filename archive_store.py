@@ -0,0 +1,224 @@
+import os
+import re
+import json
+import time
+import shutil
+
+from incremental_build import file_hash
+from lazy_import import lazy_import
+
+# Only needed to pack and restore packed blobs
+zstandard = lazy_import("zstandard")
+
+# Layout inside the archive directory
+INDEX_NAME = "index.json"
+BLOBS_DIR_NAME = "blobs"
+INDEX_VERSION = 1
+
+BLOB_SUFFIX = ".apkg"
+PACKED_SUFFIX = ".apkg.zst"
+
+# "<deck>_<YYYY-MM-DD>[_N].apkg" -> deck, used to apply count retention per deck
+DECK_NAME_RE = re.compile(r"^(.*?)_\d{4}-\d{2}-\d{2}(?:_\d+)?\.apkg$")
+
+def unpack_blob(blob_path, dest_path):
+    """Writes the apkg stored at blob_path (packed or not) to dest_path."""
+    if blob_path.endswith(PACKED_SUFFIX):
+        dctx = zstandard.ZstdDecompressor()
+        with open(blob_path, 'rb') as src, open(dest_path, 'wb') as dst:
+            dctx.copy_stream(src, dst)
+    else:
+        shutil.copyfile(blob_path, dest_path)
+
+def deck_of(name):
+    match = DECK_NAME_RE.match(name)
+    return match.group(1) if match else os.path.splitext(name)[0]
+
+class ArchiveStore:
+    """Content-addressed store of archived apkg files.
+
+    Each distinct build is kept once as blobs/<sha256>.apkg (or .apkg.zst
+    once packed), and index.json lists every archived file as
+    {name, deck, archived_at, blob, size, packed}. Archiving an unchanged
+    build adds an index entry but no bytes. Opening a store only reads
+    index.json; loose .apkg files left in the archive directory by older
+    versions are moved in by adopt_loose_files().
+    """
+    def __init__(self, archive_dir):
+        self.archive_dir = archive_dir
+        self.blobs_dir = os.path.join(archive_dir, BLOBS_DIR_NAME)
+        self.index_path = os.path.join(archive_dir, INDEX_NAME)
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return []
+        if index.get("version") != INDEX_VERSION:
+            return []
+        return index["entries"]
+
+    def adopt_loose_files(self):
+        """Moves apkg files archived by older versions into the store. Returns the new entries.
+
+        Only callers that write to the archive (archiving and cleanup) call
+        this, so reading a store never moves files.
+        """
+        if not os.path.isdir(self.archive_dir):
+            return []
+        loose = [os.path.join(self.archive_dir, f) for f in sorted(os.listdir(self.archive_dir)) if f.endswith(".apkg")]
+        adopted = [self._add(path, archived_at=os.path.getmtime(path)) for path in loose]
+        if adopted:
+            self.save()
+        return adopted
+
+    def save(self):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": INDEX_VERSION, "entries": self.entries}, f, indent=1)
+        os.replace(tmp_path, self.index_path)
+
+    def blob_path(self, entry):
+        return os.path.join(self.blobs_dir, entry["blob"] + (PACKED_SUFFIX if entry["packed"] else BLOB_SUFFIX))
+
+    def add(self, paths):
+        """Moves the given apkg files into the store. Returns the new entries."""
+        now = time.time()
+        added = [self._add(path, now) for path in paths]
+        if added:
+            self.save()
+        return added
+
+    def _add(self, path, archived_at):
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        digest = file_hash(path)
+        blob = os.path.join(self.blobs_dir, digest + BLOB_SUFFIX)
+        packed = os.path.exists(os.path.join(self.blobs_dir, digest + PACKED_SUFFIX))
+
+        # Identical bytes are already stored: drop the copy
+        if packed or os.path.exists(blob):
+            os.remove(path)
+        else:
+            os.replace(path, blob)
+
+        name = os.path.basename(path)
+        entry = {
+            "name": name,
+            "deck": deck_of(name),
+            "archived_at": archived_at,
+            "blob": digest,
+            "size": os.path.getsize(self.blob_path({"blob": digest, "packed": packed})),
+            "packed": packed,
+        }
+        self.entries.append(entry)
+        return entry
+
+    def find(self, name):
+        """Returns the most recently archived entry called name, or None."""
+        matches = [entry for entry in self.entries if entry["name"] == name]
+        return max(matches, key=lambda entry: entry["archived_at"]) if matches else None
+
+    def restore(self, entry, dest_path):
+        """Writes the apkg of entry to dest_path."""
+        unpack_blob(self.blob_path(entry), dest_path)
+
+    def select_expired(self, keep=None, max_age_days=None, max_bytes=None, now=None):
+        """Returns the entries a retention policy would remove.
+
+        keep: newest entries to keep per deck.
+        max_age_days: entries archived longer ago than this are removed.
+        max_bytes: oldest entries are removed until the blobs still
+                   referenced fit in this many bytes.
+        """
+        now = time.time() if now is None else now
+        newest_first = sorted(self.entries, key=lambda entry: entry["archived_at"], reverse=True)
+        expired = {} # id(entry) -> entry, in the order they were picked
+
+        if keep is not None:
+            seen = {}
+            for entry in newest_first:
+                seen[entry["deck"]] = seen.get(entry["deck"], 0) + 1
+                if seen[entry["deck"]] > keep:
+                    expired[id(entry)] = entry
+
+        if max_age_days is not None:
+            cutoff = now - max_age_days * 86400
+            for entry in newest_first:
+                if entry["archived_at"] < cutoff:
+                    expired[id(entry)] = entry
+
+        if max_bytes is not None:
+            kept = [entry for entry in newest_first if id(entry) not in expired]
+            users = {}
+            for entry in kept:
+                users[entry["blob"]] = users.get(entry["blob"], 0) + 1
+            total = sum({entry["blob"]: entry["size"] for entry in kept}.values())
+            for entry in reversed(kept):
+                if total <= max_bytes:
+                    break
+                expired[id(entry)] = entry
+                # A blob's bytes are freed with the last entry that uses it
+                users[entry["blob"]] -= 1
+                if users[entry["blob"]] == 0:
+                    total -= entry["size"]
+
+        return list(expired.values())
+
+    def remove(self, entries):
+        """Drops entries from the index and deletes blobs no longer referenced. Returns bytes freed."""
+        removed = {id(entry) for entry in entries}
+        self.entries = [entry for entry in self.entries if id(entry) not in removed]
+        self.save()
+        return self.collect_garbage()
+
+    def collect_garbage(self):
+        if not os.path.isdir(self.blobs_dir):
+            return 0
+        referenced = {os.path.basename(self.blob_path(entry)) for entry in self.entries}
+        freed = 0
+        for filename in os.listdir(self.blobs_dir):
+            if filename not in referenced:
+                path = os.path.join(self.blobs_dir, filename)
+                freed += os.path.getsize(path)
+                os.remove(path)
+        return freed
+
+    def pack(self, older_than_days=0, level=19, now=None):
+        """Compresses with zstd the blobs only used by entries archived before the cutoff.
+
+        Returns the number of blobs packed.
+        """
+        now = time.time() if now is None else now
+        cutoff = now - older_than_days * 86400
+        newest = {}
+        for entry in self.entries:
+            newest[entry["blob"]] = max(newest.get(entry["blob"], 0), entry["archived_at"])
+
+        cctx = zstandard.ZstdCompressor(level=level)
+        packed = 0
+        for blob, archived_at in newest.items():
+            if archived_at >= cutoff:
+                continue
+            entries = [entry for entry in self.entries if entry["blob"] == blob]
+            if entries[0]["packed"]:
+                continue
+            src_path = self.blob_path(entries[0])
+            dst_path = os.path.join(self.blobs_dir, blob + PACKED_SUFFIX)
+            with open(src_path, 'rb') as src, open(dst_path + ".tmp", 'wb') as dst:
+                cctx.copy_stream(src, dst)
+            os.replace(dst_path + ".tmp", dst_path)
+            os.remove(src_path)
+            for entry in entries:
+                entry["packed"] = True
+                entry["size"] = os.path.getsize(dst_path)
+            packed += 1
+
+        if packed:
+            self.save()
+        return packed
+
+    def total_bytes(self):
+        return sum({entry["blob"]: entry["size"] for entry in self.entries}.values())
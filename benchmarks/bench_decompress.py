@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import io
+import time
+import argparse
+import tempfile
+import tracemalloc
+import zstandard
+
+# Add parent directory to path to import scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anki_unpacker import stream_decompress, CHUNK_SIZE
+
+def bench(size_mb, chunk_size):
+    """Decompresses a synthetic size_mb stream to disk, returns (seconds, peak bytes)."""
+    block = os.urandom(4096)
+    raw = block * (size_mb * 1024 * 1024 // len(block))
+    compressed = zstandard.ZstdCompressor().compress(raw)
+    del raw
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with open(os.path.join(temp_dir, "collection.db"), 'wb') as dst:
+            tracemalloc.start()
+            start = time.perf_counter()
+            stream_decompress(io.BytesIO(compressed), dst, chunk_size=chunk_size)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure peak memory of streaming zstd decompression')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[16, 64, 256], help='Decompressed sizes in MB')
+    parser.add_argument('--chunk_size', type=int, default=CHUNK_SIZE, help='Streaming chunk size in bytes')
+    args = parser.parse_args()
+
+    print(f"{'size (MB)':>10} {'time (s)':>10} {'peak (KB)':>10}")
+    for size_mb in args.sizes:
+        elapsed, peak = bench(size_mb, args.chunk_size)
+        print(f"{size_mb:>10} {elapsed:>10.3f} {peak // 1024:>10}")
+
+if __name__ == "__main__":
+    main()
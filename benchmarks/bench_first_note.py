@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import zipfile
+import argparse
+import tempfile
+import contextlib
+
+# Add parent directory to path to import scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import write_apkg
+from anki_unpacker import AnkiDeckUnpacker, MappedZip, load_collection
+
+def sequential(apkg, media_dir):
+    """Unpack, export all media, then query: the order dumps used before pipelining.
+
+    Returns (seconds to the first note, seconds until media is written too).
+    """
+    start = time.perf_counter()
+    with AnkiDeckUnpacker(apkg, cache=False) as unpacker:
+        unpacker.unpack()
+        unpacker.export_media(media_dir)
+        next(unpacker.get_notes())
+        first = time.perf_counter() - start
+    return first, time.perf_counter() - start
+
+def pipelined(apkg, media_dir):
+    """Media export starts during unpack() and runs while the notes are queried."""
+    start = time.perf_counter()
+    with AnkiDeckUnpacker(apkg, cache=False) as unpacker:
+        unpacker.unpack(media_target=media_dir)
+        next(unpacker.get_notes())
+        first = time.perf_counter() - start
+        unpacker.wait_for_media()
+    return first, time.perf_counter() - start
+
+def load_via_zipfile(apkg, work_dir):
+    """Decompresses the collection from a zipfile stream (each read copies the member data)."""
+    start = time.perf_counter()
+    with zipfile.ZipFile(apkg) as z, z.open("collection.anki21b") as src:
+        load_collection(src, os.path.join(work_dir, "collection.db")).close()
+    return time.perf_counter() - start
+
+def load_via_mmap(apkg, work_dir):
+    """Decompresses the collection straight from the mapped zip member."""
+    start = time.perf_counter()
+    with MappedZip(apkg) as z, z.view(z.getinfo("collection.anki21b")) as src:
+        load_collection(src, os.path.join(work_dir, "collection.db")).close()
+    return time.perf_counter() - start
+
+def best(run, repeat):
+    """Returns the best result of repeat runs of run(work_dir) (tuples compare by first element)."""
+    results = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as work_dir:
+            results.append(run(work_dir))
+    return min(results)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure time-to-first-note of sequential vs pipelined unpacking')
+    parser.add_argument('--notes', type=int, nargs='+', default=[10_000, 100_000], help='Note counts')
+    parser.add_argument('--media', type=int, default=2000, help='Media files per deck')
+    parser.add_argument('--media-kb', type=int, default=64, help='Size of each media file in KiB')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per measurement (best is reported)')
+    args = parser.parse_args()
+
+    print(f"CPUs: {os.cpu_count()}")
+    print(f"{'notes':>8} {'mode':<11} {'first note ms':>14} {'with media ms':>14}")
+    with tempfile.TemporaryDirectory() as data_dir:
+        for notes in args.notes:
+            apkg = os.path.join(data_dir, f"deck_{notes}.apkg")
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                write_apkg(apkg, notes, compressed=True, media_files=args.media, media_size=args.media_kb * 1024)
+                results = {
+                    'sequential': best(lambda work_dir: sequential(apkg, os.path.join(work_dir, "media")), args.repeat),
+                    'pipelined': best(lambda work_dir: pipelined(apkg, os.path.join(work_dir, "media")), args.repeat),
+                }
+                zip_load = best(lambda work_dir: load_via_zipfile(apkg, work_dir), args.repeat)
+                mmap_load = best(lambda work_dir: load_via_mmap(apkg, work_dir), args.repeat)
+            for mode, (first, total) in results.items():
+                print(f"{notes:>8} {mode:<11} {first * 1000:>14.1f} {total * 1000:>14.1f}")
+            speedup = results['sequential'][0] / results['pipelined'][0]
+            print(f"{notes:>8} first note {speedup:.2f}x sooner; collection load zipfile {zip_load * 1000:.1f} ms, "
+                  f"mmap {mmap_load * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
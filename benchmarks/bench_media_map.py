@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import random
+import argparse
+
+# Add parent directory to path to import scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from anki_unpacker import parse_protobuf_media
+
+def encode_varint(value):
+    out = bytearray()
+    while True:
+        b = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+def encode_field(field_number, wire_type, payload):
+    return encode_varint(field_number << 3 | wire_type) + payload
+
+def synthetic_media_map(num_entries, seed=0):
+    """Builds a protobuf media map like Anki's: filename, index and a sha1 checksum per entry."""
+    rng = random.Random(seed)
+    parts = []
+    for idx in range(num_entries):
+        name = f"image_{idx}_{rng.randrange(1 << 30):x}.{rng.choice(['png', 'jpg', 'mp3', 'ogg'])}".encode()
+        entry = (
+            encode_field(1, 2, encode_varint(len(name)) + name)
+            + encode_field(2, 0, encode_varint(idx))
+            + encode_field(3, 2, encode_varint(20) + rng.randbytes(20))
+        )
+        parts.append(encode_field(1, 2, encode_varint(len(entry)) + entry))
+    return b"".join(parts)
+
+def reference_parse_protobuf_media(data):
+    """The original byte-at-a-time decoder, kept to check the fast path's output."""
+    media_map = {}
+    pos = 0
+    length = len(data)
+
+    def read_varint(pos):
+        result = 0
+        shift = 0
+        while True:
+            if pos >= length:
+                raise IndexError("Varint read out of bounds")
+            b = data[pos]
+            pos += 1
+            result |= (b & 0x7f) << shift
+            if not (b & 0x80):
+                return result, pos
+            shift += 7
+
+    while pos < length:
+        tag, pos = read_varint(pos)
+        field_number = tag >> 3
+        wire_type = tag & 7
+
+        if field_number == 1 and wire_type == 2:
+            msg_len, pos = read_varint(pos)
+            end_pos = pos + msg_len
+            filename = None
+            idx = None
+            while pos < end_pos:
+                inner_tag, pos = read_varint(pos)
+                inner_field = inner_tag >> 3
+                inner_type = inner_tag & 7
+                if inner_field == 1 and inner_type == 2:
+                    str_len, pos = read_varint(pos)
+                    filename = data[pos:pos+str_len].decode('utf-8', errors='replace')
+                    pos += str_len
+                elif inner_field == 2 and inner_type == 0:
+                    idx, pos = read_varint(pos)
+                elif inner_type == 2:
+                    skip_len, pos = read_varint(pos)
+                    pos += skip_len
+                elif inner_type == 0:
+                    _, pos = read_varint(pos)
+                elif inner_type == 5:
+                    pos += 4
+                elif inner_type == 1:
+                    pos += 8
+            if filename is not None and idx is not None:
+                media_map[str(idx)] = filename
+        else:
+            if wire_type == 2:
+                skip_len, pos = read_varint(pos)
+                pos += skip_len
+            elif wire_type == 0:
+                _, pos = read_varint(pos)
+            elif wire_type == 5:
+                pos += 4
+            elif wire_type == 1:
+                pos += 8
+
+    return media_map
+
+def best_time(func, data, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the fast and reference protobuf media map decoders')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 500_000], help='Media entry counts')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per decoder (best is reported)')
+    args = parser.parse_args()
+
+    print(f"{'entries':>10} {'reference (s)':>14} {'fast (s)':>10} {'speedup':>8}")
+    for size in args.sizes:
+        data = synthetic_media_map(size)
+        ref_time, expected = best_time(reference_parse_protobuf_media, data, args.repeat)
+        fast_time, actual = best_time(parse_protobuf_media, data, args.repeat)
+        if actual != expected:
+            print(f"❌ Fast decoder output differs from the reference for {size} entries")
+            sys.exit(1)
+        print(f"{size:>10} {ref_time:>14.3f} {fast_time:>10.3f} {ref_time / fast_time:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
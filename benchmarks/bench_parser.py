@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+# Add parent directory to path to import scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from card_parser import parse_card_file
+
+def write_cards_file(path, num_lines):
+    """Writes a synthetic cards file mixing basic, multi-field, cloze and comment lines."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(num_lines):
+            kind = i % 4
+            if kind == 0:
+                f.write(f"[{i:010d}] What is item {i}? :: Answer {i}\n")
+            elif kind == 1:
+                f.write(f"[{i:010d}] Term {i} :: Definition {i} :: Example {i}\n")
+            elif kind == 2:
+                f.write(f"[{i:010d}] Item {{{{c1::{i}}}}} is a cloze :: Extra {i}\n")
+            else:
+                f.write(f"# Section {i}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure card_parser throughput')
+    parser.add_argument('--lines', type=int, default=1_000_000, help='Number of lines in the synthetic cards file')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of timed runs (best is reported)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "cards.txt")
+        write_cards_file(path, args.lines)
+
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            parsed = parse_card_file(path)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+    print(f"Parsed {args.lines} lines ({len(parsed.records)} records) in {best:.3f}s")
+    print(f"Throughput: {args.lines / best:,.0f} lines/sec")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import glob
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Import-time budgets in ms (sum of top-level imports under -X importtime).
+# 'help' runs `<script> --help`; 'run' is a trivial invocation on a one-card deck.
+BUDGETS_MS = {
+    'generate_anki_from_text.py': {'help': 80, 'run': 80},
+    'dump_apkg.py': {'help': 80, 'run': 100},
+    'verify_guids.py': {'help': 80, 'run': 100},
+    'diff_apkg.py': {'help': 80, 'run': 100},
+    'cleanup_archive.py': {'help': 60, 'run': 60},
+    'search_index.py': {'help': 80, 'run': 80},
+    'anki_daemon.py': {'help': 40, 'run': 40},
+}
+
+def trivial_runs(work_dir):
+    """Returns {script: argv} for a cheap real invocation of each entry point, after preparing their inputs."""
+    cards = os.path.join(work_dir, "cards.txt")
+    with open(cards, 'w', encoding='utf-8') as f:
+        f.write("[g1] Question :: Answer\n")
+    # Build once so the measured generate run is the unchanged-deck fast path
+    subprocess.run([sys.executable, os.path.join(ROOT, "generate_anki_from_text.py"), cards],
+                   cwd=work_dir, check=True, capture_output=True)
+    apkg = glob.glob(os.path.join(work_dir, "generated_decks", "*.apkg"))[0]
+    subprocess.run([sys.executable, os.path.join(ROOT, "search_index.py"), "update"],
+                   cwd=work_dir, check=True, capture_output=True)
+    return {
+        'generate_anki_from_text.py': [cards],
+        'dump_apkg.py': [apkg, '--output_dir', os.path.join(work_dir, "out"), '--no-cache'],
+        'verify_guids.py': [cards, apkg, '--no-cache'],
+        'diff_apkg.py': [apkg, apkg, '--no-cache'],
+        'cleanup_archive.py': ['--list'],
+        'search_index.py': ['query', 'Question'],
+        'anki_daemon.py': ['--socket', os.path.join(work_dir, "none.sock"), 'status'],
+    }
+
+def import_ms(stderr):
+    """Sums the cumulative time of top-level imports in -X importtime output."""
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if not name[1:].startswith(" "): # Nested imports are indented
+            total += int(cumulative)
+    return total / 1000
+
+def measure(argv, cwd, repeat):
+    """Returns (median import ms, median wall ms) of running argv with -X importtime."""
+    imports, walls = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", *argv], cwd=cwd, capture_output=True, text=True)
+        walls.append((time.perf_counter() - start) * 1000)
+        imports.append(import_ms(proc.stderr))
+    return statistics.median(imports), statistics.median(walls)
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure cold-start import time of each script against a budget')
+    parser.add_argument('--repeat', type=int, default=7, help='Runs per measurement (median is reported)')
+    parser.add_argument('--budget-scale', type=float, default=1.0, help='Multiply every budget, e.g. for slow CI machines')
+    args = parser.parse_args()
+
+    over = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        env_cache = os.path.join(work_dir, "cache")
+        os.environ.setdefault("ANKI_PROCESSING_CACHE_DIR", env_cache)
+        runs = trivial_runs(work_dir)
+        _, baseline_wall = measure(["-c", "pass"], work_dir, args.repeat)
+        print(f"Interpreter baseline: {baseline_wall:.0f} ms wall\n")
+        print(f"{'script':<28} {'mode':<5} {'imports ms':>10} {'budget':>7} {'wall ms':>8}")
+        for script, budgets in BUDGETS_MS.items():
+            path = os.path.join(ROOT, script)
+            for mode, argv in (('help', [path, '--help']), ('run', [path, *runs[script]])):
+                imports, wall = measure(argv, work_dir, args.repeat)
+                budget = budgets[mode] * args.budget_scale
+                flag = "" if imports <= budget else "  ❌"
+                print(f"{script:<28} {mode:<5} {imports:>10.1f} {budget:>7.0f} {wall:>8.0f}{flag}")
+                if flag:
+                    over.append((script, mode, imports, budget))
+
+    if over:
+        print(f"\n❌ {len(over)} measurements over budget")
+        sys.exit(1)
+    print("\n✅ All scripts start within budget")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+from datetime import datetime
+
+# Add parent directory to path to import scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import write_cards_file, write_apkg
+
+# Pipeline stages in run order
+STAGES = ('parse', 'create_deck', 'write_genanki', 'write_native', 'unpack_anki2', 'unpack_anki21b', 'verify', 'dump')
+
+# A stage is a regression when it is this much slower than the baseline
+DEFAULT_THRESHOLD = 0.20
+
+def _prepare(stage, inputs, work_dir):
+    """Returns a zero-argument callable that runs one stage; its setup is not timed."""
+    from card_parser import parse_card_file
+    from generate_anki_from_text import create_deck_from_records
+    from anki_unpacker import AnkiDeckUnpacker
+    from verify_guids import verify
+    from dump_apkg import unpack_and_review
+    from apkg_writer import write_deck_native
+    import genanki
+
+    if stage == 'parse':
+        return lambda: parse_card_file(inputs['cards'])
+    if stage == 'create_deck':
+        parsed = parse_card_file(inputs['cards'])
+        return lambda: create_deck_from_records("Benchmark", parsed)
+    if stage in ('write_genanki', 'write_native'):
+        deck = create_deck_from_records("Benchmark", parse_card_file(inputs['cards']))
+        path = os.path.join(work_dir, f"{stage}.apkg")
+        if stage == 'write_native':
+            return lambda: write_deck_native(deck, path)
+        return lambda: genanki.Package(deck).write_to_file(path)
+    if stage in ('unpack_anki2', 'unpack_anki21b'):
+        apkg = inputs['anki2' if stage == 'unpack_anki2' else 'anki21b']
+
+        def unpack():
+            with AnkiDeckUnpacker(apkg, cache=False) as unpacker:
+                unpacker.unpack()
+                for _ in unpacker.get_notes():
+                    pass
+        return unpack
+    if stage == 'verify':
+        return lambda: verify(inputs['cards'], inputs['anki2'], cache=False)
+    if stage == 'dump':
+        def dump():
+            with AnkiDeckUnpacker(inputs['anki21b'], cache=False) as unpacker:
+                unpacker.unpack()
+                unpack_and_review(inputs['anki21b'], os.path.join(work_dir, "dump"), unpacker=unpacker)
+        return dump
+    raise ValueError(f"Unknown stage: {stage}")
+
+def _measure(stage, inputs, repeat, result_queue):
+    """Runs in a fresh process, so peak RSS belongs to this stage alone."""
+    import resource
+    with tempfile.TemporaryDirectory() as work_dir, open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            run = _prepare(stage, inputs, work_dir)
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_mb = peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+    result_queue.put({"seconds": best, "peak_rss_mb": round(peak_mb, 1)})
+
+def run_stage(stage, inputs, repeat):
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(stage, inputs, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def make_inputs(data_dir, size, media_files):
+    inputs = {
+        'cards': os.path.join(data_dir, f"cards_{size}.txt"),
+        'anki2': os.path.join(data_dir, f"legacy_{size}.apkg"),
+        'anki21b': os.path.join(data_dir, f"zstd_{size}.apkg"),
+    }
+    write_cards_file(inputs['cards'], size)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        write_apkg(inputs['anki2'], size, compressed=False)
+        write_apkg(inputs['anki21b'], size, compressed=True, media_files=media_files)
+    return inputs
+
+def compare(results, baseline, threshold):
+    """Returns [(key, baseline seconds, seconds)] for stages slower than the baseline by more than threshold."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base and result["seconds"] > base["seconds"] * (1 + threshold):
+            regressions.append((key, base["seconds"], result["seconds"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Time each pipeline stage on synthetic decks and check for regressions')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000], help='Note counts')
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES)
+    parser.add_argument('--media', type=int, default=100, help='Media files in the zstd apkg used by unpack/dump')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per stage (best is reported)')
+    parser.add_argument('--output', default='bench_results.json', help='Where to write the JSON results')
+    parser.add_argument('--baseline',
+                        help='JSON results of an earlier run on the same machine to compare against (see README: Benchmarks)')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Allowed slowdown vs the baseline (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'stage':<16} {'notes':>8} {'seconds':>9} {'notes/s':>11} {'peak RSS':>10}")
+    with tempfile.TemporaryDirectory() as data_dir:
+        for size in args.sizes:
+            inputs = make_inputs(data_dir, size, args.media)
+            for stage in args.stages:
+                result = run_stage(stage, inputs, args.repeat)
+                result["notes"] = size
+                result["notes_per_sec"] = round(size / result["seconds"]) if result["seconds"] else None
+                results[f"{stage}/{size}"] = result
+                print(f"{stage:<16} {size:>8} {result['seconds']:>9.3f} {result['notes_per_sec']:>11,} {result['peak_rss_mb']:>7.1f} MB")
+
+    report = {
+        "meta": {
+            "date": datetime.now().isoformat(timespec='seconds'),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline_report = json.load(f)
+        # Timings only compare on the machine and Python that produced them
+        for field in ("platform", "python"):
+            if baseline_report["meta"].get(field) != report["meta"][field]:
+                print(f"⚠️  {args.baseline} was recorded on {field} {baseline_report['meta'].get(field)}, "
+                      f"this run is {report['meta'][field]}")
+        regressions = compare(results, baseline_report["results"], args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} stages are more than {args.threshold:.0%} slower than {args.baseline}:")
+            for key, before, after in regressions:
+                print(f" - {key}: {before:.3f}s -> {after:.3f}s ({after / before - 1:+.0%})")
+            sys.exit(1)
+        print(f"✅ No regressions against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
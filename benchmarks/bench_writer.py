@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import genanki
+
+# Add parent directory to path to import scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_anki_from_text import create_deck
+from apkg_writer import write_deck_native
+
+def synthetic_cards(num_notes):
+    """Returns cards.txt lines mixing basic and cloze notes."""
+    lines = []
+    for i in range(num_notes):
+        if i % 3 == 2:
+            lines.append(f"[{i:010d}] Item {{{{c1::{i}}}}} and {{{{c2::{i + 1}}}}} :: Extra {i}")
+        else:
+            lines.append(f"[{i:010d}] What is item {i}? :: Answer {i}")
+    return lines
+
+def time_backend(backend, deck, path):
+    start = time.perf_counter()
+    if backend == 'native':
+        write_deck_native(deck, path)
+    else:
+        genanki.Package(deck).write_to_file(path)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the genanki and native apkg writer backends')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000], help='Note counts')
+    parser.add_argument('--backends', nargs='+', default=['genanki', 'native'], choices=['genanki', 'native'])
+    args = parser.parse_args()
+
+    print(f"{'notes':>10} " + " ".join(f"{b + ' (s)':>14}" for b in args.backends) + f" {'speedup':>8}")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in args.sizes:
+            deck = create_deck("Benchmark", synthetic_cards(size))
+            timings = [time_backend(b, deck, os.path.join(temp_dir, f"{b}.apkg")) for b in args.backends]
+            speedup = f"{timings[0] / timings[-1]:>7.1f}x" if len(timings) > 1 else ""
+            print(f"{size:>10} " + " ".join(f"{t:>14.2f}" for t in timings) + f" {speedup:>8}")
+
+if __name__ == "__main__":
+    main()
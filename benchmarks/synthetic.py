@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import json
+import random
+import zipfile
+import argparse
+import tempfile
+import zstandard
+
+# Add parent directory to path to import scripts
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from generate_anki_from_text import create_deck
+from apkg_writer import write_deck_native
+from bench_media_map import encode_field, encode_varint
+
+def write_cards_file(path, num_notes, seed=0):
+    """Writes a cards.txt of num_notes notes with GUIDs: basic, multi-field and cloze, plus comments.
+
+    The same num_notes and seed always produce the same file.
+    """
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for i in range(num_notes):
+            if i % 50 == 0:
+                f.write(f"# Section {i // 50}\n")
+            guid = f"{rng.getrandbits(40):010x}"
+            kind = i % 3
+            if kind == 0:
+                f.write(f"[{guid}] What is item {i}? :: Answer {i} <b>{rng.random():.6f}</b>\n")
+            elif kind == 1:
+                f.write(f"[{guid}] Term {i} :: Definition {i} :: Example {i}\n")
+            else:
+                f.write(f"[{guid}] Item {{{{c1::{i}}}}} is a {{{{c2::cloze}}}} :: Extra {i}\n")
+
+def write_apkg(path, num_notes, compressed=True, media_files=0, media_size=4096, seed=0):
+    """Writes a synthetic .apkg with num_notes notes built from write_cards_file's cards.
+
+    compressed=True stores a zstd collection.anki21b with a zstd protobuf
+    media map, as recent Anki exports do; otherwise a legacy collection.anki2
+    with a JSON media map. media_files files of media_size random bytes are
+    added and referenced from the first notes.
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cards_path = os.path.join(temp_dir, "cards.txt")
+        write_cards_file(cards_path, num_notes, seed)
+        with open(cards_path, 'r', encoding='utf-8') as f:
+            lines = f.read().splitlines()
+
+        media_names = [f"image_{i}.png" for i in range(media_files)]
+        for i, name in enumerate(media_names):
+            # Reference each file from a basic note (every third line after the comment)
+            index = 1 + (i * 3) % max(len(lines) - 1, 1)
+            if " :: " in lines[index]:
+                lines[index] = lines[index].replace(" :: ", f' <img src="{name}"> :: ', 1)
+
+        deck_path = os.path.join(temp_dir, "deck.apkg")
+        write_deck_native(create_deck("Synthetic", lines), deck_path, timestamp=1_700_000_000)
+        with zipfile.ZipFile(deck_path, 'r') as z:
+            db_bytes = z.read("collection.anki2")
+
+    cctx = zstandard.ZstdCompressor()
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as z:
+        if compressed:
+            z.writestr("collection.anki21b", cctx.compress(db_bytes))
+            z.writestr("media", cctx.compress(_protobuf_media_map(media_names)))
+        else:
+            z.writestr("collection.anki2", db_bytes)
+            z.writestr("media", json.dumps({str(i): name for i, name in enumerate(media_names)}))
+        for i in range(media_files):
+            z.writestr(str(i), rng.randbytes(media_size))
+
+def _protobuf_media_map(names):
+    parts = []
+    for idx, name in enumerate(names):
+        encoded = name.encode()
+        entry = encode_field(1, 2, encode_varint(len(encoded)) + encoded) + encode_field(2, 0, encode_varint(idx))
+        parts.append(encode_field(1, 2, encode_varint(len(entry)) + entry))
+    return b"".join(parts)
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic cards.txt or .apkg files for benchmarks')
+    parser.add_argument('output', help='Path of the .txt or .apkg file to write')
+    parser.add_argument('--notes', type=int, default=10_000, help='Number of notes')
+    parser.add_argument('--legacy', action='store_true', help='Write a legacy collection.anki2 instead of collection.anki21b')
+    parser.add_argument('--media', type=int, default=0, help='Number of media files to add to an .apkg')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    args = parser.parse_args()
+
+    if args.output.endswith(".apkg"):
+        write_apkg(args.output, args.notes, compressed=not args.legacy, media_files=args.media, seed=args.seed)
+    else:
+        write_cards_file(args.output, args.notes, args.seed)
+    print(f"Wrote {args.output}")
+
+if __name__ == "__main__":
+    main()
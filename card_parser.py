@@ -0,0 +1,86 @@
+BASIC = 'basic'
+CLOZE = 'cloze'
+INVALID = 'invalid'
+
+class CardRecord:
+    """One parsed card line.
+
+    guid is the explicit GUID or None, kind is BASIC, CLOZE or INVALID,
+    fields the stripped field values (the whole text for INVALID lines) and
+    text the line content after the GUID prefix.
+    """
+    __slots__ = ('guid', 'kind', 'fields', 'text')
+
+    def __init__(self, guid, kind, fields, text):
+        self.guid = guid
+        self.kind = kind
+        self.fields = fields
+        self.text = text
+
+    def __repr__(self):
+        return f"CardRecord(guid={self.guid!r}, kind={self.kind!r}, fields={self.fields!r})"
+
+class ParsedCards:
+    """Result of parse_cards: the records plus the max field count per kind."""
+    __slots__ = ('records', 'max_basic', 'max_cloze')
+
+    def __init__(self, records, max_basic, max_cloze):
+        self.records = records
+        self.max_basic = max_basic
+        self.max_cloze = max_cloze
+
+def parse_line(line):
+    """Parses one line. Returns a CardRecord, or None for blank and comment lines."""
+    line = line.strip()
+    if not line or line[0] == '#':
+        return None
+
+    guid = None
+    if line[0] == '[':
+        part1, sep, part2 = line.partition('] ')
+        if sep:
+            guid = part1[1:]
+            line = part2.strip()
+
+    if '{{c' in line:
+        return CardRecord(guid, CLOZE, [f.strip() for f in line.split(" :: ")], line)
+
+    if "::" in line:
+        fields = line.split(" :: ")
+        # Fallback for Basic cards with no spaces around ::
+        if len(fields) == 1:
+            fields = line.split("::")
+        return CardRecord(guid, BASIC, [f.strip() for f in fields], line)
+
+    return CardRecord(guid, INVALID, [line], line)
+
+def parse_cards(lines):
+    """Parses an iterable of lines in a single pass.
+
+    Returns ParsedCards. The max field counts start at 2, the minimum the
+    Basic and Cloze models are built with.
+    """
+    records = []
+    append = records.append
+    max_basic = 2
+    max_cloze = 2
+
+    for line in lines:
+        record = parse_line(line)
+        if record is None:
+            continue
+        append(record)
+
+        count = len(record.fields)
+        if record.kind is CLOZE:
+            if count > max_cloze:
+                max_cloze = count
+        elif count > max_basic:
+            max_basic = count
+
+    return ParsedCards(records, max_basic, max_cloze)
+
+def parse_card_file(path):
+    """Parses a cards file, see parse_cards."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return parse_cards(f)
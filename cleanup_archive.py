@@ -1,41 +1,96 @@
 #!/usr/bin/env python
 
 import os
-import sys
-import shutil
+import argparse
+from datetime import datetime
+from archive_store import ArchiveStore
 
-def cleanup_archive():
-    archive_dir = os.path.join("generated_decks", "archive")
-    
+def _format_entry(store, entry):
+    archived = datetime.fromtimestamp(entry["archived_at"]).strftime("%Y-%m-%d %H:%M")
+    packed = " (zstd)" if entry["packed"] else ""
+    return f" - {entry['name']}  {archived}  {entry['size'] / 1024:.0f} KiB{packed}  {os.path.relpath(store.blob_path(entry))}"
+
+def cleanup_archive(archive_dir=os.path.join("generated_decks", "archive"), keep=None, max_age_days=None,
+                    max_size_mb=None, pack_older_than=None, list_only=False, assume_yes=False):
+    """Applies retention and packing to the archive store in archive_dir.
+
+    Without any retention option every archived deck is offered for deletion,
+    as before. Returns the number of entries removed.
+    """
     if not os.path.exists(archive_dir):
         print(f"ℹ️  Archive directory not found: {archive_dir}")
-        return
+        return 0
+
+    store = ArchiveStore(archive_dir)
+    store.adopt_loose_files()
 
-    files = [f for f in os.listdir(archive_dir) if os.path.isfile(os.path.join(archive_dir, f))]
-    
-    if not files:
+    if not store.entries:
         print(f"ℹ️  Archive is already empty: {archive_dir}")
-        return
+        return 0
+
+    if list_only:
+        print(f"{len(store.entries)} archived decks in {archive_dir} ({store.total_bytes() / (1 << 20):.1f} MiB stored):")
+        for entry in sorted(store.entries, key=lambda entry: entry["archived_at"]):
+            print(_format_entry(store, entry))
+        return 0
 
-    print(f"found {len(files)} files in {archive_dir}:")
-    for f in files:
-        print(f" - {f}")
-    
-    confirm = input("\n⚠️  Are you sure you want to delete these files? (y/N): ").strip().lower()
-    
-    if confirm == 'y':
-        deleted_count = 0
-        for f in files:
-            file_path = os.path.join(archive_dir, f)
-            try:
-                os.remove(file_path)
-                deleted_count += 1
-            except Exception as e:
-                print(f"❌ Failed to delete {f}: {e}")
-        
-        print(f"\n✅ Successfully deleted {deleted_count} files.")
+    removed = 0
+    if keep is None and max_age_days is None and max_size_mb is None:
+        if pack_older_than is None:
+            removed = _confirm_and_remove(store, list(store.entries), assume_yes)
     else:
-        print("\n🚫 Operation cancelled.")
+        max_bytes = int(max_size_mb * (1 << 20)) if max_size_mb is not None else None
+        expired = store.select_expired(keep=keep, max_age_days=max_age_days, max_bytes=max_bytes)
+        if expired:
+            removed = _confirm_and_remove(store, expired, assume_yes)
+        else:
+            print("✅ Nothing to remove: the archive is within the retention limits.")
+
+    if pack_older_than is not None:
+        packed = store.pack(older_than_days=pack_older_than)
+        print(f"🗜️  Packed {packed} archived decks with zstd.")
+    return removed
+
+def _confirm_and_remove(store, entries, assume_yes):
+    print(f"found {len(entries)} archived decks to delete:")
+    for entry in entries:
+        print(_format_entry(store, entry))
+
+    if not assume_yes:
+        confirm = input("\n⚠️  Are you sure you want to delete these files? (y/N): ").strip().lower()
+        if confirm != 'y':
+            print("\n🚫 Operation cancelled.")
+            return 0
+
+    freed = store.remove(entries)
+    print(f"\n✅ Successfully deleted {len(entries)} archived decks ({freed / (1 << 20):.1f} MiB freed).")
+    return len(entries)
+
+def main():
+    parser = argparse.ArgumentParser(description='Delete or compress archived decks in generated_decks/archive')
+    parser.add_argument('--archive-dir', default=os.path.join("generated_decks", "archive"), help='Archive directory')
+    parser.add_argument('--keep', type=int, help='Keep only the N newest archived builds of each deck')
+    parser.add_argument('--max-age', type=float, metavar='DAYS', help='Delete builds archived more than DAYS ago')
+    parser.add_argument('--max-size', type=float, metavar='MB', help='Delete the oldest builds until the archive fits in MB')
+    parser.add_argument('--pack-older-than', type=float, metavar='DAYS', help='Compress builds archived more than DAYS ago with zstd')
+    parser.add_argument('--list', action='store_true', help='List the archived decks and exit')
+    parser.add_argument('--restore', metavar='NAME', help='Copy the newest archived build called NAME to the current directory and exit')
+    parser.add_argument('-y', '--yes', action='store_true', help='Do not ask for confirmation')
+
+    args = parser.parse_args()
+    if args.restore:
+        store = ArchiveStore(args.archive_dir)
+        store.adopt_loose_files()
+        entry = store.find(args.restore)
+        if entry is None:
+            print(f"❌ No archived deck called {args.restore}")
+            return
+        store.restore(entry, args.restore)
+        print(f"✅ Restored {args.restore}")
+        return
+
+    cleanup_archive(args.archive_dir, keep=args.keep, max_age_days=args.max_age, max_size_mb=args.max_size,
+                    pack_older_than=args.pack_older_than, list_only=args.list, assume_yes=args.yes)
 
 if __name__ == "__main__":
-    cleanup_archive()
+    main()
@@ -0,0 +1,143 @@
+import os
+import json
+import sqlite3
+import hashlib
+import tempfile
+import pathlib
+
+# Environment overrides for the cache location and size cap
+CACHE_DIR_ENV = "ANKI_PROCESSING_CACHE_DIR"
+CACHE_MAX_MB_ENV = "ANKI_PROCESSING_CACHE_MAX_MB"
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "anki_processing")
+DEFAULT_MAX_BYTES = 2 << 30 # 2 GiB
+
+# Zip members whose content determines a cache entry
+KEY_MEMBERS = ("collection.anki21b", "collection.anki2", "media")
+
+# Read size used when hashing members for the key (1 MiB)
+HASH_CHUNK_SIZE = 1 << 20
+
+DB_SUFFIX = ".anki2"
+MEDIA_SUFFIX = ".media.json"
+
+class CacheEntry:
+    def __init__(self, db_path, media_map_path):
+        self.db_path = db_path
+        self.media_map_path = media_map_path
+
+    def connect(self):
+        """Opens the cached collection read-only."""
+        # as_uri() percent-encodes the path, so '?', '#' and '%' in the cache dir are safe
+        uri = pathlib.Path(os.path.abspath(self.db_path)).as_uri()
+        return sqlite3.connect(f"{uri}?mode=ro", uri=True)
+
+    def load_media_map(self):
+        with open(self.media_map_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+class CollectionCache:
+    """Content-addressed store of decompressed collections and parsed media maps.
+
+    Entries are keyed by the content of the collection and media map members
+    of an apkg, so an unchanged deck is served without any decompression.
+    The total size is capped at max_bytes; the least recently used entries
+    are evicted first.
+    """
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+        if max_bytes is None:
+            max_mb = os.environ.get(CACHE_MAX_MB_ENV)
+            max_bytes = int(max_mb) * 1024 * 1024 if max_mb else DEFAULT_MAX_BYTES
+        self.max_bytes = max_bytes
+
+    def key_for(self, z):
+        """Returns the cache key for an open zipfile.ZipFile (or anki_unpacker.MappedZip).
+
+        The key is a sha256 of the name, size and bytes of each relevant
+        member as stored in the zip (still compressed for zstd collections),
+        so two decks only share an entry when their content is identical.
+        Hashing the stored bytes costs a fraction of decompressing them.
+        """
+        h = hashlib.sha256()
+        names = set(z.namelist())
+        for name in KEY_MEMBERS:
+            if name in names:
+                info = z.getinfo(name)
+                h.update(f"{name}:{info.file_size}\n".encode())
+                with z.open(name) as f:
+                    for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                        h.update(chunk)
+        return h.hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + DB_SUFFIX, base + MEDIA_SUFFIX
+
+    def get(self, key):
+        """Returns the CacheEntry for key, or None on a miss. Marks the entry as recently used."""
+        db_path, media_map_path = self._paths(key)
+        if not (os.path.exists(db_path) and os.path.exists(media_map_path)):
+            return None
+
+        try:
+            os.utime(db_path)
+            os.utime(media_map_path)
+        except OSError:
+            return None # Evicted concurrently
+        return CacheEntry(db_path, media_map_path)
+
+    def put(self, key, conn, media_map):
+        """Stores the collection open on conn and its media map under key."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        db_path, media_map_path = self._paths(key)
+
+        # Write to temp names and rename so readers never see a partial entry
+        fd, tmp_db = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        os.close(fd)
+        tmp_media = None
+        try:
+            dst = sqlite3.connect(tmp_db)
+            try:
+                conn.backup(dst)
+            finally:
+                dst.close()
+
+            fd, tmp_media = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(media_map, f)
+
+            os.replace(tmp_db, db_path)
+            os.replace(tmp_media, media_map_path)
+        finally:
+            for path in (tmp_db, tmp_media):
+                if path and os.path.exists(path):
+                    os.remove(path)
+
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        total = 0
+        for filename in os.listdir(self.cache_dir):
+            if not filename.endswith(DB_SUFFIX):
+                continue
+            key = filename[:-len(DB_SUFFIX)]
+            db_path, media_map_path = self._paths(key)
+            try:
+                st = os.stat(db_path)
+                size = st.st_size + (os.path.getsize(media_map_path) if os.path.exists(media_map_path) else 0)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, size, key))
+            total += size
+
+        entries.sort()
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+            total -= size
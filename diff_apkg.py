@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import argparse
+
+from anki_unpacker import AnkiDeckUnpacker, GUID_LOOKUP_BATCH
+from instrumentation import stage, profiler, add_profile_arguments, start_from_args
+
+def merge_diff(old_digests, new_digests):
+    """Merge-joins two GUID-ordered (guid, digest) streams.
+
+    Yields ('added' | 'removed' | 'changed', guid). Only the current row of
+    each side is held, so memory stays flat for any deck size.
+    """
+    old = next(old_digests, None)
+    new = next(new_digests, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            yield 'removed', old[0]
+            old = next(old_digests, None)
+        elif old is None or new[0] < old[0]:
+            yield 'added', new[0]
+            new = next(new_digests, None)
+        else:
+            if old[1] != new[1]:
+                yield 'changed', old[0]
+            old = next(old_digests, None)
+            new = next(new_digests, None)
+
+def field_changes(old_flds, new_flds):
+    """Returns [(field index, old text, new text)] for fields that differ."""
+    old_fields = old_flds.split('\x1f')
+    new_fields = new_flds.split('\x1f')
+    changes = []
+    for i in range(max(len(old_fields), len(new_fields))):
+        before = old_fields[i] if i < len(old_fields) else None
+        after = new_fields[i] if i < len(new_fields) else None
+        if before != after:
+            changes.append((i, before, after))
+    return changes
+
+def diff_apkgs(old_path, new_path, verbose=False, cache=True):
+    """Prints the notes added, removed and changed between two apkgs.
+
+    Notes are compared by content digest first; field text is only read
+    (by indexed GUID lookup) for changed notes when verbose is set.
+    Returns {'added': n, 'removed': n, 'changed': n}.
+    """
+    counts = {'added': 0, 'removed': 0, 'changed': 0}
+    with AnkiDeckUnpacker(old_path, cache=cache) as old, AnkiDeckUnpacker(new_path, cache=cache) as new:
+        old.unpack(media=False)
+        new.unpack(media=False)
+        
+        changed = []
+        with stage("merge_diff"):
+            for kind, guid in merge_diff(old.note_digests(), new.note_digests()):
+                counts[kind] += 1
+                if kind == 'changed':
+                    if verbose:
+                        changed.append(guid)
+                        if len(changed) >= GUID_LOOKUP_BATCH:
+                            _print_changes(old, new, changed)
+                            changed = []
+                    else:
+                        print(f"✏️  [{guid}]")
+                else:
+                    print(f"{'➕' if kind == 'added' else '➖'} [{guid}]")
+        if changed:
+            _print_changes(old, new, changed)
+    
+    print(f"\nAdded: {counts['added']}, removed: {counts['removed']}, changed: {counts['changed']}")
+    if not any(counts.values()):
+        print("✅ Decks are identical")
+    return counts
+
+def _print_changes(old, new, guids):
+    old_notes = dict(old.find_notes(guids, columns=('guid', 'flds')))
+    new_notes = dict(new.find_notes(guids, columns=('guid', 'flds')))
+    for guid in guids:
+        print(f"✏️  [{guid}]")
+        changes = field_changes(old_notes[guid], new_notes[guid])
+        if not changes:
+            print("    note type changed")
+        for i, before, after in changes:
+            print(f"    field {i + 1}: {before!r} -> {after!r}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Show notes added, removed and changed between two .apkg files')
+    parser.add_argument('old_apkg', help='Path to the older .apkg file')
+    parser.add_argument('new_apkg', help='Path to the newer .apkg file')
+    parser.add_argument('-v', '--verbose', action='store_true', help='Print the changed fields of changed notes')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the decompressed collection cache')
+    add_profile_arguments(parser)
+    
+    args = parser.parse_args()
+    start_from_args(args)
+    
+    for path in (args.old_apkg, args.new_apkg):
+        if not os.path.exists(path):
+            print(f"Error: APKG file not found: {path}")
+            sys.exit(2)
+    
+    counts = diff_apkgs(args.old_apkg, args.new_apkg, args.verbose, cache=not args.no_cache)
+    profiler.finish()
+    sys.exit(1 if any(counts.values()) else 0)
@@ -1,113 +1,462 @@
 #!/usr/bin/env python
 
 import os
+import io
+import sys
+import glob
+import re
+import html
+import json
 import shutil
 import argparse
-from anki_unpacker import AnkiDeckUnpacker
+import tempfile
+import contextlib
+from urllib.parse import quote
+from anki_unpacker import AnkiDeckUnpacker, MEDIA_EXPORT_MODES, media_references
+from archive_store import ArchiveStore, INDEX_NAME as ARCHIVE_INDEX_NAME, PACKED_SUFFIX, unpack_blob
 from verify_guids import verify
+from instrumentation import stage, profiler, add_profile_arguments, start_from_args
 
-def unpack_and_review(apkg_path, output_dir="anki_review_output"):
+# Cards per HTML page; 0 puts every card on index.html
+PAGE_SIZE = 1000
+
+HTML_STYLE = [
+    "<style>",
+    "body { font-family: sans-serif; max_width: 800px; margin: 20px auto; background: #f4f4f9; }",
+    ".card { background: white; padding: 20px; margin-bottom: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }",
+    "img { max-width: 100%; height: auto; }",
+    ".field-sep { border-top: 1px dashed #ccc; margin: 10px 0; }",
+    ".nav { margin: 20px 0; }",
+    "</style>",
+]
+
+def unpack_and_review(apkg_path, output_dir="anki_review_output", unpacker=None, media_mode='stream', workers=None,
+                      page_size=PAGE_SIZE, json_data=False, deck_name=None):
+    """Dumps apkg_path into output_dir. Returns the number of cards.
+
+    If an AnkiDeckUnpacker is passed it is reused and left open for the
+    caller; otherwise one is created and closed here. An unpacker that is
+    not unpacked yet is unpacked here, so the media export already starts
+    while the collection loads. Media is exported in the background while
+    the cards are rendered.
+    deck_name titles the pages (default: the apkg file name).
+    """
     # 1. Prepare Output Directory
     if os.path.exists(output_dir):
         shutil.rmtree(output_dir)
     os.makedirs(output_dir)
     
-    unpacker = AnkiDeckUnpacker(apkg_path)
-    unpacker.unpack()
+    owns_unpacker = unpacker is None
+    if owns_unpacker:
+        unpacker = AnkiDeckUnpacker(apkg_path)
     
     # Export media to nested 'media' folder
     media_dir = os.path.join(output_dir, "media")
-    unpacker.export_media(media_dir)
     
     try:
-        notes = unpacker.get_notes()
-        deck_name = os.path.basename(apkg_path)
+        if unpacker.unpacked:
+            unpacker.start_media_export(media_dir, mode=media_mode, workers=workers)
+        else:
+            unpacker.unpack(media_target=media_dir, media_mode=media_mode, media_workers=workers)
+        
+        deck_name = deck_name or os.path.basename(apkg_path)
         
-        _generate_html(notes, output_dir, deck_name)
-        _generate_text(notes, output_dir)
+        # Each writer streams its own pass over the notes
+        with stage("html"):
+            count = _generate_html(unpacker.get_notes(), output_dir, deck_name, page_size, json_data)
+        with stage("text"):
+            _generate_text(unpacker.get_notes(), output_dir)
+        unpacker.wait_for_media()
+        return count
         
     finally:
-        unpacker.close()
+        if owns_unpacker:
+            unpacker.close()
 
-def _generate_html(notes, output_dir, deck_name):
-    """Generates a Review HTML Page."""
-    html_path = os.path.join(output_dir, "index.html")
-    
-    html_content = [
-        "<html><head><style>",
-        "body { font-family: sans-serif; max_width: 800px; margin: 20px auto; background: #f4f4f9; }",
-        ".card { background: white; padding: 20px; margin-bottom: 20px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); }",
-        "img { max-width: 100%; height: auto; }",
-        ".field-sep { border-top: 1px dashed #ccc; margin: 10px 0; }",
-        "</style></head><body>",
-        f"<h1>Deck Preview: {deck_name}</h1>"
-    ]
+def _page_name(number):
+    return f"page-{number:05d}.html"
+
+def _generate_html(notes, output_dir, deck_name, page_size=PAGE_SIZE, json_data=False, html_name="index.html"):
+    """Generates the Review HTML, writing cards as they are read.
+
+    Cards are split into pages of page_size cards (page-00001.html, ...)
+    with prev/next links, and index.html links to every page. With
+    page_size=0 all cards go on index.html. Only the current page is held
+    open, so memory does not grow with the deck. json_data also writes
+    cards.json and a viewer.html that loads it in chunks.
+    Returns the number of cards written.
+    """
+    html_path = os.path.join(output_dir, html_name)
+    json_file = open(os.path.join(output_dir, "cards.json"), "w", encoding="utf-8") if json_data else None
     
-    for note in notes:
-        # Anki fields are separated by the hex character 0x1f
-        fields = note[0].split('\x1f')
-        guid = note[1]
+    try:
+        if json_file:
+            json_file.write("[")
         
-        card_html = f'<div class="card" data-guid="{guid}">'
-        for i, field in enumerate(fields):
-            # Update image paths to point to media folder
-            field = field.replace('src="', 'src="media/')
-            
-            if i > 0:
-                card_html += '<div class="field-sep"></div>'
-            card_html += f'<div>{field}</div>'
-        card_html += '</div>'
+        if page_size <= 0:
+            with open(html_path, "w", encoding="utf-8") as f:
+                _write_page_header(f, f"Deck Preview: {deck_name}")
+                count = 0
+                for note in notes:
+                    f.write("\n" + _render_card(note))
+                    _write_json_card(json_file, note, count)
+                    count += 1
+                f.write("\n</body></html>")
+        else:
+            pages, count = _write_pages(notes, output_dir, deck_name, page_size, json_file)
+            _write_index(html_path, deck_name, pages, count)
         
-        html_content.append(card_html)
-    
-    html_content.append("</body></html>")
+        if json_file:
+            json_file.write("\n]")
+    finally:
+        if json_file:
+            json_file.close()
     
-    with open(html_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(html_content))
+    if json_data:
+        _write_viewer(output_dir, deck_name)
         
     print(f"Done! Open this file to review: {html_path}")
+    return count
+
+def _write_page_header(f, title):
+    f.write("\n".join(["<html><head><meta charset=\"utf-8\">"] + HTML_STYLE + ["</head><body>", f"<h1>{html.escape(title)}</h1>"]))
+
+def _write_pages(notes, output_dir, deck_name, page_size, json_file):
+    """Streams notes into page files. Returns ([(page name, first card, last card)], card count)."""
+    pages = []
+    f = None
+    count = 0
+    try:
+        for note in notes:
+            if count % page_size == 0:
+                number = len(pages) + 1
+                if f:
+                    # Another card arrived, so the full page gets a next link
+                    _close_page(f, number - 1, has_next=True)
+                f = open(os.path.join(output_dir, _page_name(number)), "w", encoding="utf-8")
+                _write_page_header(f, f"Deck Preview: {deck_name} (page {number})")
+                f.write("\n" + _page_nav(number, has_next=False))
+                pages.append([_page_name(number), count + 1, count + 1])
+            f.write("\n" + _render_card(note))
+            _write_json_card(json_file, note, count)
+            count += 1
+            pages[-1][2] = count
+        if f:
+            _close_page(f, len(pages), has_next=False)
+            f = None
+    finally:
+        if f:
+            f.close()
+    return pages, count
+
+def _page_nav(number, has_next):
+    links = ['<a href="index.html">Index</a>']
+    if number > 1:
+        links.append(f'<a href="{_page_name(number - 1)}">&larr; Previous</a>')
+    if has_next:
+        links.append(f'<a href="{_page_name(number + 1)}">Next &rarr;</a>')
+    return f'<div class="nav">{" | ".join(links)}</div>'
+
+def _close_page(f, number, has_next):
+    f.write("\n" + _page_nav(number, has_next))
+    f.write("\n</body></html>")
+    f.close()
+
+def _write_index(html_path, deck_name, pages, count):
+    with open(html_path, "w", encoding="utf-8") as f:
+        _write_page_header(f, f"Deck Preview: {deck_name}")
+        f.write(f"\n<p>{count} cards on {len(pages)} pages</p>\n<ul>")
+        for name, first, last in pages:
+            f.write(f'\n<li><a href="{name}">Cards {first}&ndash;{last}</a></li>')
+        f.write("\n</ul>\n</body></html>")
+
+def _write_json_card(json_file, note, index):
+    if json_file:
+        json_file.write(("\n" if index == 0 else ",\n") + json.dumps({"guid": note[1], "fields": note[0].split('\x1f')}))
+
+# Renders cards.json 200 at a time as the reader scrolls. fetch() needs the
+# folder to be served, e.g. `python -m http.server` inside the output dir.
+VIEWER_SCRIPT = """<div id="cards"></div>
+<script>
+let cards = [], shown = 0;
+function more() {
+  const root = document.getElementById('cards');
+  for (const card of cards.slice(shown, shown + 200)) {
+    const div = document.createElement('div');
+    div.className = 'card';
+    div.dataset.guid = card.guid;
+    div.innerHTML = card.fields.map(f => '<div>' + f.replaceAll('src="', 'src="media/') + '</div>').join('<div class="field-sep"></div>');
+    root.appendChild(div);
+  }
+  shown += 200;
+}
+window.addEventListener('scroll', () => {
+  if (window.innerHeight + window.scrollY >= document.body.offsetHeight - 500) more();
+});
+fetch('cards.json').then(r => r.json()).then(data => { cards = data; more(); });
+</script>
+</body></html>"""
+
+def _write_viewer(output_dir, deck_name):
+    with open(os.path.join(output_dir, "viewer.html"), "w", encoding="utf-8") as f:
+        _write_page_header(f, f"Deck Preview: {deck_name}")
+        f.write("\n" + VIEWER_SCRIPT)
+
+def _render_card(note):
+    """Renders one (flds, guid) note as a card div."""
+    # Anki fields are separated by the hex character 0x1f
+    fields = note[0].split('\x1f')
+    guid = note[1]
+    
+    # Update image paths to point to media folder
+    parts = ['<div>' + field.replace('src="', 'src="media/') + '</div>' for field in fields]
+    return f'<div class="card" data-guid="{guid}">' + '<div class="field-sep"></div>'.join(parts) + '</div>'
 
 def _generate_text(notes, output_dir):
     """Generates a Raw Text File ([GUID] Front :: Back)."""
     txt_path = os.path.join(output_dir, "cards.txt")
-    text_content = []
-    
-    for note in notes:
-        fields = note[0].split('\x1f')
-        guid = note[1]
-        
-        # Assume back is only the last field
-        if len(fields) >= 1:
-            line_content = " :: ".join([f.strip().replace('\n', '\x1f') for f in fields])
-            text_content.append(f"[{guid}] {line_content}")
     
     with open(txt_path, "w", encoding="utf-8") as f:
-        f.write("\n".join(text_content))
+        sep = ""
+        for note in notes:
+            f.write(f"{sep}{_text_line(note)}")
+            sep = "\n"
         
     print(f"Generated raw text file: {txt_path}")
 
+def _text_line(note):
+    """Formats one (flds, guid) note as a cards.txt line."""
+    fields = note[0].split('\x1f')
+    line_content = " :: ".join([field.strip().replace('\n', '\x1f') for field in fields])
+    return f"[{note[1]}] {line_content}"
+
+def query_notes(unpacker, output_dir, guids=(), pattern=None, media_mode='stream'):
+    """Prints the notes with the given GUIDs or whose front matches pattern.
+
+    Unlike unpack_and_review() nothing is wiped or fully rendered: the
+    matches go to output_dir/query.html and only the media they reference
+    is exported to output_dir/media. Returns the matching notes.
+    """
+    notes = unpacker.find_notes(guids, pattern)
+    
+    found = {note[1] for note in notes}
+    for guid in guids:
+        if guid not in found:
+            print(f"❌ GUID not found: {guid}")
+    for note in notes:
+        print(_text_line(note))
+    print(f"Found {len(notes)} notes")
+    
+    if notes:
+        os.makedirs(output_dir, exist_ok=True)
+        names = set()
+        for note in notes:
+            names |= media_references(note[0])
+        if names:
+            unpacker.export_media(os.path.join(output_dir, "media"), mode=media_mode, names=names)
+        _generate_html(notes, output_dir, os.path.basename(unpacker.apkg_path), page_size=0, html_name="query.html")
+    return notes
+
+def expand_apkg_paths(apkg_path):
+    """Returns [(name, path)] for the apkgs named by a file path, a directory (its *.apkg files) or a glob.
+
+    An archive directory (see archive_store.ArchiveStore) yields every
+    archived build under its original file name, with path pointing at its
+    blob (.apkg.zst once packed). An existing file is taken as is, even if
+    its name contains glob characters.
+    """
+    if os.path.isfile(apkg_path):
+        paths = [apkg_path]
+    elif os.path.isdir(apkg_path):
+        if os.path.exists(os.path.join(apkg_path, ARCHIVE_INDEX_NAME)):
+            store = ArchiveStore(apkg_path)
+            entries = sorted(store.entries, key=lambda entry: entry["archived_at"])
+            return [(entry["name"], store.blob_path(entry)) for entry in entries]
+        paths = sorted(glob.glob(os.path.join(apkg_path, "*.apkg")))
+    elif glob.has_magic(apkg_path):
+        paths = sorted(p for p in glob.glob(apkg_path) if os.path.isfile(p))
+    else:
+        paths = []
+    return [(os.path.basename(path), path) for path in paths]
+
+def _deck_dirs(names):
+    """Returns a distinct output subdirectory name for each apkg file name."""
+    dirs = []
+    used = set()
+    for name in names:
+        base = name[:-len(".apkg")] if name.endswith(".apkg") else name
+        sub = base
+        n = 1
+        while sub in used:
+            n += 1
+            sub = f"{base}_{n}"
+        used.add(sub)
+        dirs.append(sub)
+    return dirs
+
+def _dump_one(name, apkg_path, deck_dir, temp_root, media_mode, media_workers, page_size, json_data, cache):
+    """Dumps and verifies one apkg of a batch in a pool worker. Returns (card count, GUIDs match).
+
+    Its messages, and the error if it fails, go to deck_dir/dump.log
+    instead of the shared console.
+    """
+    output = io.StringIO()
+    count = verified = None
+    try:
+        with contextlib.redirect_stdout(output):
+            temp_dir = tempfile.mkdtemp(dir=temp_root)
+            try:
+                if apkg_path.endswith(PACKED_SUFFIX):
+                    restored = os.path.join(temp_dir, name)
+                    unpack_blob(apkg_path, restored)
+                    apkg_path = restored
+                with AnkiDeckUnpacker(apkg_path, cache=cache, temp_root=temp_dir) as unpacker:
+                    count = unpack_and_review(apkg_path, deck_dir, unpacker=unpacker, media_mode=media_mode,
+                                              workers=media_workers, page_size=page_size, json_data=json_data,
+                                              deck_name=name)
+                    print("\n--- Verifying GUIDs ---")
+                    verified = verify(os.path.join(deck_dir, "cards.txt"), apkg_path, unpacker=unpacker)
+            except Exception as e:
+                print(f"❌ {e}")
+                raise
+            finally:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+    finally:
+        if os.path.isdir(deck_dir):
+            with open(os.path.join(deck_dir, "dump.log"), "w", encoding="utf-8") as f:
+                f.write(output.getvalue())
+    return count, verified
+
+def dump_batch(apkgs, output_dir, workers=None, media_mode='stream', media_workers=None, page_size=PAGE_SIZE,
+               json_data=False, cache=False):
+    """Dumps many apkgs in a process pool, each into its own subdirectory of output_dir.
+
+    apkgs is [(name, path)] as returned by expand_apkg_paths(). Up to
+    workers decks are unpacked, have their media exported and are rendered
+    at once. They share a temp area inside output_dir, so hardlinked media
+    stays on one filesystem. output_dir/index.html links every deck.
+    Per-deck failures are collected and returned as [(name, error message)]
+    instead of aborting the batch. The collection cache is off unless cache
+    is given: a whole directory or archive would evict the decks in daily use.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    os.makedirs(output_dir, exist_ok=True)
+    subdirs = _deck_dirs([name for name, _ in apkgs])
+    results = {}
+    failures = []
+    
+    temp_root = tempfile.mkdtemp(prefix=".tmp-", dir=output_dir)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(_dump_one, name, path, os.path.join(output_dir, sub), temp_root, media_mode,
+                            media_workers, page_size, json_data, cache): (name, sub)
+                for (name, path), sub in zip(apkgs, subdirs)
+            }
+            for future in as_completed(futures):
+                name, sub = futures[future]
+                try:
+                    results[sub] = future.result()
+                    count, verified = results[sub]
+                    print(f"{'✅' if verified else '⚠️ '} {name}: {count} cards -> {os.path.join(output_dir, sub)}")
+                except Exception as e:
+                    results[sub] = str(e) or type(e).__name__
+                    failures.append((name, results[sub]))
+    finally:
+        shutil.rmtree(temp_root, ignore_errors=True)
+    
+    html_path = os.path.join(output_dir, "index.html")
+    _write_batch_index(html_path, [(name, sub, results.get(sub)) for (name, _), sub in zip(apkgs, subdirs)])
+    
+    print(f"\n📚 Batch finished: {len(apkgs) - len(failures)} dumped, {len(failures)} failed. "
+          f"Open this file to review: {html_path}")
+    for name, error in failures:
+        print(f"❌ {name}: {error}")
+    return failures
+
+def _write_batch_index(html_path, decks):
+    """Writes the page linking each deck of a batch; decks is [(name, subdirectory, result or error)]."""
+    with open(html_path, "w", encoding="utf-8") as f:
+        _write_page_header(f, f"{len(decks)} decks")
+        f.write("\n<ul>")
+        for name, sub, result in decks:
+            if isinstance(result, tuple):
+                count, verified = result
+                status = f"{count} cards" + ("" if verified else ", GUID check failed")
+                f.write(f'\n<li><a href="{html.escape(quote(sub))}/index.html">{html.escape(name)}</a> ({status})</li>')
+            else:
+                f.write(f"\n<li>{html.escape(name)} (failed: {html.escape(str(result))})</li>")
+        f.write("\n</ul>\n</body></html>")
 
 def main():
     parser = argparse.ArgumentParser(description='Unpack Anki APKG file to HTML/Text for review')
-    parser.add_argument('apkg_path', help='Path to the .apkg file')
+    parser.add_argument('apkg_path',
+                        help='Path to the .apkg file, or a directory / quoted glob of them (or an archive directory) to dump as a batch')
     parser.add_argument('--output_dir', default='anki_review_output', help='Directory to output files')
+    parser.add_argument('--media-mode', choices=MEDIA_EXPORT_MODES, default='stream',
+                        help='How media reaches the output: streamed from the apkg, or hardlinked/reflinked/copied from a temp copy')
+    parser.add_argument('--media-workers', type=int, default=None, help='Threads used to export media')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='Cards per HTML page (0 for a single page)')
+    parser.add_argument('--json-data', action='store_true', help='Also write cards.json and a viewer.html that loads it lazily')
+    parser.add_argument('--guid', action='append', default=[],
+                        help='Only look up the note with this GUID (repeatable). A deck that is not cached yet is '
+                             'decompressed and cached in full on the first lookup')
+    parser.add_argument('--grep', metavar='PATTERN',
+                        help='Only look up notes whose front matches this regular expression (same caching as --guid)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes used for batch dumps (default: number of CPUs)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the decompressed collection cache (batch dumps never use it)')
+    add_profile_arguments(parser)
     
     args = parser.parse_args()
+    if args.grep is not None:
+        try:
+            re.compile(args.grep)
+        except re.error as e:
+            parser.error(f"invalid --grep pattern {args.grep!r}: {e}")
     
-    if not os.path.exists(args.apkg_path):
+    args.apkgs = expand_apkg_paths(args.apkg_path)
+    if not args.apkgs:
         print(f"Error: File not found: {args.apkg_path}")
         return
 
-    unpack_and_review(args.apkg_path, args.output_dir)
-
-    # Verify GUIDs
-    print("\n--- Verifying GUIDs ---")
+    start_from_args(args)
     try:
-        verify(os.path.join(args.output_dir, "cards.txt"), args.apkg_path)
-    except ImportError:
-        print("Warning: verify_guids module not found. Skipping verification.")
-    except Exception as e:
-        print(f"Warning: Verification failed: {e}")
+        _dump(args)
+    finally:
+        profiler.finish()
+
+def _dump(args):
+    # A directory or glob dumps every matching apkg as one batch
+    if args.apkgs != [(os.path.basename(args.apkg_path), args.apkg_path)]:
+        if args.guid or args.grep is not None:
+            print("❌ --guid and --grep query a single .apkg file")
+            sys.exit(1)
+        failures = dump_batch(args.apkgs, args.output_dir, args.workers, args.media_mode, args.media_workers,
+                              args.page_size, args.json_data)
+        if failures:
+            sys.exit(1)
+        return
+    
+    # Open the package once and share it between the dump and the verification
+    with AnkiDeckUnpacker(args.apkg_path, cache=not args.no_cache) as unpacker:
+        if args.guid or args.grep is not None:
+            unpacker.unpack()
+            query_notes(unpacker, args.output_dir, args.guid, args.grep, args.media_mode)
+            return
+        
+        unpack_and_review(args.apkg_path, args.output_dir, unpacker=unpacker,
+                          media_mode=args.media_mode, workers=args.media_workers,
+                          page_size=args.page_size, json_data=args.json_data)
+
+        # Verify GUIDs
+        print("\n--- Verifying GUIDs ---")
+        try:
+            verify(os.path.join(args.output_dir, "cards.txt"), args.apkg_path, unpacker=unpacker)
+        except ImportError:
+            print("Warning: verify_guids module not found. Skipping verification.")
+        except Exception as e:
+            print(f"Warning: Verification failed: {e}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
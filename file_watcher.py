@@ -0,0 +1,144 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# inotify event masks (linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Editors often save by writing a temp file and renaming it over the
+# original, so directories are watched rather than the files themselves
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_MODIFY
+
+EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+
+# Seconds without further events before a burst of saves counts as done
+DEFAULT_DEBOUNCE = 0.2
+
+# Seconds between directory scans for PollingWatcher
+DEFAULT_POLL_INTERVAL = 0.5
+
+class PollingWatcher:
+    """Detects changed files in dirs by comparing mtime and size between scans."""
+    def __init__(self, dirs, interval=DEFAULT_POLL_INTERVAL):
+        self.dirs = list(dirs)
+        self.interval = interval
+        self.snapshot = self._scan()
+
+    def _scan(self):
+        snapshot = {}
+        for directory in self.dirs:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                snapshot[os.path.abspath(entry.path)] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def wait(self, timeout=None):
+        """Returns the set of paths changed since the last call, waiting up to timeout seconds."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self._scan()
+            changed = {path for path in snapshot.keys() | self.snapshot.keys()
+                       if snapshot.get(path) != self.snapshot.get(path)}
+            self.snapshot = snapshot
+            if changed:
+                return changed
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+            time.sleep(self.interval if deadline is None else max(0, min(self.interval, deadline - time.monotonic())))
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """Linux inotify watcher for dirs, called through ctypes."""
+    def __init__(self, dirs):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._libc = libc
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}
+        try:
+            for directory in dirs:
+                wd = libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+                if wd < 0:
+                    raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+                self.dirs[wd] = os.path.abspath(directory)
+        except OSError:
+            os.close(self.fd)
+            raise
+
+    def wait(self, timeout=None):
+        """Returns the set of paths changed since the last call, waiting up to timeout seconds."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if not data:
+                break
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, pos)
+                pos += EVENT_HEADER.size
+                name = data[pos:pos + length].rstrip(b"\0")
+                pos += length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were dropped: report every watched directory, callers rebuild all they hold
+                    changed.update(self.dirs.values())
+                elif wd in self.dirs and name:
+                    changed.add(os.path.join(self.dirs[wd], os.fsdecode(name)))
+        return changed
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+def make_watcher(dirs, polling=False):
+    """Returns an InotifyWatcher on Linux, or a PollingWatcher where inotify is unavailable."""
+    if not polling and sys.platform.startswith("linux"):
+        try:
+            return InotifyWatcher(dirs)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(dirs)
+
+def wait_for_changes(watcher, debounce=DEFAULT_DEBOUNCE):
+    """Blocks until files change, then keeps collecting until debounce seconds pass quietly.
+
+    Returns every path changed during the burst.
+    """
+    changed = watcher.wait()
+    while True:
+        more = watcher.wait(debounce)
+        if not more:
+            return changed
+        changed |= more
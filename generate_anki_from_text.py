@@ -1,11 +1,22 @@
 #!/usr/bin/env python
 
-import genanki
 import random
 import sys
 import os
+import glob
+import time
+import argparse
+import incremental_build
 from datetime import datetime
-from verify_guids import verify
+from verify_guids import verify_deck, read_guids_from_apkg
+from card_parser import parse_cards, BASIC, CLOZE
+from archive_store import ArchiveStore
+from instrumentation import stage, profiler, add_profile_arguments, start_from_args
+from lazy_import import lazy_import
+
+# genanki takes longer to import than everything else together, and --help,
+# unchanged decks and batch planning never touch it
+genanki = lazy_import("genanki")
 
 # Define Models Globally
 SHARED_CSS = """
@@ -78,71 +89,34 @@ def create_cloze_model(num_fields):
 
 def analyze_field_counts(cards):
     """Scans all cards to find max field counts for Basic and Cloze types."""
-    max_basic = 2
-    max_cloze = 2
-    
-    for line in cards:
-        if line.strip().startswith('#') or not line.strip():
-            continue
-            
-        line = line.strip()
-        if line.startswith('[') and '] ' in line:
-            _, _, line = line.partition('] ')
-            line = line.strip()
-            
-        fields = line.split(" :: ")
-        # Fallback split check
-        if len(fields) == 1 and "::" in line and not "{{c" in line:
-             fields = line.split("::")
-             
-        count = len(fields)
-        
-        if '{{c' in line:
-            max_cloze = max(max_cloze, count)
-        else:
-            max_basic = max(max_basic, count)
-            
-    return max_basic, max_cloze
+    parsed = parse_cards(cards)
+    return parsed.max_basic, parsed.max_cloze
 
 def create_deck(deck_name, cards):
     """Creates a single deck containing both Basic and Cloze cards."""
+    return create_deck_from_records(deck_name, parse_cards(cards))
+
+def create_deck_from_records(deck_name, parsed):
+    """Creates a deck from the ParsedCards returned by card_parser.parse_cards."""
     deck = genanki.Deck(random.randrange(1 << 30, 1 << 31), deck_name)
     
-    # 1. Analyze cards to determine model requirements
-    num_basic, num_cloze = analyze_field_counts(cards)
+    # 1. Field counts were collected while parsing
+    num_basic, num_cloze = parsed.max_basic, parsed.max_cloze
     
     basic_model = create_basic_model(num_basic)
     cloze_model = create_cloze_model(num_cloze)
 
-    for line in cards:
-        # ignore comments
-        if line.strip().startswith('#'):
-            continue
-        
-        line = line.strip()
-        if not line:
-            continue
-
-        # Check for [GUID] at the start
-        guid = None
-        if line.startswith('[') and '] ' in line:
-            part1, sep, part2 = line.partition('] ')
-            guid = part1[1:]
-            line = part2.strip()
+    for record in parsed.records:
+        guid = record.guid
+        fields = record.fields
 
-        # Determine Card Type
-        if '{{c' in line:
-            # Cloze Card
+        if record.kind is CLOZE:
             # If no GUID provided, generate one based on content
             if not guid:
-                guid = genanki.guid_for(line, cloze_model.model_id)
-            
-            fields = line.split(" :: ")
-            fields = [f.strip() for f in fields]
+                guid = genanki.guid_for(record.text, cloze_model.model_id)
             
             # Pad fields
-            while len(fields) < num_cloze:
-                fields.append("")
+            fields = fields + [""] * (num_cloze - len(fields))
                 
             deck.add_note(genanki.Note(
                 model=cloze_model,
@@ -150,19 +124,9 @@ def create_deck(deck_name, cards):
                 guid=guid
             ))
             
-        elif "::" in line:
-            # Basic Card
-            # Basic/Generic Card
-            fields = line.split(" :: ")
-            # Fallback for Basic cards with no spaces around :: if strict split fails to find multiple fields
-            if len(fields) == 1 and "::" in line:
-                 fields = line.split("::")
-
-            fields = [f.strip() for f in fields]
-            
+        elif record.kind is BASIC:
             # Pad fields
-            while len(fields) < num_basic:
-                fields.append("")
+            fields = fields + [""] * (num_basic - len(fields))
             
             # If no GUID provided, generate one based on Front field
             if not guid:
@@ -174,24 +138,52 @@ def create_deck(deck_name, cards):
                 guid=guid
             ))
         else:
-            print(f"⚠️ Skipping invalid line: {line}")
+            print(f"⚠️ Skipping invalid line: {record.text}")
 
     return deck
 
 def parse_arguments():
     """Parse and validate command line arguments."""
-    if len(sys.argv) < 2:
+    parser = argparse.ArgumentParser(description='Generate Anki .apkg decks from cards text files')
+    parser.add_argument('input_path', nargs='?',
+                        help='Cards text file, or a directory / quoted glob of them to build as a batch')
+    parser.add_argument('--force', action='store_true', help='Rebuild the whole deck, ignoring the previous build')
+    parser.add_argument('--backend', choices=['genanki', 'native'], default='genanki',
+                        help='Writer for full builds: genanki.Package or the bulk SQLite writer')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Processes used for batch builds (default: number of CPUs)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and rebuild decks whenever their cards files change')
+    parser.add_argument('--poll', action='store_true', help='With --watch, poll for changes instead of using inotify')
+    parser.add_argument('--check-output', action='store_true',
+                        help='Also read the GUIDs back from each written .apkg (loads its collection again)')
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+    
+    if args.input_path is None:
         default_path = os.path.join("anki_review_output", "cards.txt")
         print(f"ℹ️  No input file specified. Defaulting to: {default_path}")
-        input_path = default_path
-    else:
-        input_path = sys.argv[1]
+        args.input_path = default_path
     
-    if not os.path.exists(input_path):
-        print(f"❌ File not found: {input_path}")
+    args.input_paths = expand_input_paths(args.input_path)
+    if not args.input_paths:
+        print(f"❌ File not found: {args.input_path}")
         sys.exit(1)
     
-    return input_path
+    return args
+
+def expand_input_paths(input_path):
+    """Returns the cards files named by a file path, a directory (its *.txt files) or a glob.
+
+    An existing file is taken as is, even if its name contains glob characters.
+    """
+    if os.path.isfile(input_path):
+        return [input_path]
+    if os.path.isdir(input_path):
+        return sorted(glob.glob(os.path.join(input_path, "*.txt")))
+    if glob.has_magic(input_path):
+        return sorted(p for p in glob.glob(input_path) if os.path.isfile(p))
+    return [input_path] if os.path.exists(input_path) else []
 
 def read_input_file(input_path):
     """Read and return non-empty lines from the input file."""
@@ -202,74 +194,273 @@ def get_deck_name(input_path):
     """Extract deck name from file path (filename without extension)."""
     return os.path.splitext(os.path.basename(input_path))[0]
 
-def archive_all_decks(output_dir):
-    """Move all existing .apkg files in output_dir to the archive folder."""
+def archive_all_decks(output_dir, keep=()):
+    """Move all existing .apkg files in output_dir to the archive store.
+
+    Paths in keep are left in place. See archive_store.ArchiveStore.
+    """
     if not os.path.exists(output_dir):
         return
 
-    archive_dir = os.path.join(output_dir, "archive")
-    if not os.path.exists(archive_dir):
-        os.makedirs(archive_dir)
-
-    for filename in os.listdir(output_dir):
+    keep_paths = {os.path.abspath(path) for path in keep}
+    paths = []
+    for filename in sorted(os.listdir(output_dir)):
         filepath = os.path.join(output_dir, filename)
         
         # Skip directories and non-apkg files
         if os.path.isdir(filepath) or not filename.endswith(".apkg"):
             continue
+        if os.path.abspath(filepath) in keep_paths:
+            continue
+        paths.append(filepath)
 
-        target_path = os.path.join(archive_dir, filename)
-        
-        # If file exists in archive, append counter
-        if os.path.exists(target_path):
-            base, ext = os.path.splitext(filename)
-            counter = 1
-            while os.path.exists(os.path.join(archive_dir, f"{base}_{counter}{ext}")):
-                counter += 1
-            target_path = os.path.join(archive_dir, f"{base}_{counter}{ext}")
-
-        os.rename(filepath, target_path)
-        print(f"📦 Archived: {filename} -> {target_path}")
-
-def export_deck(deck, filename):
-    """Export a deck to an .apkg file and print confirmation."""
+    with stage("archive"):
+        store = ArchiveStore(os.path.join(output_dir, "archive"))
+        store.adopt_loose_files()
+        entries = store.add(paths)
+    for entry in entries:
+        print(f"📦 Archived: {entry['name']} -> {store.blob_path(entry)}")
+
+def export_deck(deck, filename, backend='genanki', archive=True):
+    """Export a deck to an .apkg file and print confirmation.
+
+    backend is 'genanki' (genanki.Package) or 'native' (apkg_writer bulk inserts).
+    archive=False skips archiving the existing decks (batch builds archive once up front).
+    """
     # Archive all existing decks in the output directory before saving the new one
-    output_dir = os.path.dirname(filename)
-    archive_all_decks(output_dir)
+    if archive:
+        archive_all_decks(os.path.dirname(filename))
     
-    genanki.Package(deck).write_to_file(filename)
+    with stage(f"write_{backend}"):
+        if backend == 'native':
+            from apkg_writer import write_deck_native
+            write_deck_native(deck, filename)
+        else:
+            genanki.Package(deck).write_to_file(filename)
     print(f"✅ Deck exported to {filename} ({len(deck.notes)} cards)")
     return filename
 
-def main():
-    """Main entry point that orchestrates the deck generation process."""
-    input_path = parse_arguments()
-    lines = read_input_file(input_path)
+def export_deck_incremental(deck, filename, state, source_hash, force=False, backend='genanki', archive=True):
+    """Export a deck, patching the previous build's collection when possible.
+
+    Only notes whose content hash changed since the last build (per the
+    BuildState manifest) are rewritten; a change to the models or force=True
+    falls back to a full export_deck.
+    """
+    hashes = incremental_build.note_hashes(deck.notes)
+    models_digest = incremental_build.models_hash({note.model.model_id: note.model for note in deck.notes}.values())
+    
+    if not force and state.can_patch(models_digest):
+        dirty, removed = state.diff(hashes)
+        deck.deck_id = state.manifest["deck_id"]
+        
+        if archive:
+            archive_all_decks(os.path.dirname(filename))
+        with stage("patch_collection"):
+            state.patch(deck.notes, dirty, removed, deck.deck_id, filename)
+        print(f"✅ Deck exported to {filename} ({len(deck.notes)} cards, "
+              f"{len(dirty)} updated, {len(removed)} removed)")
+    else:
+        export_deck(deck, filename, backend, archive)
+        state.save_collection_from_apkg(filename)
+    
+    state.save(source_hash, models_digest, deck.deck_id, filename, hashes)
+    return filename
+
+class NoCardsError(ValueError):
+    """Raised when a cards file produces no notes."""
+
+def build_deck(input_path, output_dir, force=False, backend='genanki', archive=True, check_output=False):
+    """Builds (or incrementally updates) the deck for one cards file and verifies it.
+
+    The GUIDs are verified against the notes built in memory. check_output=True
+    also reads the GUIDs back from the written apkg, which loads its whole
+    collection again.
+
+    Returns the output .apkg path, or None if the source is unchanged since
+    the last build. Raises NoCardsError if the file has no valid cards.
+    """
     deck_name = get_deck_name(input_path)
     
-    deck = create_deck(deck_name, lines)
+    # Nothing to do if the source is byte-identical to the last build
+    source_hash = incremental_build.file_hash(input_path)
+    state = incremental_build.BuildState(output_dir, deck_name)
+    if not force and state.is_unchanged(source_hash):
+        print(f"✅ {input_path} is unchanged since the last build: {state.manifest['output']}")
+        return None
+    
+    with stage("parse"):
+        parsed = parse_cards(read_input_file(input_path))
+    with stage("create_deck"):
+        deck = create_deck_from_records(deck_name, parsed)
     
     if len(deck.notes) == 0:
-        print("❌ No valid cards found.")
-        sys.exit(1)
-        
-    output_dir = "generated_decks"
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+        raise NoCardsError(f"No valid cards found in {input_path}")
         
     date_str = datetime.now().strftime("%Y-%m-%d")
     output_filename = os.path.join(output_dir, f"{deck_name}_{date_str}.apkg")
     
-    export_deck(deck, output_filename)
+    with stage("export"):
+        export_deck_incremental(deck, output_filename, state, source_hash, force, backend, archive)
 
-    # Verify GUIDs
+    # Verify GUIDs against the deck in memory, and the written file on request
     print("\n--- Verifying GUIDs ---")
     try:
-        verify(input_path, output_filename)
+        with stage("verify"):
+            deck_cards = {note.guid: note.fields[0] for note in deck.notes}
+            verify_deck(parsed.records, deck_cards, input_path, output_filename)
+            if check_output and read_guids_from_apkg(output_filename) != set(deck_cards):
+                print(f"❌ {output_filename} does not contain the notes that were built")
     except ImportError:
         print("Warning: verify_guids module not found. Skipping verification.")
     except Exception as e:
         print(f"Warning: Verification failed: {e}")
+    
+    return output_filename
+
+def prepare_batch(input_paths, output_dir, force=False):
+    """Archives the existing decks once before several decks are built into output_dir.
+
+    Returns (pending, keep, failures): the input paths to build with
+    build_deck(..., archive=False), the outputs of unchanged sources (left in
+    place) and [(input_path, error message)] for files whose deck name is
+    already taken by an earlier one.
+    """
+    failures = []
+    pending = []
+    keep = []
+    seen = {}
+    for input_path in input_paths:
+        deck_name = get_deck_name(input_path)
+        if deck_name in seen:
+            failures.append((input_path, f"deck name '{deck_name}' is also used by {seen[deck_name]}"))
+            continue
+        seen[deck_name] = input_path
+        
+        state = incremental_build.BuildState(output_dir, deck_name)
+        if not force and state.is_unchanged(incremental_build.file_hash(input_path)):
+            print(f"✅ {input_path} is unchanged since the last build: {state.manifest['output']}")
+            keep.append(state.manifest["output"])
+        else:
+            pending.append(input_path)
+    
+    if pending:
+        archive_all_decks(output_dir, keep=keep)
+    return pending, keep, failures
+
+def build_batch(input_paths, output_dir, workers=None, force=False, backend='genanki', check_output=False):
+    """Builds many decks in a process pool.
+
+    Existing decks are archived once before the batch (decks whose source is
+    unchanged keep their current apkg), so workers never move each other's
+    output. Per-deck failures are collected and returned as
+    [(input_path, error message)] instead of aborting the batch.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    os.makedirs(output_dir, exist_ok=True)
+    pending, keep, failures = prepare_batch(input_paths, output_dir, force)
+    built = 0
+    
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(build_deck, input_path, output_dir, force, backend, False, check_output): input_path
+            for input_path in pending
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+                built += 1
+            except Exception as e:
+                failures.append((futures[future], str(e) or type(e).__name__))
+    
+    print(f"\n📚 Batch finished: {built} built, "
+          f"{len(keep)} unchanged, {len(failures)} failed")
+    for input_path, error in failures:
+        print(f"❌ {input_path}: {error}")
+    return failures
+
+def watched_dirs(input_path):
+    """Returns the directories to watch for changes to the cards files input_path names."""
+    if os.path.isdir(input_path):
+        return [os.path.abspath(input_path)]
+    parent = os.path.dirname(input_path) or "."
+    if glob.has_magic(parent):
+        return sorted({os.path.dirname(os.path.abspath(p)) for p in expand_input_paths(input_path)})
+    return [os.path.abspath(parent)]
+
+def watch_and_rebuild(input_path, output_dir, backend='genanki', polling=False, debounce=None, max_rounds=None):
+    """Rebuilds decks whenever the cards files named by input_path change, until interrupted.
+
+    Runs in this process, so genanki, the models and the incremental build
+    state stay loaded between rebuilds. Bursts of saves are debounced, and
+    build_deck skips files whose content did not change. Rebuilds overwrite
+    the deck in place instead of archiving every save. A changed directory
+    (reported when inotify drops events) rebuilds every deck sourced from it.
+    max_rounds stops after that many change bursts (for tests).
+    """
+    import file_watcher
+    if debounce is None:
+        debounce = file_watcher.DEFAULT_DEBOUNCE
+    watcher = file_watcher.make_watcher(watched_dirs(input_path), polling)
+    kind = "polling" if isinstance(watcher, file_watcher.PollingWatcher) else "inotify"
+    print(f"👀 Watching {input_path} for changes ({kind}). Press Ctrl+C to stop.")
+    rounds = 0
+    try:
+        while max_rounds is None or rounds < max_rounds:
+            changed = file_watcher.wait_for_changes(watcher, debounce)
+            rounds += 1
+            targets = {os.path.abspath(p): p for p in expand_input_paths(input_path)}
+            for path in sorted(p for p in targets if p in changed or os.path.dirname(p) in changed):
+                start = time.perf_counter()
+                try:
+                    if build_deck(targets[path], output_dir, backend=backend, archive=False):
+                        print(f"🔁 Rebuilt {targets[path]} in {time.perf_counter() - start:.2f}s")
+                except NoCardsError:
+                    print(f"❌ No valid cards found in {targets[path]}")
+                except Exception as e:
+                    print(f"❌ Rebuild of {targets[path]} failed: {e}")
+    except KeyboardInterrupt:
+        print("\n👋 Stopped watching.")
+    finally:
+        watcher.close()
+
+def main():
+    """Main entry point that orchestrates the deck generation process."""
+    args = parse_arguments()
+    start_from_args(args)
+    try:
+        _run(args)
+    finally:
+        profiler.finish()
+
+def _run(args):
+    output_dir = "generated_decks"
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    
+    # A directory or glob builds every matching file as one batch
+    if args.input_paths != [args.input_path]:
+        failures = build_batch(args.input_paths, output_dir, args.workers, args.force, args.backend, args.check_output)
+        if args.watch:
+            watch_and_rebuild(args.input_path, output_dir, args.backend, args.poll)
+        elif failures:
+            sys.exit(1)
+        return
+    
+    try:
+        build_deck(args.input_path, output_dir, args.force, args.backend, check_output=args.check_output)
+    except NoCardsError:
+        print("❌ No valid cards found.")
+        if not args.watch:
+            sys.exit(1)
+    except Exception as e:
+        # A half-saved file must not stop --watch before it starts; the next save rebuilds it
+        if not args.watch:
+            raise
+        print(f"❌ Build of {args.input_path} failed: {e}")
+    
+    if args.watch:
+        watch_and_rebuild(args.input_path, output_dir, args.backend, args.poll)
 
 if __name__ == '__main__':
     main()
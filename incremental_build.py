@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import zipfile
+import itertools
+import tempfile
+
+# Build state lives in a hidden folder inside the output directory
+MANIFEST_DIR_NAME = ".build"
+MANIFEST_VERSION = 1
+
+def file_hash(path):
+    """Returns the sha256 hex digest of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def models_hash(models):
+    """Hashes everything about the models that ends up in the collection."""
+    h = hashlib.sha256()
+    for model in sorted(models, key=lambda m: m.model_id):
+        h.update(json.dumps([
+            model.model_id, model.name, model.fields, model.templates,
+            model.css, model.model_type, model.sort_field_index,
+        ], sort_keys=True).encode())
+    return h.hexdigest()
+
+def note_hashes(notes):
+    """Returns {guid: content hash} for genanki notes.
+
+    Notes sharing a GUID are folded into a single hash, so they are always
+    rewritten together.
+    """
+    hashes = {}
+    for note in notes:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(hashes.get(note.guid, '').encode())
+        h.update(str(note.model.model_id).encode())
+        h.update(b'\x1e')
+        h.update('\x1f'.join(note.fields).encode())
+        hashes[note.guid] = h.hexdigest()
+    return hashes
+
+class BuildState:
+    """Manifest and collection of the previous build of one deck.
+
+    The manifest records the source file hash, the models hash, the deck id,
+    the apkg that was written and a content hash per note GUID. The
+    collection is the SQLite database inside that apkg, kept so the next
+    build can patch it instead of regenerating every note.
+    """
+    def __init__(self, output_dir, deck_name):
+        state_dir = os.path.join(output_dir, MANIFEST_DIR_NAME)
+        self.state_dir = state_dir
+        self.manifest_path = os.path.join(state_dir, f"{deck_name}.json")
+        self.collection_path = os.path.join(state_dir, f"{deck_name}.anki2")
+        self.manifest = self._load()
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if manifest.get("version") != MANIFEST_VERSION or not os.path.exists(self.collection_path):
+            return None
+        return manifest
+
+    def is_unchanged(self, source_hash):
+        """True if the source is identical to the last build and its apkg still exists."""
+        return (self.manifest is not None
+                and self.manifest["source_hash"] == source_hash
+                and os.path.exists(self.manifest["output"]))
+
+    def can_patch(self, models_digest):
+        """True if the previous collection can be patched (same models)."""
+        return self.manifest is not None and self.manifest["models_hash"] == models_digest
+
+    def diff(self, hashes):
+        """Returns (dirty_guids, removed_guids) relative to the previous build."""
+        old = self.manifest["notes"]
+        dirty = {guid for guid, digest in hashes.items() if old.get(guid) != digest}
+        removed = {guid for guid in old if guid not in hashes}
+        return dirty, removed
+
+    def save(self, source_hash, models_digest, deck_id, output, hashes):
+        os.makedirs(self.state_dir, exist_ok=True)
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "source_hash": source_hash,
+            "models_hash": models_digest,
+            "deck_id": deck_id,
+            "output": output,
+            "notes": hashes,
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        self.manifest = manifest
+
+    def save_collection_from_apkg(self, apkg_path):
+        """Keeps the collection of a freshly written apkg for the next build."""
+        os.makedirs(self.state_dir, exist_ok=True)
+        with zipfile.ZipFile(apkg_path, 'r') as z, z.open("collection.anki2") as src:
+            with open(self.collection_path + ".tmp", 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1 << 20)
+        os.replace(self.collection_path + ".tmp", self.collection_path)
+
+    def patch(self, notes, dirty, removed, deck_id, apkg_path, timestamp=None):
+        """Writes apkg_path from the previous collection with only dirty/removed notes changed.
+
+        Rows for dirty and removed GUIDs are deleted, then the notes whose GUID
+        is dirty are written again through genanki, so inserted and updated
+        notes get exactly the rows a full build would give them.
+        """
+        if timestamp is None:
+            timestamp = time.time()
+
+        fd, work_path = tempfile.mkstemp(dir=self.state_dir, suffix=".anki2")
+        os.close(fd)
+        try:
+            shutil.copyfile(self.collection_path, work_path)
+            conn = sqlite3.connect(work_path)
+            try:
+                cursor = conn.cursor()
+                stale = [(guid,) for guid in dirty | removed]
+                cursor.executemany("DELETE FROM cards WHERE nid IN (SELECT id FROM notes WHERE guid = ?)", stale)
+                cursor.executemany("DELETE FROM notes WHERE guid = ?", stale)
+
+                # New ids must not collide with the ones kept from the previous build
+                max_id = max(
+                    cursor.execute("SELECT IFNULL(MAX(id), 0) FROM notes").fetchone()[0],
+                    cursor.execute("SELECT IFNULL(MAX(id), 0) FROM cards").fetchone()[0])
+                id_gen = itertools.count(max(int(timestamp * 1000), max_id + 1))
+                for note in notes:
+                    if note.guid in dirty:
+                        note.write_to_db(cursor, timestamp, deck_id, id_gen)
+                conn.commit()
+            finally:
+                conn.close()
+
+            write_apkg(work_path, apkg_path)
+            os.replace(work_path, self.collection_path)
+        finally:
+            if os.path.exists(work_path):
+                os.remove(work_path)
+
+def write_apkg(collection_path, apkg_path):
+    """Zips a collection into an apkg laid out like genanki.Package writes it."""
+    with zipfile.ZipFile(apkg_path, 'w') as outzip:
+        outzip.write(collection_path, 'collection.anki2')
+        outzip.writestr('media', json.dumps({}))
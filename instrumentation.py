@@ -0,0 +1,144 @@
+import os
+import sys
+import json
+import time
+import contextlib
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# Shared no-op context returned by stage() while profiling is off
+_NULL_STAGE = contextlib.nullcontext()
+
+def _io_counters():
+    """Returns (bytes read, bytes written) by this process so far, or None if unknown.
+
+    Uses rchar/wchar from /proc/self/io, which count every read/write call,
+    including data served from the page cache.
+    """
+    try:
+        with open("/proc/self/io", "rb") as f:
+            fields = dict(line.split(b":") for line in f.read().splitlines())
+        return int(fields[b"rchar"]), int(fields[b"wchar"])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+class Profiler:
+    """Records wall time, bytes read/written and peak RSS per named stage.
+
+    Stages nest: `with profiler.stage("unpack"): ... with profiler.stage("decompress")`.
+    Peak RSS is the process high-water mark when the stage ends. While the
+    profiler is disabled stage() returns a shared no-op context manager, so
+    instrumented code pays one attribute check per stage.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self.depth = 0
+        self.origin = None
+        self.cprofile = None
+        self.cprofile_path = None
+        self.trace_path = None
+
+    def enable(self, cprofile_path=None, trace_path=None):
+        self.enabled = True
+        self.records = []
+        self.origin = time.perf_counter()
+        self.trace_path = trace_path
+        self.cprofile_path = cprofile_path
+        if cprofile_path:
+            import cProfile
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return self._stage(name)
+
+    @contextlib.contextmanager
+    def _stage(self, name):
+        record = {"name": name, "depth": self.depth}
+        self.records.append(record)
+        io_before = _io_counters()
+        start = time.perf_counter()
+        self.depth += 1
+        try:
+            yield
+        finally:
+            self.depth -= 1
+            record["start"] = start - self.origin
+            record["seconds"] = time.perf_counter() - start
+            io_after = _io_counters()
+            if io_before and io_after:
+                record["bytes_read"] = io_after[0] - io_before[0]
+                record["bytes_written"] = io_after[1] - io_before[1]
+            record["peak_rss_mb"] = _peak_rss_mb()
+
+    def finish(self):
+        """Stops profiling, prints the summary table and writes the requested files."""
+        if not self.enabled:
+            return
+        self.enabled = False
+        if self.cprofile:
+            self.cprofile.disable()
+            self.cprofile.dump_stats(self.cprofile_path)
+            print(f"📝 cProfile stats written to {self.cprofile_path}")
+            self.cprofile = None
+        self.print_summary()
+        if self.trace_path:
+            self.write_trace(self.trace_path)
+            print(f"📝 Trace written to {self.trace_path}")
+
+    def print_summary(self):
+        print(f"\n{'stage':<32} {'seconds':>9} {'read MB':>9} {'written MB':>11} {'peak RSS MB':>12}")
+        for record in self.records:
+            if "seconds" not in record:
+                continue
+            name = "  " * record["depth"] + record["name"]
+            read = _mb(record.get("bytes_read"))
+            written = _mb(record.get("bytes_written"))
+            rss = f"{record['peak_rss_mb']:.1f}" if record["peak_rss_mb"] is not None else "-"
+            print(f"{name:<32} {record['seconds']:>9.3f} {read:>9} {written:>11} {rss:>12}")
+
+    def write_trace(self, path):
+        """Writes the stages as Chrome trace events (chrome://tracing, Perfetto)."""
+        events = []
+        for record in self.records:
+            if "seconds" not in record:
+                continue
+            events.append({
+                "name": record["name"], "ph": "X", "pid": os.getpid(), "tid": 0,
+                "ts": round(record["start"] * 1e6), "dur": round(record["seconds"] * 1e6),
+                "args": {key: record[key] for key in ("bytes_read", "bytes_written", "peak_rss_mb") if key in record},
+            })
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({"traceEvents": events}, f)
+
+def _mb(value):
+    return f"{value / (1 << 20):.1f}" if value is not None else "-"
+
+# Process-wide profiler used by the CLI entry points
+profiler = Profiler()
+
+def stage(name):
+    """Shortcut for profiler.stage(name)."""
+    return profiler.stage(name)
+
+def add_profile_arguments(parser):
+    parser.add_argument('--profile', action='store_true', help='Print time, I/O and peak memory per stage')
+    parser.add_argument('--profile-cprofile', metavar='FILE', help='With --profile, also write cProfile stats to FILE')
+    parser.add_argument('--profile-trace', metavar='FILE', help='With --profile, also write a JSON trace of the stages to FILE')
+
+def start_from_args(args):
+    if args.profile:
+        profiler.enable(cprofile_path=args.profile_cprofile, trace_path=args.profile_trace)
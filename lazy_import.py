@@ -0,0 +1,32 @@
+import sys
+import types
+import importlib
+import importlib.util
+
+class _LazyModule(types.ModuleType):
+    """Stand-in that imports the real module on first attribute access.
+
+    importlib.util.LazyLoader is not safe when two threads touch the module
+    first at the same time (before Python 3.12.3 one of them sees it half
+    executed). Here the import system's per-module lock serializes the real
+    import, and its attributes are then copied over so later lookups are
+    plain attribute reads.
+    """
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+def lazy_import(name):
+    """Returns the module called name, but only executes it on first attribute access.
+
+    Keeps heavy optional dependencies (genanki, zstandard) off the startup
+    path of code that may never use them. An already imported module is
+    returned as is.
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if importlib.util.find_spec(name) is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    return _LazyModule(name)
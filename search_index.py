@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import sqlite3
+import argparse
+import tempfile
+from datetime import datetime
+
+from anki_unpacker import AnkiDeckUnpacker
+from archive_store import ArchiveStore, deck_of
+from incremental_build import file_hash
+from instrumentation import stage, profiler, add_profile_arguments, start_from_args
+
+DEFAULT_DECKS_DIR = "generated_decks"
+INDEX_NAME = ".search_index.sqlite"
+SCHEMA_VERSION = 1
+
+# Matches printed by a query unless --limit says otherwise
+DEFAULT_LIMIT = 20
+
+# Notes are stored once per distinct apkg (by sha256), and every deck file or
+# archive entry with that content points at them through sources.hash.
+# notes_fts is an external-content FTS5 table over notes.flds, so the field
+# text is not stored twice.
+SCHEMA = [
+    "CREATE TABLE sources (source TEXT PRIMARY KEY, name TEXT, deck TEXT, date REAL, hash TEXT, size INTEGER, mtime_ns INTEGER)",
+    "CREATE INDEX ix_sources_hash ON sources (hash)",
+    "CREATE TABLE blobs (hash TEXT PRIMARY KEY, notes INTEGER)",
+    "CREATE TABLE notes (id INTEGER PRIMARY KEY, hash TEXT, guid TEXT, flds TEXT)",
+    "CREATE INDEX ix_notes_hash ON notes (hash)",
+    "CREATE VIRTUAL TABLE notes_fts USING fts5(flds, content='notes', content_rowid='id')",
+]
+
+def fts_query(text):
+    """Turns plain search words into an FTS5 query matching notes that contain all of them."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+class SearchIndex:
+    """SQLite FTS5 index of the notes in every generated and archived deck.
+
+    update() only reads apkgs whose content hash is not indexed yet: deck
+    files are re-hashed when their size or mtime changes, archive entries
+    carry their hash already. Identical builds share one copy of their notes.
+    """
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.conn = self._open()
+
+    def _open(self):
+        """Opens the index, creating it if missing and rebuilding one in an older layout.
+
+        Raises ValueError for any other file, which is left untouched.
+        """
+        conn = sqlite3.connect(self.index_path)
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        except sqlite3.DatabaseError:
+            conn.close()
+            raise ValueError(f"{self.index_path} is not a search index")
+        if version != SCHEMA_VERSION:
+            conn.close()
+            if tables and "sources" not in tables:
+                raise ValueError(f"{self.index_path} is not a search index")
+            if tables:
+                os.remove(self.index_path) # Older layout: rebuild from scratch
+            conn = sqlite3.connect(self.index_path)
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            conn.commit()
+        return conn
+
+    def update(self, decks_dir=DEFAULT_DECKS_DIR, archive_dir=None):
+        """Brings the index in line with the apkgs in decks_dir and the archive store.
+
+        Returns {'sources': n, 'indexed': n, 'removed': n, 'failed': n}, where
+        indexed counts apkgs whose notes were read and removed the deck files or
+        archive entries that disappeared. A source that cannot be read is
+        reported, left out of the index and counted as failed; the rest of the
+        update goes on.
+        """
+        archive_dir = archive_dir or os.path.join(decks_dir, "archive")
+        known = {row[0]: row[1:] for row in self.conn.execute("SELECT source, hash, size, mtime_ns FROM sources")}
+        indexed = {row[0] for row in self.conn.execute("SELECT hash FROM blobs")}
+        counts = {'sources': 0, 'indexed': 0, 'removed': 0, 'failed': 0}
+        seen = set()
+        failures = []
+
+        with stage("index_decks"):
+            for name in sorted(os.listdir(decks_dir)) if os.path.isdir(decks_dir) else ():
+                path = os.path.join(decks_dir, name)
+                if not name.endswith(".apkg") or not os.path.isfile(path):
+                    continue
+                try:
+                    st = os.stat(path)
+                    previous = known.get(name)
+                    if previous and previous[1:] == (st.st_size, st.st_mtime_ns):
+                        digest = previous[0]
+                    else:
+                        digest = file_hash(path)
+                    if digest not in indexed:
+                        self._index_apkg(path, digest)
+                        indexed.add(digest)
+                        counts['indexed'] += 1
+                except Exception as e:
+                    failures.append((name, str(e) or type(e).__name__))
+                    continue
+                self._upsert_source(name, name, st.st_mtime, digest, st.st_size, st.st_mtime_ns)
+                seen.add(name)
+
+        with stage("index_archive"):
+            store = ArchiveStore(archive_dir) if os.path.isdir(archive_dir) else None
+            for entry in store.entries if store else ():
+                source = f"archive/{entry['name']}@{entry['archived_at']}"
+                if entry["blob"] not in indexed:
+                    try:
+                        self._index_archive_entry(store, entry)
+                    except Exception as e:
+                        failures.append((source, str(e) or type(e).__name__))
+                        continue
+                    indexed.add(entry["blob"])
+                    counts['indexed'] += 1
+                self._upsert_source(source, entry["name"], entry["archived_at"], entry["blob"], entry["size"], None)
+                seen.add(source)
+
+        gone = [source for source in known if source not in seen]
+        self.conn.executemany("DELETE FROM sources WHERE source = ?", [(source,) for source in gone])
+        self._drop_unreferenced_blobs()
+        self.conn.commit()
+        counts['sources'] = len(seen)
+        counts['failed'] = len(failures)
+        counts['removed'] = len(gone) - len({source for source, _ in failures} & set(gone))
+        for source, error in failures:
+            print(f"❌ {source}: {error}")
+        return counts
+
+    def _upsert_source(self, source, name, date, digest, size, mtime_ns):
+        self.conn.execute("INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?, ?)",
+                          (source, name, deck_of(name), date, digest, size, mtime_ns))
+
+    def _index_archive_entry(self, store, entry):
+        if not entry["packed"]:
+            self._index_apkg(store.blob_path(entry), entry["blob"])
+            return
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, entry["name"])
+            store.restore(entry, path)
+            self._index_apkg(path, entry["blob"])
+
+    def _index_apkg(self, path, digest):
+        """Reads the notes of one apkg into the index, committing once they are all in."""
+        # Thousands of archived builds would evict the decks in daily use from the collection cache
+        try:
+            with AnkiDeckUnpacker(path, cache=False) as unpacker:
+                unpacker.unpack(media=False)
+                self.conn.executemany("INSERT INTO notes (hash, guid, flds) VALUES (?, ?, ?)",
+                                      ((digest, guid, flds) for guid, flds in unpacker.get_notes(('guid', 'flds'))))
+        except Exception:
+            # Drop the notes read before the failure, the rest of the update still commits
+            self.conn.execute("DELETE FROM notes WHERE hash = ?", (digest,))
+            raise
+        self.conn.execute("INSERT INTO notes_fts (rowid, flds) SELECT id, flds FROM notes WHERE hash = ?", (digest,))
+        count = self.conn.execute("SELECT COUNT(*) FROM notes WHERE hash = ?", (digest,)).fetchone()[0]
+        self.conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?)", (digest, count))
+        self.conn.commit()
+
+    def _drop_unreferenced_blobs(self):
+        unused = [row[0] for row in self.conn.execute(
+            "SELECT hash FROM blobs WHERE hash NOT IN (SELECT hash FROM sources)")]
+        for digest in unused:
+            # External-content FTS rows are removed by replaying their old values
+            self.conn.execute("INSERT INTO notes_fts (notes_fts, rowid, flds) SELECT 'delete', id, flds FROM notes WHERE hash = ?",
+                              (digest,))
+            self.conn.execute("DELETE FROM notes WHERE hash = ?", (digest,))
+            self.conn.execute("DELETE FROM blobs WHERE hash = ?", (digest,))
+
+    def search(self, query, limit=DEFAULT_LIMIT, deck=None, raw=False):
+        """Returns [(deck, name, date, guid, flds)] for notes matching query, best matches first.
+
+        query is a set of words that must all appear in the note's fields, or
+        FTS5 query syntax (phrases, prefix*, OR, NEAR) when raw is True. A note
+        found in several deck files is returned once per file, newest first.
+        """
+        sql = ("SELECT s.deck, s.name, s.date, n.guid, n.flds FROM notes_fts "
+               "JOIN notes n ON n.id = notes_fts.rowid JOIN sources s ON s.hash = n.hash "
+               "WHERE notes_fts MATCH ?")
+        params = [query if raw else fts_query(query)]
+        if deck is not None:
+            sql += " AND s.deck = ?"
+            params.append(deck)
+        sql += " ORDER BY notes_fts.rank, s.date DESC LIMIT ?"
+        params.append(limit)
+        return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def _format_hit(hit):
+    deck, name, date, guid, flds = hit
+    fields = " :: ".join(field.strip().replace('\n', ' ') for field in flds.split('\x1f'))
+    return f"{deck:<24} {datetime.fromtimestamp(date).strftime('%Y-%m-%d')}  [{guid}] {fields}  ({name})"
+
+def _open_index(index_path):
+    try:
+        return SearchIndex(index_path)
+    except ValueError as e:
+        print(f"❌ {e}. Pass --index to use another file.")
+        sys.exit(2)
+
+def main():
+    parser = argparse.ArgumentParser(description='Full-text search over the notes of all generated and archived decks')
+    parser.add_argument('--decks-dir', default=DEFAULT_DECKS_DIR, help='Directory holding the generated decks and their archive')
+    parser.add_argument('--index', help=f'Index database (default: <decks-dir>/{INDEX_NAME})')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('update', help='Index new and changed decks, drop removed ones')
+
+    query = sub.add_parser('query', help='Print notes matching the search words')
+    query.add_argument('words', nargs='+', help='Words that must all appear in the note')
+    query.add_argument('--deck', help='Only search this deck')
+    query.add_argument('--limit', type=int, default=DEFAULT_LIMIT, help='Maximum number of matches to print')
+    query.add_argument('--fts', action='store_true', help='Treat the words as an FTS5 query (phrases, prefix*, OR, NEAR)')
+    add_profile_arguments(parser)
+
+    args = parser.parse_args()
+    start_from_args(args)
+    index_path = args.index or os.path.join(args.decks_dir, INDEX_NAME)
+
+    try:
+        if args.command == 'update':
+            os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+            with _open_index(index_path) as index:
+                counts = index.update(args.decks_dir)
+            print(f"✅ Indexed {counts['indexed']} new apkgs, dropped {counts['removed']} sources; "
+                  f"{counts['sources']} deck files and archive entries in {index_path}")
+            if counts['failed']:
+                print(f"❌ {counts['failed']} apkgs could not be indexed")
+                sys.exit(1)
+            return
+
+        if not os.path.exists(index_path):
+            print(f"❌ No search index at {index_path}. Run `search_index.py update` first.")
+            sys.exit(2)
+        with _open_index(index_path) as index:
+            try:
+                hits = index.search(" ".join(args.words), args.limit, args.deck, raw=args.fts)
+            except sqlite3.OperationalError as e:
+                print(f"❌ Invalid FTS5 query: {e}")
+                sys.exit(2)
+        for hit in hits:
+            print(_format_hit(hit))
+        if not hits:
+            print("No matching notes.")
+            sys.exit(1)
+    finally:
+        profiler.finish()
+
+if __name__ == "__main__":
+    main()
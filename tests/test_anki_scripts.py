@@ -2,12 +2,82 @@ import unittest
 from unittest.mock import MagicMock, patch, mock_open
 import sys
 import os
+import io
+import json
+import sqlite3
+import tempfile
+import tracemalloc
+import zipfile
+import zstandard
 
 # Add parent directory to path to import scripts
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 import generate_anki_from_text
 import dump_apkg
+import anki_unpacker
+import collection_cache
+import verify_guids
+import diff_apkg
+import search_index
+import card_parser
+import incremental_build
+import apkg_writer
+import archive_store
+import cleanup_archive
+import instrumentation
+import file_watcher
+import anki_daemon
+import threading
+import time
+import subprocess
+import genanki
+from anki_unpacker import AnkiDeckUnpacker
+
+def make_apkg(apkg_path, notes, compressed=True, media=None):
+    """Builds a minimal .apkg with the given [(flds, guid), ...] notes.
+
+    compressed=True writes a zstd collection.anki21b (and zstd JSON media map),
+    otherwise a legacy collection.anki2. media is a {filename: bytes} dict.
+    """
+    media = media or {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db_path = os.path.join(temp_dir, "collection.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute("CREATE TABLE notes (id integer primary key, guid text, mid integer, mod integer, "
+                     "usn integer, tags text, flds text, sfld text, csum integer, flags integer, data text)")
+        conn.executemany(
+            "INSERT INTO notes VALUES (?, ?, 1, 100, -1, '', ?, ?, 0, 0, '')",
+            [(i + 1, guid, flds, flds.split('\x1f')[0]) for i, (flds, guid) in enumerate(notes)])
+        conn.commit()
+        conn.close()
+        with open(db_path, 'rb') as f:
+            db_bytes = f.read()
+
+        media_map = json.dumps({str(i): name for i, name in enumerate(media)}).encode()
+        cctx = zstandard.ZstdCompressor()
+        with zipfile.ZipFile(apkg_path, 'w') as z:
+            if compressed:
+                z.writestr("collection.anki21b", cctx.compress(db_bytes))
+                z.writestr("media", cctx.compress(media_map))
+            else:
+                z.writestr("collection.anki2", db_bytes)
+                z.writestr("media", media_map)
+            for i, content in enumerate(media.values()):
+                z.writestr(str(i), content)
+
+class ApkgTestCase(unittest.TestCase):
+    """Base class for tests that build real .apkg files in a temp directory."""
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.apkg_path = os.path.join(self.tmp.name, "deck.apkg")
+        self.cache_dir = os.path.join(self.tmp.name, "cache")
+        
+        # Keep the collection cache out of the user's home directory
+        env = patch.dict(os.environ, {collection_cache.CACHE_DIR_ENV: self.cache_dir})
+        env.start()
+        self.addCleanup(env.stop)
 
 class TestGenerateAnkiFromText(unittest.TestCase):
     def setUp(self):
@@ -168,6 +238,263 @@ class TestGenerateAnkiFromText(unittest.TestCase):
             self.assertEqual(mock_genanki.Note.call_count, 1)
 
 
+class TestCardParser(unittest.TestCase):
+    def test_parse_cards_single_pass(self):
+        """Test records and max field counts are collected in one pass."""
+        parsed = card_parser.parse_cards([
+            "# comment",
+            "",
+            "[g1] Q :: A :: Extra",
+            "Front::Back",
+            "{{c1::Cloze}} :: Extra :: More :: Most",
+            "not a card",
+        ])
+        kinds = [(r.guid, r.kind, r.fields) for r in parsed.records]
+        self.assertEqual(kinds, [
+            ("g1", card_parser.BASIC, ["Q", "A", "Extra"]),
+            (None, card_parser.BASIC, ["Front", "Back"]),
+            (None, card_parser.CLOZE, ["{{c1::Cloze}}", "Extra", "More", "Most"]),
+            (None, card_parser.INVALID, ["not a card"]),
+        ])
+        self.assertEqual((parsed.max_basic, parsed.max_cloze), (3, 4))
+
+    def test_analyze_field_counts_matches_parser(self):
+        """Test analyze_field_counts still reports the minimum of 2 fields per model."""
+        self.assertEqual(generate_anki_from_text.analyze_field_counts(["Q :: A"]), (2, 2))
+
+class TestIncrementalBuild(ApkgTestCase):
+    def setUp(self):
+        super().setUp()
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        self.cards_path = os.path.join(self.tmp.name, "cards.txt")
+
+    def _build(self, content, *extra_args):
+        with open(self.cards_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        with patch.object(sys, 'argv', ['generate_anki_from_text.py', self.cards_path, *extra_args]), \
+             patch('generate_anki_from_text.export_deck', wraps=generate_anki_from_text.export_deck) as export, \
+             patch('builtins.print') as mock_print:
+            generate_anki_from_text.main()
+        return export, " ".join(str(call) for call in mock_print.call_args_list)
+
+    def _notes(self):
+        state = incremental_build.BuildState("generated_decks", "cards")
+        conn = sqlite3.connect(state.collection_path)
+        try:
+            notes = sorted(conn.execute("SELECT guid, flds FROM notes"))
+            orphans = conn.execute("SELECT COUNT(*) FROM cards WHERE nid NOT IN (SELECT id FROM notes)").fetchone()[0]
+        finally:
+            conn.close()
+        self.assertEqual(orphans, 0)
+        return notes
+
+    def test_build_verifies_deck_without_reloading_it(self):
+        """Test the build verifies from memory and reads the written file back only with --check-output."""
+        loads = anki_unpacker.stats['collection_loads']
+        with patch('generate_anki_from_text.verify_deck', wraps=generate_anki_from_text.verify_deck) as verify_deck, \
+             patch('generate_anki_from_text.read_guids_from_apkg') as read_guids:
+            _, printed = self._build("[g1] Q :: A\n[g2] F :: B\n")
+        records, deck_cards = verify_deck.call_args[0][:2]
+        self.assertEqual([r.guid for r in records], ["g1", "g2"])
+        self.assertEqual(deck_cards, {"g1": "Q", "g2": "F"})
+        self.assertIn("All GUIDs match", printed)
+        read_guids.assert_not_called()
+        
+        # The stored collection of a genanki build is read without the unpacker
+        with patch('generate_anki_from_text.read_guids_from_apkg', wraps=generate_anki_from_text.read_guids_from_apkg) as read_guids:
+            _, printed = self._build("[g1] Q :: A\n[g2] F :: B\n[g3] G :: C\n", '--check-output')
+        self.assertEqual(read_guids.call_count, 1)
+        self.assertNotIn("does not contain", printed)
+        self.assertEqual(anki_unpacker.stats['collection_loads'], loads)
+        self.assertEqual(verify_guids.read_guids_from_apkg(read_guids.call_args[0][0]), {"g1", "g2", "g3"})
+        
+        # zstd collections fall back to the unpacker
+        zstd_path = os.path.join(self.tmp.name, "zstd.apkg")
+        make_apkg(zstd_path, [("Q\x1fA", "z1"), ("F\x1fB", "z2")])
+        with patch('builtins.print'):
+            self.assertEqual(verify_guids.read_guids_from_apkg(zstd_path), {"z1", "z2"})
+
+    def test_unchanged_source_is_a_no_op(self):
+        """Test a second build of an identical cards file exits without writing a deck."""
+        export, _ = self._build("[g1] Q :: A\n")
+        export.assert_called_once()
+        export, printed = self._build("[g1] Q :: A\n")
+        export.assert_not_called()
+        self.assertIn("unchanged", printed)
+        self.assertEqual(archive_store.ArchiveStore(os.path.join("generated_decks", "archive")).entries, [])
+
+    def test_small_edit_patches_previous_collection(self):
+        """Test edits rewrite only the changed notes of the previous collection."""
+        self._build("[g1] Q1 :: A1\n[g2] Q2 :: A2\n[g3] Q3 :: A3\n")
+        export, printed = self._build("[g1] Q1 :: A1\n[g2] Q2 :: edited\n[g4] Q4 :: A4\n")
+        export.assert_not_called()
+        self.assertIn("2 updated, 1 removed", printed)
+        self.assertEqual(self._notes(), [("g1", "Q1\x1fA1"), ("g2", "Q2\x1fedited"), ("g4", "Q4\x1fA4")])
+        
+        # A new field count changes the models, which needs a full rebuild
+        export, _ = self._build("[g1] Q1 :: A1 :: Extra\n")
+        export.assert_called_once()
+        self.assertEqual(self._notes(), [("g1", "Q1\x1fA1\x1fExtra")])
+
+class TestWatchMode(ApkgTestCase):
+    def setUp(self):
+        super().setUp()
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        self.cards_path = os.path.join(self.tmp.name, "cards.txt")
+        with open(self.cards_path, "w", encoding="utf-8") as f:
+            f.write("[g1] Q :: A\n")
+
+    def test_watchers_report_saved_files(self):
+        """Test inotify and polling watchers both see a save done by renaming a temp file."""
+        for polling in (False, True):
+            watcher = file_watcher.make_watcher([self.tmp.name], polling=polling)
+            try:
+                tmp_path = self.cards_path + ".swp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    f.write(f"[g1] Q :: A {polling}\n")
+                os.replace(tmp_path, self.cards_path)
+                changed = file_watcher.wait_for_changes(watcher, debounce=0.05)
+                self.assertIn(self.cards_path, changed)
+            finally:
+                watcher.close()
+
+    @patch('builtins.print')
+    def test_watch_rebuilds_only_changed_content(self, mock_print):
+        """Test each burst of changes rebuilds the deck in-process, skipping unchanged content."""
+        os.makedirs("generated_decks")
+        generate_anki_from_text.build_deck(self.cards_path, "generated_decks")
+        bursts = [{self.cards_path}, {self.cards_path, os.path.join(self.tmp.name, "other.swp")}]
+        
+        def next_burst(watcher, debounce):
+            if len(bursts) == 1:
+                with open(self.cards_path, "a", encoding="utf-8") as f:
+                    f.write("[g2] New :: Card\n")
+            return bursts.pop(0)
+        
+        with patch('file_watcher.wait_for_changes', side_effect=next_burst), \
+             patch('generate_anki_from_text.build_deck', wraps=generate_anki_from_text.build_deck) as build:
+            generate_anki_from_text.watch_and_rebuild(self.cards_path, "generated_decks", polling=True, max_rounds=2)
+        
+        self.assertEqual(build.call_count, 2)
+        printed = [str(call) for call in mock_print.call_args_list]
+        self.assertEqual(sum("Rebuilt" in line for line in printed), 1)
+        self.assertEqual(len([f for f in os.listdir("generated_decks") if f.endswith(".apkg")]), 1)
+
+    @patch('builtins.print')
+    def test_failed_first_build_still_starts_watching(self, mock_print):
+        """Test an error in the initial build is reported and --watch goes on to watch the file."""
+        argv = ['generate_anki_from_text.py', self.cards_path, '--watch']
+        with patch.object(sys, 'argv', argv), \
+             patch('generate_anki_from_text.build_deck', side_effect=ValueError("half-saved file")), \
+             patch('generate_anki_from_text.watch_and_rebuild') as watch:
+            generate_anki_from_text.main()
+        watch.assert_called_once()
+        self.assertIn(f"❌ Build of {self.cards_path} failed: half-saved file", [call[0][0] for call in mock_print.call_args_list])
+        
+        # Without --watch the error still ends the run
+        with patch.object(sys, 'argv', argv[:-1]), \
+             patch('generate_anki_from_text.build_deck', side_effect=ValueError("half-saved file")):
+            with self.assertRaises(ValueError):
+                generate_anki_from_text.main()
+
+    @patch('builtins.print')
+    def test_inotify_overflow_rebuilds_every_target(self, mock_print):
+        """Test a queue overflow reports the watched directory and the watch loop rebuilds its decks."""
+        watcher = file_watcher.InotifyWatcher([self.tmp.name])
+        read_fd, write_fd = os.pipe()
+        os.close(watcher.fd)
+        watcher.fd = read_fd
+        os.set_blocking(read_fd, False)
+        os.write(write_fd, file_watcher.EVENT_HEADER.pack(-1, file_watcher.IN_Q_OVERFLOW, 0, 0))
+        os.close(write_fd)
+        try:
+            changed = watcher.wait(timeout=1)
+        finally:
+            watcher.close()
+        self.assertEqual(changed, {os.path.abspath(self.tmp.name)})
+        
+        os.makedirs("generated_decks")
+        with patch('file_watcher.wait_for_changes', return_value=changed), \
+             patch('generate_anki_from_text.build_deck', return_value=None) as build:
+            generate_anki_from_text.watch_and_rebuild(self.cards_path, "generated_decks", polling=True, max_rounds=1)
+        self.assertEqual([call[0][0] for call in build.call_args_list], [self.cards_path])
+
+class TestBatchBuild(ApkgTestCase):
+    def setUp(self):
+        super().setUp()
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        self.addCleanup(os.chdir, cwd)
+        os.makedirs("cards")
+        for name, content in (("one", "[g1] Q :: A\n"), ("two", "[g2] Q :: A\n"), ("empty", "# nothing\n")):
+            with open(os.path.join("cards", f"{name}.txt"), "w", encoding="utf-8") as f:
+                f.write(content)
+
+    @patch('builtins.print')
+    def test_batch_builds_in_pool_and_collects_failures(self, mock_print):
+        """Test a directory builds every deck, archives once and reports failures per deck."""
+        paths = generate_anki_from_text.expand_input_paths("cards")
+        self.assertEqual(len(paths), 3)
+        
+        failures = generate_anki_from_text.build_batch(paths, "generated_decks", workers=2)
+        self.assertEqual([os.path.basename(path) for path, _ in failures], ["empty.txt"])
+        built = sorted(f for f in os.listdir("generated_decks") if f.endswith(".apkg"))
+        self.assertEqual([f.split("_")[0] for f in built], ["one", "two"])
+        self.assertEqual(archive_store.ArchiveStore(os.path.join("generated_decks", "archive")).entries, [])
+        
+        # Rebuilding after one edit archives only the superseded deck
+        with open(os.path.join("cards", "one.txt"), "a", encoding="utf-8") as f:
+            f.write("[g3] New :: Card\n")
+        generate_anki_from_text.build_batch(paths, "generated_decks", workers=2)
+        self.assertEqual([entry["deck"] for entry in archive_store.ArchiveStore(os.path.join("generated_decks", "archive")).entries], ["one"])
+        built = sorted(f for f in os.listdir("generated_decks") if f.endswith(".apkg"))
+        self.assertEqual([f.split("_")[0] for f in built], ["one", "two"])
+
+    def test_existing_file_with_glob_characters_is_not_a_pattern(self):
+        """Test a cards file named like a glob pattern is used as a file."""
+        path = os.path.join("cards", "deck[v2].txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("[g1] Q :: A\n")
+        self.assertEqual(generate_anki_from_text.expand_input_paths(path), [path])
+        self.assertEqual(len(generate_anki_from_text.expand_input_paths(os.path.join("cards", "*.txt"))), 4)
+
+class TestNativeWriter(ApkgTestCase):
+    def _tables(self, apkg_path):
+        db_path = os.path.join(self.tmp.name, "collection.anki2")
+        with zipfile.ZipFile(apkg_path) as z:
+            self.assertEqual(sorted(z.namelist()), ["collection.anki2", "media"])
+            with open(db_path, 'wb') as f:
+                f.write(z.read("collection.anki2"))
+        conn = sqlite3.connect(db_path)
+        try:
+            tables = {
+                table: conn.execute(f"SELECT * FROM {table} ORDER BY 1").fetchall()
+                for table in ("col", "notes", "cards")
+            }
+            # Page numbers may differ, the definitions may not
+            tables["schema"] = conn.execute("SELECT type, name, tbl_name, sql FROM sqlite_master ORDER BY name").fetchall()
+            return tables
+        finally:
+            conn.close()
+            os.remove(db_path)
+
+    @patch('builtins.print')
+    def test_native_backend_matches_genanki(self, mock_print):
+        """Test the bulk writer produces the same tables as genanki.Package."""
+        cards = ["[g1] Q :: A", "Front :: Back :: Extra", "{{c1::One}} {{c2::Two}} :: Extra"]
+        deck = generate_anki_from_text.create_deck("Test Deck", cards)
+        expected_path = os.path.join(self.tmp.name, "genanki.apkg")
+        actual_path = os.path.join(self.tmp.name, "native.apkg")
+        
+        genanki.Package(deck).write_to_file(expected_path, timestamp=1700000000.0)
+        apkg_writer.write_deck_native(deck, actual_path, timestamp=1700000000.0)
+        
+        self.assertEqual(self._tables(actual_path), self._tables(expected_path))
+
 class TestDumpApkg(unittest.TestCase):
     @patch('dump_apkg.AnkiDeckUnpacker')
     @patch('dump_apkg.verify') # Mock verify to do nothing
@@ -226,5 +553,644 @@ class TestDumpApkg(unittest.TestCase):
         self.assertIn('src="media/image.jpg"', all_written_content)
         self.assertIn('data-guid="111"', all_written_content)
 
+    @patch('builtins.print')
+    def test_generate_html_pages(self, mock_print):
+        """Test HTML output is split into linked pages with an index and optional JSON data."""
+        notes = [(f"Q{i}\x1fA{i}", f"g{i}") for i in range(5)]
+        with tempfile.TemporaryDirectory() as output_dir:
+            dump_apkg._generate_html(iter(notes), output_dir, "deck.apkg", page_size=2, json_data=True)
+            self.assertEqual(sorted(os.listdir(output_dir)), [
+                "cards.json", "index.html", "page-00001.html", "page-00002.html", "page-00003.html", "viewer.html"])
+            
+            with open(os.path.join(output_dir, "index.html"), encoding="utf-8") as f:
+                index = f.read()
+            self.assertIn('<a href="page-00003.html">Cards 5&ndash;5</a>', index)
+            with open(os.path.join(output_dir, "page-00001.html"), encoding="utf-8") as f:
+                first = f.read()
+            self.assertIn('data-guid="g1"', first)
+            self.assertNotIn('data-guid="g2"', first)
+            self.assertIn('href="page-00002.html"', first)
+            with open(os.path.join(output_dir, "page-00003.html"), encoding="utf-8") as f:
+                self.assertNotIn('page-00004.html', f.read())
+            with open(os.path.join(output_dir, "cards.json"), encoding="utf-8") as f:
+                self.assertEqual([card["guid"] for card in json.load(f)], [guid for _, guid in notes])
+
+class TestDumpApkgEndToEnd(ApkgTestCase):
+    def setUp(self):
+        super().setUp()
+        self.output_dir = os.path.join(self.tmp.name, "out")
+
+    @patch('builtins.print')
+    def test_main_loads_collection_once(self, mock_print):
+        """Test dump plus verification decompresses the collection exactly once."""
+        make_apkg(self.apkg_path, [("Q\x1fA", "g1"), ("F\x1fB", "g2")], media={"a.png": b"png"})
+        before = anki_unpacker.stats['collection_loads']
+        with patch.object(sys, 'argv', ['dump_apkg.py', self.apkg_path, '--output_dir', self.output_dir]):
+            dump_apkg.main()
+        self.assertEqual(anki_unpacker.stats['collection_loads'] - before, 1)
+        
+        with open(os.path.join(self.output_dir, "cards.txt"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), "[g1] Q :: A\n[g2] F :: B")
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "media", "a.png")))
+        printed = " ".join(str(call) for call in mock_print.call_args_list)
+        self.assertIn("All GUIDs match", printed)
+
+    @patch('builtins.print')
+    def test_main_query_mode(self, mock_print):
+        """Test --guid/--grep print only the matching notes and export only their media."""
+        make_apkg(self.apkg_path, [('Q <img src="a.png">\x1fA', "g1"), ("F\x1fB [sound:b.mp3]", "g2"), ("Other\x1fC", "g3")],
+                  media={"a.png": b"png", "b.mp3": b"mp3", "c.jpg": b"jpg"})
+        argv = ['dump_apkg.py', self.apkg_path, '--output_dir', self.output_dir, '--guid', 'g1', '--grep', '^F', '--guid', 'nope']
+        with patch.object(sys, 'argv', argv):
+            dump_apkg.main()
+        
+        printed = [call[0][0] for call in mock_print.call_args_list]
+        self.assertIn('[g1] Q <img src="a.png"> :: A', printed)
+        self.assertIn("[g2] F :: B [sound:b.mp3]", printed)
+        self.assertIn("❌ GUID not found: nope", printed)
+        self.assertFalse(any("[g3]" in line for line in printed))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.output_dir, "media"))), ["a.png", "b.mp3"])
+        self.assertFalse(os.path.exists(os.path.join(self.output_dir, "cards.txt")))
+
+    def test_main_rejects_invalid_grep_pattern(self):
+        """Test an invalid --grep pattern is a usage error rather than a traceback."""
+        make_apkg(self.apkg_path, [("Q\x1fA", "g1")])
+        argv = ['dump_apkg.py', self.apkg_path, '--output_dir', self.output_dir, '--grep', '[unclosed']
+        with patch.object(sys, 'argv', argv), patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            with self.assertRaises(SystemExit) as cm:
+                dump_apkg.main()
+        self.assertEqual(cm.exception.code, 2)
+        self.assertIn("invalid --grep pattern", stderr.getvalue())
+        self.assertFalse(os.path.exists(self.output_dir))
+
+    @patch('builtins.print')
+    def test_batch_dump_into_subdirectories(self, mock_print):
+        """Test a directory of apkgs is dumped in a pool, one subdirectory per deck, with a combined index."""
+        decks_dir = os.path.join(self.tmp.name, "decks")
+        os.makedirs(decks_dir)
+        make_apkg(os.path.join(decks_dir, "a.apkg"), [("Q\x1fA", "g1")], media={"a.png": b"png"})
+        make_apkg(os.path.join(decks_dir, "b.apkg"), [("F\x1fB", "g2"), ("G\x1fC", "g3")], compressed=False)
+        with open(os.path.join(decks_dir, "broken.apkg"), 'wb') as f:
+            f.write(b"not a zip")
+        
+        failures = dump_apkg.dump_batch(dump_apkg.expand_apkg_paths(decks_dir), self.output_dir, workers=2,
+                                        media_mode='hardlink')
+        self.assertEqual([name for name, _ in failures], ["broken.apkg"])
+        with open(os.path.join(self.output_dir, "b", "cards.txt"), encoding="utf-8") as f:
+            self.assertEqual(f.read(), "[g2] F :: B\n[g3] G :: C")
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "a", "media", "a.png")))
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "a", "dump.log")))
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ["a", "b", "broken", "index.html"])
+        with open(os.path.join(self.output_dir, "index.html"), encoding="utf-8") as f:
+            index = f.read()
+        self.assertIn('<a href="a/index.html">a.apkg</a> (1 cards)', index)
+        self.assertIn('<a href="b/index.html">b.apkg</a> (2 cards)', index)
+        self.assertIn("broken.apkg (failed:", index)
+        self.assertEqual(dump_apkg._deck_dirs(["x.apkg", "x.apkg", "y"]), ["x", "x_2", "y"])
+        
+        # Batch dumps leave the collection cache alone
+        self.assertFalse(os.path.exists(self.cache_dir) and os.listdir(self.cache_dir))
+
+    def test_existing_apkg_with_glob_characters_is_not_a_pattern(self):
+        """Test an apkg named like a glob pattern is dumped as a single file."""
+        path = os.path.join(self.tmp.name, "x[1].apkg")
+        make_apkg(path, [("Q\x1fA", "g1")])
+        self.assertEqual(dump_apkg.expand_apkg_paths(path), [("x[1].apkg", path)])
+        with patch.object(sys, 'argv', ['dump_apkg.py', path, '--output_dir', self.output_dir]), patch('builtins.print'):
+            dump_apkg.main()
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, "cards.txt")))
+
+class TestAnkiDeckUnpacker(ApkgTestCase):
+    @patch('builtins.print')
+    def test_unpack_zstd_collection(self, mock_print):
+        """Test notes and media are read from a zstd (.anki21b) package."""
+        make_apkg(self.apkg_path, [("Q\x1fA", "g1")], media={"a.png": b"png"})
+        unpacker = AnkiDeckUnpacker(self.apkg_path)
+        try:
+            unpacker.unpack()
+            self.assertEqual(list(unpacker.get_notes()), [("Q\x1fA", "g1")])
+            media_dir = os.path.join(self.tmp.name, "media")
+            unpacker.export_media(media_dir)
+            self.assertEqual(os.listdir(media_dir), ["a.png"])
+        finally:
+            unpacker.close()
+
+    @patch('builtins.print')
+    def test_unpack_legacy_collection(self, mock_print):
+        """Test notes are read from a legacy (.anki2) package."""
+        make_apkg(self.apkg_path, [("Q\x1fA", "g1")], compressed=False)
+        unpacker = AnkiDeckUnpacker(self.apkg_path)
+        try:
+            unpacker.unpack()
+            self.assertEqual(list(unpacker.get_notes()), [("Q\x1fA", "g1")])
+        finally:
+            unpacker.close()
+
+    @patch('builtins.print')
+    def test_media_is_extracted_lazily(self, mock_print):
+        """Test unpack() leaves media in the archive until export_media() is called."""
+        make_apkg(self.apkg_path, [("<img src=\"a.png\">", "g1")], media={"a.png": b"png", "b.mp3": b"mp3"})
+        unpacker = AnkiDeckUnpacker(self.apkg_path)
+        try:
+            unpacker.unpack()
+            self.assertEqual(os.listdir(unpacker.temp_dir), [])
+            media_dir = os.path.join(self.tmp.name, "media")
+            unpacker.export_media(media_dir)
+            self.assertEqual(sorted(os.listdir(media_dir)), ["a.png", "b.mp3"])
+            with open(os.path.join(media_dir, "b.mp3"), 'rb') as f:
+                self.assertEqual(f.read(), b"mp3")
+        finally:
+            unpacker.close()
+
+    @patch('builtins.print')
+    def test_export_media_link_modes(self, mock_print):
+        """Test hardlink, reflink and copy modes give the same files as streaming."""
+        make_apkg(self.apkg_path, [("Q\x1fA", "g1")], media={"a.png": b"png", "b.mp3": b"mp3"})
+        with AnkiDeckUnpacker(self.apkg_path) as unpacker:
+            unpacker.unpack()
+            for mode in ('hardlink', 'reflink', 'copy'):
+                media_dir = os.path.join(self.tmp.name, mode)
+                unpacker.export_media(media_dir, mode=mode, workers=2)
+                self.assertEqual(sorted(os.listdir(media_dir)), ["a.png", "b.mp3"])
+                with open(os.path.join(media_dir, "a.png"), 'rb') as f:
+                    self.assertEqual(f.read(), b"png")
+            # Hardlinks share the temp copy's inode
+            self.assertEqual(os.stat(os.path.join(self.tmp.name, "hardlink", "a.png")).st_ino,
+                             os.stat(os.path.join(unpacker.media_dir, "a.png")).st_ino)
+            with self.assertRaises(ValueError):
+                unpacker.export_media(media_dir, mode='symlink')
+
+    @patch('builtins.print')
+    def test_pipelined_unpack_reads_mapped_and_deflated_members(self, mock_print):
+        """Test unpack(media_target=...) exports media in the background, from stored or deflated zips."""
+        notes = [("Q <img src=\"a.png\">\x1fA", "g1"), ("F\x1fB", "g2")]
+        make_apkg(self.apkg_path, notes, media={"a.png": b"png", "b.mp3": b"mp3"})
+        deflated_path = os.path.join(self.tmp.name, "deflated.apkg")
+        with zipfile.ZipFile(self.apkg_path) as src, zipfile.ZipFile(deflated_path, 'w', zipfile.ZIP_DEFLATED) as dst:
+            for info in src.infolist():
+                dst.writestr(info.filename, src.read(info))
+        
+        with anki_unpacker.MappedZip(self.apkg_path) as z:
+            with z.view(z.getinfo("0")) as data:
+                self.assertIsInstance(data, memoryview)
+                self.assertEqual(bytes(data), b"png")
+        
+        for path in (self.apkg_path, deflated_path):
+            media_dir = os.path.join(self.tmp.name, "media_" + os.path.basename(path))
+            with AnkiDeckUnpacker(path, cache=False) as unpacker:
+                unpacker.unpack(media_target=media_dir)
+                self.assertEqual(list(unpacker.get_notes()), notes)
+                self.assertEqual(unpacker.wait_for_media(), 2)
+            with open(os.path.join(media_dir, "b.mp3"), 'rb') as f:
+                self.assertEqual(f.read(), b"mp3")
+
+    @patch('builtins.print')
+    def test_small_collection_loads_in_memory(self, mock_print):
+        """Test a small collection is deserialized without writing a decompressed file."""
+        make_apkg(self.apkg_path, [("Q\x1fA", "g1")])
+        unpacker = AnkiDeckUnpacker(self.apkg_path)
+        try:
+            unpacker.unpack()
+            self.assertIsNone(unpacker.db_path)
+            self.assertEqual(list(unpacker.get_notes()), [("Q\x1fA", "g1")])
+        finally:
+            unpacker.close()
+
+    @patch('anki_unpacker.IN_MEMORY_MAX_BYTES', 1024)
+    @patch('builtins.print')
+    def test_large_collection_spills_to_disk(self, mock_print):
+        """Test a collection above the size threshold falls back to a file-backed database."""
+        make_apkg(self.apkg_path, [("Q\x1fA", "g1")])
+        unpacker = AnkiDeckUnpacker(self.apkg_path)
+        try:
+            unpacker.unpack()
+            self.assertTrue(os.path.exists(unpacker.db_path))
+            self.assertEqual(list(unpacker.get_notes()), [("Q\x1fA", "g1")])
+        finally:
+            unpacker.close()
+
+    @patch('builtins.print')
+    def test_get_notes_streams_projected_columns(self, mock_print):
+        """Test get_notes() is a batched iterator over only the requested columns."""
+        notes = [(f"Q{i}\x1fA{i}", f"g{i}") for i in range(25)]
+        make_apkg(self.apkg_path, notes)
+        with AnkiDeckUnpacker(self.apkg_path) as unpacker:
+            unpacker.unpack()
+            rows = unpacker.get_notes(columns=('guid',), batch_size=10)
+            self.assertNotIsInstance(rows, list)
+            self.assertEqual(list(rows), [(guid,) for _, guid in notes])
+            self.assertEqual(list(unpacker.get_notes(columns=('guid', 'mod')))[0], ("g0", 100))
+            with self.assertRaises(ValueError):
+                unpacker.get_notes(columns=('flds; DROP TABLE notes',))
+            temp_dir = unpacker.temp_dir
+        self.assertIsNone(unpacker.conn)
+        self.assertFalse(os.path.exists(temp_dir))
+
+    @patch('builtins.print')
+    def test_repeat_unpack_hits_cache(self, mock_print):
+        """Test a second unpack of an unchanged deck skips decompression."""
+        make_apkg(self.apkg_path, [("<img src=\"a.png\">", "g1")], media={"a.png": b"png"})
+        with AnkiDeckUnpacker(self.apkg_path) as unpacker:
+            unpacker.unpack()
+        
+        loads = anki_unpacker.stats['collection_loads']
+        hits = anki_unpacker.stats['cache_hits']
+        with AnkiDeckUnpacker(self.apkg_path) as unpacker:
+            unpacker.unpack()
+            self.assertEqual(list(unpacker.get_notes()), [("<img src=\"a.png\">", "g1")])
+            media_dir = os.path.join(self.tmp.name, "media")
+            unpacker.export_media(media_dir)
+            self.assertEqual(os.listdir(media_dir), ["a.png"])
+        self.assertEqual(anki_unpacker.stats['collection_loads'], loads)
+        self.assertEqual(anki_unpacker.stats['cache_hits'], hits + 1)
+        
+        # cache=False always decompresses
+        with AnkiDeckUnpacker(self.apkg_path, cache=False) as unpacker:
+            unpacker.unpack()
+        self.assertEqual(anki_unpacker.stats['collection_loads'], loads + 1)
+
+    @patch('builtins.print')
+    def test_apkg_without_collection_is_reported(self, mock_print):
+        """Test a package with no collection member raises a descriptive error, not a KeyError."""
+        with zipfile.ZipFile(self.apkg_path, 'w') as z:
+            z.writestr("media", b"{}")
+        with AnkiDeckUnpacker(self.apkg_path) as unpacker:
+            with self.assertRaisesRegex(FileNotFoundError, "Database not found"):
+                unpacker.unpack()
+
+    @patch('builtins.print')
+    def test_cache_entry_evicted_after_lookup_is_a_miss(self, mock_print):
+        """Test an entry removed between get() and connect() falls back to decompressing."""
+        make_apkg(self.apkg_path, [("Q\x1fA", "g1")])
+        cache = collection_cache.CollectionCache(os.path.join(self.tmp.name, "odd ?#% cache"))
+        with AnkiDeckUnpacker(self.apkg_path, cache=cache) as unpacker:
+            unpacker.unpack()
+        with AnkiDeckUnpacker(self.apkg_path, cache=cache) as unpacker:
+            unpacker.unpack()
+            self.assertEqual(list(unpacker.get_notes()), [("Q\x1fA", "g1")])
+        
+        get = cache.get
+        def get_then_evict(key):
+            entry = get(key)
+            os.remove(entry.db_path)
+            return entry
+        loads = anki_unpacker.stats['collection_loads']
+        with patch.object(cache, 'get', side_effect=get_then_evict), AnkiDeckUnpacker(self.apkg_path, cache=cache) as unpacker:
+            unpacker.unpack()
+            self.assertEqual(list(unpacker.get_notes()), [("Q\x1fA", "g1")])
+        self.assertEqual(anki_unpacker.stats['collection_loads'], loads + 1)
+
+    def test_cache_key_hashes_member_bytes(self):
+        """Test the key comes from the member bytes, the same through zipfile and the mapped reader."""
+        cache = collection_cache.CollectionCache(self.cache_dir)
+        keys = []
+        for content in (b"collection one", b"collection two"):
+            path = os.path.join(self.tmp.name, "deck.apkg")
+            with zipfile.ZipFile(path, 'w') as z:
+                z.writestr("collection.anki2", content)
+            with zipfile.ZipFile(path) as z:
+                keys.append(cache.key_for(z))
+            with anki_unpacker.MappedZip(path) as z:
+                self.assertEqual(cache.key_for(z), keys[-1])
+        self.assertNotEqual(keys[0], keys[1])
+
+    def test_cache_evicts_least_recently_used(self):
+        """Test the cache drops the oldest entries once it exceeds its size cap."""
+        cache = collection_cache.CollectionCache(self.cache_dir, max_bytes=1 << 30)
+        conn = sqlite3.connect(":memory:")
+        conn.execute("CREATE TABLE notes (flds text)")
+        for i, key in enumerate(("old", "new")):
+            cache.put(key, conn, {})
+            for path in cache._paths(key):
+                os.utime(path, (1000 + i, 1000 + i))
+        entry_size = sum(os.path.getsize(p) for p in cache._paths("new"))
+        
+        cache.max_bytes = entry_size
+        cache.evict()
+        self.assertIsNone(cache.get("old"))
+        self.assertIsNotNone(cache.get("new"))
+
+    @patch('builtins.print')
+    def test_find_notes_uses_guid_index(self, mock_print):
+        """Test GUID lookups go through the notes.guid index, fresh or from the cache."""
+        make_apkg(self.apkg_path, [(f"Q{i}\x1fA{i}", f"g{i}") for i in range(10)])
+        hits = anki_unpacker.stats['cache_hits']
+        for _ in range(2): # Decompressed, then served read-only from the cache
+            with AnkiDeckUnpacker(self.apkg_path) as unpacker:
+                unpacker.unpack()
+                self.assertEqual(unpacker.find_notes(["g7", "g2", "g7"]), [("Q7\x1fA7", "g7"), ("Q2\x1fA2", "g2")])
+                plan = " ".join(row[-1] for row in unpacker.conn.execute(
+                    "EXPLAIN QUERY PLAN SELECT flds FROM notes WHERE guid IN (?)", ("g1",)))
+                self.assertIn("ix_notes_guid", plan)
+                self.assertEqual(unpacker.find_notes(pattern=r"^Q[35]$", columns=('guid',)), [("g3",), ("g5",)])
+        self.assertEqual(anki_unpacker.stats['cache_hits'] - hits, 1)
+
+    def test_parse_protobuf_media(self):
+        """Test the protobuf media map decoder handles multi-byte varints and skips unknown fields."""
+        entry1 = b"\x0a\x05a.png" + b"\x10\x00" + b"\x1a\x03abc"
+        entry2 = b"\x1a\x01x" + b"\x10\xac\x02" + b"\x0a\x05\xff.jpg"
+        data = (b"\x0a" + bytes([len(entry1)]) + entry1
+                + b"\x10\x05" # Unknown top-level varint
+                + b"\x0a" + bytes([len(entry2)]) + entry2
+                + b"\x0a\x02\x10\x07") # Entry without a filename
+        self.assertEqual(anki_unpacker.parse_protobuf_media(data), {"0": "a.png", "300": "\ufffd.jpg"})
+        with self.assertRaises(IndexError):
+            anki_unpacker.parse_protobuf_media(b"\x0a\x80")
+
+    def test_stream_decompress_memory_is_bounded(self):
+        """Test peak memory of stream_decompress does not grow with the output size."""
+        chunk_size = 64 * 1024
+        peaks = []
+        for size in (4 << 20, 16 << 20):
+            src = io.BytesIO(zstandard.ZstdCompressor().compress(os.urandom(1024) * (size // 1024)))
+            with open(os.path.join(self.tmp.name, "out.bin"), 'wb') as dst:
+                tracemalloc.start()
+                written = anki_unpacker.stream_decompress(src, dst, chunk_size=chunk_size)
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                tracemalloc.stop()
+            self.assertEqual(written, size)
+        for peak in peaks:
+            self.assertLess(peak, 4 * chunk_size)
+
+class TestVerifyGuids(ApkgTestCase):
+    @patch('builtins.print')
+    def test_get_guids_from_apkg(self, mock_print):
+        """Test GUIDs map to front fields for both in-memory and file-backed loads."""
+        make_apkg(self.apkg_path, [("Q1\x1fA1", "g1"), ("Q2\x1fA2", "g2")])
+        for in_memory in (True, False):
+            guids = verify_guids.get_guids_from_apkg(self.apkg_path, in_memory=in_memory)
+            self.assertEqual(guids, {"g1": "Q1", "g2": "Q2"})
+
+class TestArchiveStore(ApkgTestCase):
+    def setUp(self):
+        super().setUp()
+        self.archive_dir = os.path.join(self.tmp.name, "archive")
+
+    def _deck_file(self, name, content):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+    def test_identical_builds_are_stored_once(self):
+        """Test archiving the same bytes twice adds index entries but a single blob."""
+        store = archive_store.ArchiveStore(self.archive_dir)
+        store.add([self._deck_file("deck_2025-01-01.apkg", b"same")])
+        store.add([self._deck_file("deck_2025-01-02.apkg", b"same"), self._deck_file("other_2025-01-02.apkg", b"new")])
+        
+        store = archive_store.ArchiveStore(self.archive_dir)
+        self.assertEqual([entry["deck"] for entry in store.entries], ["deck", "deck", "other"])
+        self.assertEqual(len(os.listdir(store.blobs_dir)), 2)
+        
+        restored = os.path.join(self.tmp.name, "restored.apkg")
+        store.pack()
+        store.restore(store.find("deck_2025-01-02.apkg"), restored)
+        with open(restored, 'rb') as f:
+            self.assertEqual(f.read(), b"same")
+
+    def test_loose_files_are_adopted(self):
+        """Test apkg files archived by older versions are moved in on request, not by opening the store."""
+        os.makedirs(self.archive_dir)
+        self._deck_file(os.path.join("archive", "deck_2025-01-01.apkg"), b"old")
+        store = archive_store.ArchiveStore(self.archive_dir)
+        self.assertEqual(store.entries, [])
+        self.assertEqual(os.listdir(self.archive_dir), ["deck_2025-01-01.apkg"])
+        
+        self.assertEqual([entry["name"] for entry in store.adopt_loose_files()], ["deck_2025-01-01.apkg"])
+        self.assertEqual(sorted(os.listdir(self.archive_dir)), ["blobs", "index.json"])
+        self.assertEqual(len(archive_store.ArchiveStore(self.archive_dir).entries), 1)
+
+    @patch('builtins.print')
+    def test_retention_by_count_age_and_size(self, mock_print):
+        """Test retention keeps the newest builds per deck and deletes unreferenced blobs."""
+        store = archive_store.ArchiveStore(self.archive_dir)
+        day = 86400
+        now = 100 * day
+        for i in range(4):
+            store._add(self._deck_file(f"deck_2025-01-0{i + 1}.apkg", b"x" * (i + 1) * 100), now - (4 - i) * day)
+        store._add(self._deck_file("other_2025-01-01.apkg", b"y" * 100), now - 10 * day)
+        store.save()
+        
+        names = lambda entries: sorted(entry["name"] for entry in entries)
+        self.assertEqual(names(store.select_expired(keep=2, now=now)),
+                         ["deck_2025-01-01.apkg", "deck_2025-01-02.apkg"])
+        self.assertEqual(names(store.select_expired(max_age_days=3.5, now=now)),
+                         ["deck_2025-01-01.apkg", "other_2025-01-01.apkg"])
+        self.assertEqual(names(store.select_expired(max_bytes=700, now=now)),
+                         ["deck_2025-01-01.apkg", "deck_2025-01-02.apkg", "other_2025-01-01.apkg"])
+        
+        removed = cleanup_archive.cleanup_archive(self.archive_dir, keep=1, assume_yes=True)
+        self.assertEqual(removed, 3)
+        store = archive_store.ArchiveStore(self.archive_dir)
+        self.assertEqual(names(store.entries), ["deck_2025-01-04.apkg", "other_2025-01-01.apkg"])
+        self.assertEqual(len(os.listdir(store.blobs_dir)), 2)
+
+class TestInstrumentation(ApkgTestCase):
+    def test_disabled_profiler_is_a_no_op(self):
+        """Test stages record nothing and share one no-op context while profiling is off."""
+        profiler = instrumentation.Profiler()
+        self.assertIs(profiler.stage("a"), profiler.stage("b"))
+        with profiler.stage("a"):
+            pass
+        self.assertEqual(profiler.records, [])
+
+    @patch('builtins.print')
+    def test_profile_records_nested_stages_and_trace(self, mock_print):
+        """Test --profile style runs record nested unpack stages and write a JSON trace."""
+        make_apkg(self.apkg_path, [("Q\x1fA", "g1")])
+        trace_path = os.path.join(self.tmp.name, "trace.json")
+        profiler = instrumentation.Profiler()
+        with patch.object(instrumentation, 'profiler', profiler):
+            profiler.enable(trace_path=trace_path)
+            with AnkiDeckUnpacker(self.apkg_path, cache=False) as unpacker:
+                unpacker.unpack()
+            profiler.finish()
+        
+        stages = [(record["name"], record["depth"]) for record in profiler.records]
+        self.assertEqual(stages[0], ("unpack", 0))
+        self.assertIn(("load_collection", 1), stages)
+        self.assertGreater(profiler.records[0]["seconds"], 0)
+        with open(trace_path, encoding="utf-8") as f:
+            events = json.load(f)["traceEvents"]
+        self.assertEqual([event["name"] for event in events], [name for name, _ in stages])
+
+class TestDaemon(ApkgTestCase):
+    def setUp(self):
+        super().setUp()
+        self.socket_path = os.path.join(self.tmp.name, "d.sock")
+        self.cards_path = os.path.join(self.tmp.name, "cards.txt")
+        self.output_dir = os.path.join(self.tmp.name, "generated_decks")
+        with open(self.cards_path, "w", encoding="utf-8") as f:
+            f.write("[g1] Q :: A\n[g2] F :: B\n")
+
+    @patch('builtins.print')
+    def test_client_falls_back_to_in_process(self, mock_print):
+        """Test the client runs the operation itself when no daemon is listening."""
+        response = anki_daemon.call(self.socket_path, 'build', {"input_path": self.cards_path, "output_dir": self.output_dir})
+        self.assertTrue(response["ok"])
+        self.assertTrue(os.path.exists(response["result"][0]))
+
+    @patch('builtins.print')
+    def test_build_of_a_directory_keeps_every_deck(self, mock_print):
+        """Test building a directory archives the old decks once, so every deck built stays in place."""
+        cards_dir = os.path.join(self.tmp.name, "cards")
+        os.makedirs(cards_dir)
+        for name in ("one", "two"):
+            with open(os.path.join(cards_dir, f"{name}.txt"), "w", encoding="utf-8") as f:
+                f.write(f"[{name}] Q :: A\n")
+        
+        response = anki_daemon.call(self.socket_path, 'build', {"input_path": cards_dir, "output_dir": self.output_dir})
+        self.assertTrue(response["ok"], response)
+        self.assertEqual(len(response["result"]), 2)
+        for path in response["result"]:
+            self.assertTrue(os.path.exists(path), path)
+        
+        # Unchanged sources are not reported as built
+        response = anki_daemon.call(self.socket_path, 'build', {"input_path": cards_dir, "output_dir": self.output_dir})
+        self.assertEqual(response["result"], [])
+
+    def test_daemon_serves_concurrent_requests(self):
+        """Test build and verify requests run in the daemon with their output returned per request."""
+        server = threading.Thread(target=anki_daemon.serve, args=(self.socket_path,))
+        with patch('builtins.print'):
+            server.start()
+            for _ in range(100):
+                if anki_daemon.ping(self.socket_path):
+                    break
+                time.sleep(0.05)
+        try:
+            self.assertEqual(os.stat(self.socket_path).st_mode & 0o077, 0)
+            self.assertIn('Deck', vars(sys.modules['genanki']))
+            response = anki_daemon.request(self.socket_path, 'build', {"input_path": self.cards_path, "output_dir": self.output_dir})
+            self.assertTrue(response["ok"], response)
+            apkg_path = response["result"][0]
+            self.assertIn("Deck exported", response["output"])
+            
+            responses = [None] * 4
+            def verify(i):
+                responses[i] = anki_daemon.request(self.socket_path, 'verify', {"txt_path": self.cards_path, "apkg_path": apkg_path})
+            threads = [threading.Thread(target=verify, args=(i,)) for i in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            for response in responses:
+                self.assertIs(response["result"], True)
+                self.assertEqual(response["output"].count("All GUIDs match"), 1)
+            
+            self.assertFalse(anki_daemon.request(self.socket_path, 'nope')["ok"])
+        finally:
+            anki_daemon.request(self.socket_path, 'shutdown')
+            server.join(5)
+        self.assertFalse(os.path.exists(self.socket_path))
+
+class TestLazyImports(unittest.TestCase):
+    def test_heavy_dependencies_load_on_use(self):
+        """Test importing the scripts does not load genanki, zstandard or the native writer."""
+        code = ("import sys, generate_anki_from_text, dump_apkg, diff_apkg, cleanup_archive\n"
+                "print(sorted(m for m in ('genanki.model', 'zstandard.backend_c', 'apkg_writer', 'logging') if m in sys.modules))\n"
+                "generate_anki_from_text.genanki.Deck\n"
+                "print('genanki.model' in sys.modules)")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.split("\n")[:2], ["[]", "True"])
+
+    def test_first_use_from_several_threads(self):
+        """Test threads that touch a lazy module at the same time all see it fully imported."""
+        code = ("import threading, anki_unpacker\n"
+                "errors = []\n"
+                "def use():\n"
+                "    try: anki_unpacker.zstandard.ZstdDecompressor\n"
+                "    except Exception as e: errors.append(e)\n"
+                "threads = [threading.Thread(target=use) for _ in range(8)]\n"
+                "[t.start() for t in threads]; [t.join() for t in threads]\n"
+                "print(errors)")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True)
+        self.assertEqual(result.stdout.strip(), "[]")
+
+class TestDiffApkg(ApkgTestCase):
+    @patch('builtins.print')
+    def test_diff_apkgs(self, mock_print):
+        """Test added, removed and changed notes are found by merge-joining on GUID."""
+        old_path = os.path.join(self.tmp.name, "old.apkg")
+        make_apkg(old_path, [("Q1\x1fA1", "g1"), ("Q2\x1fA2", "g2"), ("Q3\x1fA3", "g3"), ("Q4\x1fA4", "g4")])
+        make_apkg(self.apkg_path, [("Q0\x1fA0", "g0"), ("Q2\x1fA2 new", "g2"), ("Q1\x1fA1", "g1"), ("Q4\x1fA4", "g4")],
+                  compressed=False)
+        
+        counts = diff_apkg.diff_apkgs(old_path, self.apkg_path, verbose=True)
+        self.assertEqual(counts, {'added': 1, 'removed': 1, 'changed': 1})
+        printed = [call[0][0] for call in mock_print.call_args_list]
+        self.assertIn("➕ [g0]", printed)
+        self.assertIn("➖ [g3]", printed)
+        self.assertIn("    field 2: 'A2' -> 'A2 new'", printed)
+        
+        counts = diff_apkg.diff_apkgs(old_path, old_path)
+        self.assertEqual(counts, {'added': 0, 'removed': 0, 'changed': 0})
+
+class TestSearchIndex(ApkgTestCase):
+    @patch('builtins.print')
+    def test_index_updates_incrementally_and_searches_all_decks(self, mock_print):
+        """Test only new content is read and matches come from deck files and the archive."""
+        decks_dir = os.path.join(self.tmp.name, "decks")
+        os.makedirs(decks_dir)
+        old_path = os.path.join(decks_dir, "bio_2025-01-01.apkg")
+        make_apkg(old_path, [("Mitochondria\x1fPowerhouse of the cell", "g1")])
+        archive_store.ArchiveStore(os.path.join(decks_dir, "archive")).add([old_path])
+        make_apkg(os.path.join(decks_dir, "bio_2025-01-02.apkg"), [("Mitochondria\x1fPowerhouse, has DNA", "g1")])
+        make_apkg(os.path.join(decks_dir, "chem_2025-01-02.apkg"), [("Ribosome\x1fNo membrane", "g9")], compressed=False)
+        
+        index_path = os.path.join(self.tmp.name, "index.sqlite")
+        with search_index.SearchIndex(index_path) as index:
+            self.assertEqual(index.update(decks_dir), {'sources': 3, 'indexed': 3, 'removed': 0, 'failed': 0})
+            self.assertEqual(index.update(decks_dir), {'sources': 3, 'indexed': 0, 'removed': 0, 'failed': 0})
+            
+            hits = index.search("powerhouse")
+            self.assertEqual([(hit[1], hit[3]) for hit in hits],
+                             [("bio_2025-01-02.apkg", "g1"), ("bio_2025-01-01.apkg", "g1")])
+            self.assertEqual([hit[0] for hit in index.search("membrane")], ["chem"])
+            self.assertEqual(index.search("dna", deck="chem"), [])
+            self.assertEqual(len(index.search('"has DNA" OR ribo*', raw=True)), 2)
+            
+            os.remove(os.path.join(decks_dir, "chem_2025-01-02.apkg"))
+            self.assertEqual(index.update(decks_dir), {'sources': 2, 'indexed': 0, 'removed': 1, 'failed': 0})
+            self.assertEqual(index.search("membrane"), [])
+            self.assertEqual(index.conn.execute("SELECT COUNT(*) FROM notes").fetchone()[0], 2)
+
+    @patch('builtins.print')
+    def test_unreadable_apkg_is_reported_and_skipped(self, mock_print):
+        """Test one broken deck file does not stop the other decks from being indexed."""
+        decks_dir = os.path.join(self.tmp.name, "decks")
+        os.makedirs(decks_dir)
+        make_apkg(os.path.join(decks_dir, "bio_2025-01-02.apkg"), [("Mitochondria\x1fPowerhouse", "g1")])
+        with open(os.path.join(decks_dir, "broken_2025-01-02.apkg"), 'wb') as f:
+            f.write(b"not a zip")
+        
+        with search_index.SearchIndex(os.path.join(self.tmp.name, "index.sqlite")) as index:
+            self.assertEqual(index.update(decks_dir), {'sources': 1, 'indexed': 1, 'removed': 0, 'failed': 1})
+            self.assertEqual(len(index.search("powerhouse")), 1)
+        printed = [call[0][0] for call in mock_print.call_args_list]
+        self.assertTrue(any(line.startswith("❌ broken_2025-01-02.apkg:") for line in printed))
+
+    def test_other_database_is_not_replaced(self):
+        """Test a file that is not a search index is refused instead of deleted."""
+        index_path = os.path.join(self.tmp.name, "other.sqlite")
+        conn = sqlite3.connect(index_path)
+        conn.execute("CREATE TABLE notes (id INTEGER PRIMARY KEY)")
+        conn.commit()
+        conn.close()
+        with self.assertRaises(ValueError):
+            search_index.SearchIndex(index_path)
+        conn = sqlite3.connect(index_path)
+        self.assertEqual(conn.execute("SELECT name FROM sqlite_master").fetchall(), [("notes",)])
+        conn.close()
+        
+        text_path = os.path.join(self.tmp.name, "notes.txt")
+        with open(text_path, 'w') as f:
+            f.write("not a database, just long enough to have a header " * 4)
+        with self.assertRaises(ValueError):
+            search_index.SearchIndex(text_path)
+        self.assertTrue(os.path.exists(text_path))
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,71 +1,88 @@
 #!/usr/bin/env python3
 
-import sqlite3
-import zipfile
 import os
-import shutil
-import zstandard
-import io
-
-import tempfile
-
-def get_guids_from_apkg(apkg_path):
-    with tempfile.TemporaryDirectory() as temp_dir:
-        with zipfile.ZipFile(apkg_path, 'r') as z:
-            z.extractall(temp_dir)
-            
-        db_path = os.path.join(temp_dir, "collection.anki21b")
-        if not os.path.exists(db_path):
-            db_path = os.path.join(temp_dir, "collection.anki2")
-            
-        final_db_path = os.path.join(temp_dir, "collection.db")
-        
-        if db_path.endswith(".anki21b"):
-            with open(db_path, 'rb') as f:
-                data = f.read()
-                dctx = zstandard.ZstdDecompressor()
-                with dctx.stream_reader(io.BytesIO(data)) as reader:
-                    with open(final_db_path, 'wb') as out_f:
-                        shutil.copyfileobj(reader, out_f)
-        else:
-            shutil.copy(db_path, final_db_path)
-            
-        conn = sqlite3.connect(final_db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT guid, flds FROM notes")
-        
-        # Return a dict of {guid: front_field}
-        guids = {}
-        for row in cursor.fetchall():
-            guid = row[0]
-            flds = row[1]
-            front = flds.split('\x1f')[0]
-            guids[guid] = front
-            
-        conn.close()
-        return guids
-
-def verify(txt_path, apkg_path, verbose=False):
-    expected_cards = {} # {guid: front}
-    
-    with open(txt_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            # Use partition to find the first occurrence of '] '
-            if line.startswith('[') and '] ' in line:
-                part1, sep, part2 = line.partition('] ')
-                guid = part1[1:]
-                
-                # Extract Front content (everything before ' :: ')
-                if ' :: ' in part2:
-                    front = part2.split(' :: ')[0]
-                else:
-                    front = part2 # Fallback if no back field
-                    
-                expected_cards[guid] = front
+
+from anki_unpacker import AnkiDeckUnpacker, MappedZip, CAN_DESERIALIZE, load_collection
+from card_parser import parse_card_file
+from instrumentation import stage, profiler, add_profile_arguments, start_from_args
+
+def get_guids_from_apkg(apkg_path, in_memory=None, unpacker=None, cache=True):
+    """Returns {guid: front_field} for every note in the package.
+
+    Pass an already unpacked AnkiDeckUnpacker as unpacker to reuse its
+    collection instead of reading apkg_path again. cache is passed on to
+    AnkiDeckUnpacker.
+    """
+    if unpacker is not None:
+        return _front_by_guid(unpacker.get_notes(columns=('guid', 'flds')))
     
-    actual_cards = get_guids_from_apkg(apkg_path)
+    # Media is never needed here, so only the collection is loaded
+    with AnkiDeckUnpacker(apkg_path, in_memory=in_memory, cache=cache) as unpacker:
+        unpacker.unpack(media=False)
+        return _front_by_guid(unpacker.get_notes(columns=('guid', 'flds')))
+
+def _front_by_guid(notes):
+    guids = {}
+    for guid, flds in notes:
+        guids[guid] = flds.split('\x1f')[0]
+    return guids
+
+def read_guids_from_apkg(apkg_path):
+    """Returns the set of note GUIDs in an apkg.
+
+    A stored collection.anki2 member (what genanki and the native writer
+    produce) is copied from the mapped file into an in-memory database, with
+    no temp files and no media map. Other packages go through a full
+    AnkiDeckUnpacker load. Either way the whole collection is loaded, so
+    build_deck only calls this with check_output=True.
+    """
+    with MappedZip(apkg_path) as z:
+        names = set(z.namelist())
+        view = z.view(z.getinfo("collection.anki2")) if "collection.anki2" in names and CAN_DESERIALIZE else None
+        if view is not None and "collection.anki21b" not in names:
+            with view:
+                conn = load_collection(view, None, compressed=False, in_memory=True)
+            try:
+                return {guid for guid, in conn.execute("SELECT guid FROM notes")}
+            finally:
+                conn.close()
+        if view is not None:
+            view.release()
     
+    with AnkiDeckUnpacker(apkg_path, cache=False) as unpacker:
+        unpacker.unpack(media=False)
+        return {guid for guid, in unpacker.get_notes(columns=('guid',))}
+
+def expected_from_records(records):
+    """Returns {guid: front} for every CardRecord with an explicit GUID.
+
+    Invalid lines are included: the generator skips them, so they show up as
+    missing.
+    """
+    expected_cards = {}
+    for record in records:
+        if record.guid is not None:
+            expected_cards[record.guid] = record.fields[0]
+    return expected_cards
+
+def verify(txt_path, apkg_path, verbose=False, unpacker=None, cache=True):
+    with stage("verify"):
+        with stage("parse_source"):
+            expected_cards = expected_from_records(parse_card_file(txt_path).records)
+        with stage("read_guids"):
+            actual_cards = get_guids_from_apkg(apkg_path, unpacker=unpacker, cache=cache)
+        return compare_guids(expected_cards, actual_cards, txt_path, apkg_path, verbose)
+
+def verify_deck(records, deck_cards, source_label, deck_label, verbose=False):
+    """Verifies already parsed source records against a deck built in memory.
+
+    deck_cards is {guid: front} for the built notes, so nothing is re-read
+    from disk.
+    """
+    return compare_guids(expected_from_records(records), deck_cards, source_label, deck_label, verbose)
+
+def compare_guids(expected_cards, actual_cards, txt_path, apkg_path, verbose=False):
+    """Prints how {guid: front} from the source and the deck differ. Returns True if they match."""
     expected_guids = set(expected_cards.keys())
     actual_guids = set(actual_cards.keys())
     
@@ -97,6 +114,8 @@ def verify(txt_path, apkg_path, verbose=False):
             #     for guid in unexpected:
             #         print(f"❌ {guid}")
 
+    return not missing and not unexpected
+
 import argparse
 import sys
 
@@ -105,8 +124,11 @@ if __name__ == "__main__":
     parser.add_argument('txt_path', help='Path to the source text file (e.g., cards.txt)')
     parser.add_argument('apkg_path', help='Path to the generated .apkg file')
     parser.add_argument('-v', '--verbose', action='store_true', help='Print detailed card content for mismatches')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the decompressed collection cache')
+    add_profile_arguments(parser)
     
     args = parser.parse_args()
+    start_from_args(args)
     
     if not os.path.exists(args.txt_path):
         print(f"Error: Text file not found: {args.txt_path}")
@@ -116,4 +138,5 @@ if __name__ == "__main__":
         print(f"Error: APKG file not found: {args.apkg_path}")
         sys.exit(1)
         
-    verify(args.txt_path, args.apkg_path, args.verbose)
+    verify(args.txt_path, args.apkg_path, args.verbose, cache=not args.no_cache)
+    profiler.finish()